@@ -8,8 +8,12 @@ import gzip
 import logging
 import os
 import os.path
+import shutil
+import subprocess
+import sys
 
-from tools.sized_pickle import store_sized_pickle
+from tools.process_util import identify_program_dir
+from tools.sized_pickle import store_sized_pickle, retrieve_sized_pickle
 from tools.data_definitions import create_timestamp, \
         parse_timedelta_str, \
         segment_status_final, \
@@ -26,8 +30,26 @@ from anti_entropy.anti_entropy_util import anti_entropy_dir, \
         compute_data_repair_file_path
 
 from anti_entropy.cluster_inspector.work_generator import generate_work
+from anti_entropy.cluster_inspector.segment_spill import sample_unified_ids
+from anti_entropy.cluster_inspector.util import compute_shard_file_path, \
+        compute_audit_counts_path
+
+class SegmentAuditorError(Exception):
+    pass
 
 _min_segment_age = os.environ.get("NIMBUSIO_MIN_ANTI_ENTROPY_AGE", "days=1")
+_audit_shard_count = int(
+    os.environ.get("NIMBUSIO_CLUSTER_INSPECTOR_AUDIT_SHARDS", "4")
+)
+_samples_per_shard = 16
+_polling_interval = 1.0
+_node_names = os.environ["NIMBUSIO_NODE_NAME_SEQ"].split()
+_count_keys = ["total",
+               anti_entropy_missing_replicas,
+               anti_entropy_incomplete_finalization,
+               anti_entropy_damaged_records,
+               anti_entropy_missing_tombstones,
+               anti_entropy_database_inconsistancy]
 
 def _row_key(row):
     return (row["unified_id"], row["conjoined_part"], )
@@ -136,29 +158,26 @@ def _database_inconsistancy(row_key, segment_data):
 
     return False
 
-def audit_segments(halt_event, work_dir):
-    log = logging.getLogger("audit_segments")
+def audit_segment_range(halt_event, 
+                        work_dir, 
+                        low_unified_id, 
+                        high_unified_id,
+                        meta_repair_file_path,
+                        data_repair_file_path):
+    """
+    audit the segments with low_unified_id <= unified_id < high_unified_id
+    (None for no limit), writing the repair files to the paths given
 
-    if not os.path.exists(anti_entropy_dir):
-        log.info("creating {0}".format(anti_entropy_dir))
-        os.mkdir(anti_entropy_dir)
+    return a dict of counts
+    """
+    log = logging.getLogger("audit_segment_range")
 
-    meta_repair_file_path = compute_meta_repair_file_path()
     meta_repair_file = \
             gzip.GzipFile(filename=meta_repair_file_path, mode="wb")
-
-    data_repair_file_path = compute_data_repair_file_path()
     data_repair_file = \
             gzip.GzipFile(filename=data_repair_file_path, mode="wb")
 
-    counts = {
-        "total"                                 : 0,
-        anti_entropy_missing_replicas           : 0,
-        anti_entropy_incomplete_finalization    : 0,
-        anti_entropy_damaged_records            : 0,
-        anti_entropy_missing_tombstones         : 0,
-        anti_entropy_database_inconsistancy     : 0,
-    }
+    counts = dict([(key, 0, ) for key in _count_keys])
 
     current_time = create_timestamp()
     min_segment_age = parse_timedelta_str(_min_segment_age) 
@@ -166,10 +185,11 @@ def audit_segments(halt_event, work_dir):
     log.info("newest allowable timestamp = {0}".format(
         newest_allowable_timestamp.isoformat()))
 
-    for row_key, segment_status, segment_data in generate_work(work_dir):
+    for row_key, segment_status, segment_data in \
+        generate_work(work_dir, low_unified_id, high_unified_id):
         if halt_event.is_set():
             log.info("halt_event is set: exiting")
-            return
+            break
 
         assert segment_status == anti_entropy_pre_audit
 
@@ -214,20 +234,151 @@ def audit_segments(halt_event, work_dir):
             log.debug("database_inconsistancy {0}".format(row_key))
             counts[anti_entropy_database_inconsistancy] += 1
             store_sized_pickle(
-                (row_key, anti_entropy_database_inconsistency, segment_data,), 
+                (row_key, anti_entropy_database_inconsistancy, segment_data,), 
                 data_repair_file)
             continue
 
     meta_repair_file.close()
     data_repair_file.close()
 
-    keys = ["total",
-            anti_entropy_missing_replicas,
-            anti_entropy_incomplete_finalization,
-            anti_entropy_damaged_records,
-            anti_entropy_missing_tombstones,
-            anti_entropy_database_inconsistancy]
+    return counts
+
+def _compute_shard_boundaries(work_dir, shard_count):
+    """
+    return a list of (low_unified_id, high_unified_id) covering all 
+    unified_ids, split at evenly spaced samples of the spilled rows
+    """
+    samples = list()
+    for node_name in _node_names:
+        samples.extend(sample_unified_ids(work_dir, 
+                                          node_name, 
+                                          shard_count * _samples_per_shard))
+    samples.sort()
+
+    split_points = list()
+    for index in range(1, shard_count):
+        if len(samples) == 0:
+            break
+        split_point = samples[(index * len(samples)) // shard_count]
+        if len(split_points) == 0 or split_point > split_points[-1]:
+            split_points.append(split_point)
+
+    lows = [None] + split_points
+    highs = split_points + [None]
+    return list(zip(lows, highs))
+
+def _start_shard_subprocess(work_dir, shard_index, low_unified_id, 
+                            high_unified_id):
+    anti_entropy_dir = identify_program_dir("anti_entropy")
+    auditor_path = os.path.join(anti_entropy_dir,
+                                "cluster_inspector",
+                                "segment_auditor_subprocess.py")
+    args = [sys.executable, 
+            auditor_path, 
+            work_dir, 
+            str(shard_index), 
+            str(low_unified_id), 
+            str(high_unified_id), ]
+    process = subprocess.Popen(args, stderr=subprocess.PIPE)
+    assert process is not None
+    return process
+
+def _wait_for_shards(halt_event, processes):
+    log = logging.getLogger("_wait_for_shards")
+    while not halt_event.is_set():
+        running_count = 0
+        for shard_index, process in enumerate(processes):
+            process.poll()
+            if process.returncode is None: # still running
+                running_count += 1
+                continue
+            if process.returncode != 0:
+                error = process.stderr.read()
+                error_message = "audit shard {0} failed {1} {2}".format(
+                    shard_index, process.returncode, error)
+                log.error(error_message)
+                raise SegmentAuditorError(error_message)
+        if running_count == 0:
+            return
+        halt_event.wait(_polling_interval)
+
+    for process in processes:
+        if process.returncode is None:
+            process.terminate()
+            process.wait()
+
+def _concatenate_shard_files(path, shard_count):
+    """
+    concatenate the shard files, in order, into path.
+    gzip files can be concatenated: they read back as a single stream
+    """
+    with open(path, "wb") as output_file:
+        for shard_index in range(shard_count):
+            shard_path = compute_shard_file_path(path, shard_index)
+            with open(shard_path, "rb") as input_file:
+                shutil.copyfileobj(input_file, output_file)
+            os.unlink(shard_path)
+
+def _audit_shards(halt_event, work_dir, shard_boundaries):
+    """
+    audit each unified_id range in its own subprocess, then put together
+    the repair files and counts
+    """
+    log = logging.getLogger("_audit_shards")
+    processes = list()
+    for shard_index, (low_unified_id, high_unified_id, ) in \
+        enumerate(shard_boundaries):
+        log.info("starting shard {0}: unified_id {1} to {2}".format(
+            shard_index, low_unified_id, high_unified_id))
+        processes.append(_start_shard_subprocess(work_dir, 
+                                                 shard_index, 
+                                                 low_unified_id, 
+                                                 high_unified_id))
+
+    _wait_for_shards(halt_event, processes)
+    if halt_event.is_set():
+        return None
+
+    for path in [compute_meta_repair_file_path(), 
+                 compute_data_repair_file_path(), ]:
+        _concatenate_shard_files(path, len(shard_boundaries))
+
+    counts = dict([(key, 0, ) for key in _count_keys])
+    for shard_index in range(len(shard_boundaries)):
+        with open(compute_audit_counts_path(work_dir, shard_index), "rb") \
+        as counts_file:
+            shard_counts = retrieve_sized_pickle(counts_file)
+        for key in _count_keys:
+            counts[key] += shard_counts[key]
+
+    return counts
+
+def audit_segments(halt_event, work_dir):
+    log = logging.getLogger("audit_segments")
+
+    if not os.path.exists(anti_entropy_dir):
+        log.info("creating {0}".format(anti_entropy_dir))
+        os.mkdir(anti_entropy_dir)
 
-    for key in keys:
+    shard_boundaries = list()
+    if _audit_shard_count > 1:
+        shard_boundaries = _compute_shard_boundaries(work_dir, 
+                                                     _audit_shard_count)
+
+    if len(shard_boundaries) > 1:
+        counts = _audit_shards(halt_event, work_dir, shard_boundaries)
+    else:
+        counts = audit_segment_range(halt_event, 
+                                     work_dir, 
+                                     None, 
+                                     None,
+                                     compute_meta_repair_file_path(),
+                                     compute_data_repair_file_path())
+
+    if counts is None:
+        log.info("halt_event is set: exiting")
+        return
+
+    for key in _count_keys:
         log.info("{0} {1:,}".format(key, counts[key]))
 
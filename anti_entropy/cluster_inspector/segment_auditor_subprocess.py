@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+segment_auditor_subprocess.py
+  
+a subprocess run by cluster_inspector to audit one unified_id range 
+(shard) of the segments pulled from the nodes
+"""
+import logging
+import os
+import sys
+from threading import Event
+
+from tools.standard_logging import initialize_logging 
+from tools.process_util import set_signal_handler
+from tools.sized_pickle import store_sized_pickle
+
+from anti_entropy.anti_entropy_util import compute_meta_repair_file_path, \
+        compute_data_repair_file_path
+
+from anti_entropy.cluster_inspector.segment_auditor import \
+        audit_segment_range
+from anti_entropy.cluster_inspector.util import compute_shard_file_path, \
+        compute_audit_counts_path
+
+_local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
+
+def _parse_unified_id(unified_id_str):
+    return (None if unified_id_str == "None" else int(unified_id_str))
+
+def main():
+    """
+    main entry point
+    """
+    [work_dir, shard_index_str, low_unified_id_str, high_unified_id_str, ] = \
+        sys.argv[1:]
+    shard_index = int(shard_index_str)
+    low_unified_id = _parse_unified_id(low_unified_id_str)
+    high_unified_id = _parse_unified_id(high_unified_id_str)
+
+    log_path = "{0}/nimbusio_segment_auditor_{1}_{2:03}.log".format(
+        os.environ["NIMBUSIO_LOG_DIR"], _local_node_name, shard_index)
+    initialize_logging(log_path)
+    log = logging.getLogger("main")
+
+    log.info("program starts: work_dir={0}, shard {1}, {2} to {3}".format(
+        work_dir, shard_index, low_unified_id, high_unified_id))
+
+    halt_event = Event()
+    set_signal_handler(halt_event)
+
+    try:
+        counts = audit_segment_range(
+            halt_event,
+            work_dir,
+            low_unified_id,
+            high_unified_id,
+            compute_shard_file_path(compute_meta_repair_file_path(), 
+                                    shard_index),
+            compute_shard_file_path(compute_data_repair_file_path(), 
+                                    shard_index)
+        )
+        with open(compute_audit_counts_path(work_dir, shard_index), "wb") \
+        as counts_file:
+            store_sized_pickle(counts, counts_file)
+    except Exception as instance:
+        log.exception("audit_segment_range failed {0}".format(instance))
+        return -2
+
+    log.info("program terminates normally")
+    return 0
+    
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,8 +18,9 @@ from tools.database_connection import get_node_connection
 from tools.data_definitions import segment_row_template
 from tools.sized_pickle import store_sized_pickle
 
-from anti_entropy.cluster_inspector.util import compute_segment_file_path, \
+from anti_entropy.cluster_inspector.util import \
         compute_damaged_segment_file_path
+from anti_entropy.cluster_inspector.segment_spill import SegmentSpillWriter
 
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
 _node_names = os.environ["NIMBUSIO_NODE_NAME_SEQ"].split()
@@ -34,7 +35,7 @@ _damaged_segment_template = namedtuple("DamagedSegment", [
                                                   
 def _pull_segment_data(connection, work_dir, node_name):
     """
-    write out a dict for eqch segment_sequence
+    spill the segment rows (and handoff rows) for the node
     """
     log = logging.getLogger("_pull_segment_data")
     result_generator = connection.generate_all_rows("""
@@ -43,27 +44,17 @@ def _pull_segment_data(connection, work_dir, node_name):
         order by unified_id, conjoined_part, handoff_node_id nulls last
     """.format(",".join(segment_row_template._fields), []))
 
-    segment_row_count = 0
-
-    segment_file_path = compute_segment_file_path(work_dir, node_name)
-    segment_file = gzip.GzipFile(filename=segment_file_path, mode="wb")
-    handoff_rows = list()
+    spill_writer = SegmentSpillWriter(work_dir, node_name)
     for result in result_generator:
         segment_row = segment_row_template._make(result)
         if segment_row.file_hash is not None:
             segment_row = segment_row._replace(
                 file_hash=bytes(segment_row.file_hash))
-        if segment_row.handoff_node_id is not None:
-            handoff_rows.append(segment_row._asdict())
-            continue
-        segment_dict = segment_row._asdict()
-        segment_dict["handoff_rows"] = handoff_rows 
-        store_sized_pickle(segment_dict, segment_file)
-        segment_row_count += 1 
-        handoff_rows = list()
-    segment_file.close()
-
-    log.info("stored {0} segment rows".format(segment_row_count))
+        spill_writer.add(segment_row)
+    spill_writer.close()
+
+    log.info("stored {0} segment rows, {1} handoff rows".format(
+        spill_writer.segment_row_count, spill_writer.handoff_row_count))
 
 def _damaged_segment_generator(connection):
     result_generator = connection.generate_all_rows("""
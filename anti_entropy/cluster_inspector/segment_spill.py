@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+segment_spill.py
+
+a compact spill format for the segment rows cluster_inspector pulls from
+each node, in place of a gzipped stream of pickled dicts.
+
+Each node's rows are spilled to three files:
+
+    segment-<node>.records   fixed width struct records for the segment
+                             rows, sorted by (unified_id, conjoined_part)
+    segment-<node>.handoffs  the same, for the node's handoff rows
+    segment-<node>.heap      the variable length values (key, file_hash),
+                             referenced by (offset, length) from the records
+
+Because the records are fixed width and sorted, a reader can binary search
+to the start of a unified_id range, so the audit can be split into shards.
+"""
+from datetime import datetime, timedelta
+import mmap
+import os
+import struct
+
+from anti_entropy.cluster_inspector.util import \
+        compute_segment_spill_file_paths
+
+# unified_id and conjoined_part come first, so we can binary search on them
+_record_format = "!qiqicBqiqiqiiqIqI"
+_record_struct = struct.Struct(_record_format)
+_record_size = _record_struct.size
+_key_struct = struct.Struct("!qi")
+
+# bits in the null flags byte, for the nullable columns
+_null_bits = [("file_size",                   0x01),
+              ("file_adler32",                0x02),
+              ("file_hash",                   0x04),
+              ("file_tombstone_unified_id",   0x08),
+              ("segment_num",                 0x10),
+              ("handoff_node_id",             0x20),
+              ("key",                         0x40), ]
+
+_epoch = datetime(1970, 1, 1)
+_microsecond = timedelta(microseconds=1)
+
+def _zero_if_none(value):
+    return (0 if value is None else value)
+
+class _SpillFileWriter(object):
+    """
+    write the records for one kind of row, with their strings in a
+    shared heap
+    """
+    def __init__(self, path, heap):
+        self._file = open(path, "wb")
+        self._heap = heap
+
+    def write(self, segment_row):
+        null_flags = 0
+        for name, bit in _null_bits:
+            if getattr(segment_row, name) is None:
+                null_flags |= bit
+
+        key_bytes = (segment_row.key or "").encode("utf-8")
+        key_offset = self._heap.tell()
+        self._heap.write(key_bytes)
+        file_hash = segment_row.file_hash or b""
+        hash_offset = self._heap.tell()
+        self._heap.write(file_hash)
+
+        self._file.write(_record_struct.pack(
+            segment_row.unified_id,
+            segment_row.conjoined_part,
+            segment_row.id,
+            segment_row.collection_id,
+            segment_row.status.encode("ascii"),
+            null_flags,
+            (segment_row.timestamp - _epoch) // _microsecond,
+            _zero_if_none(segment_row.segment_num),
+            _zero_if_none(segment_row.file_size),
+            _zero_if_none(segment_row.file_adler32),
+            _zero_if_none(segment_row.file_tombstone_unified_id),
+            segment_row.source_node_id,
+            _zero_if_none(segment_row.handoff_node_id),
+            key_offset,
+            len(key_bytes),
+            hash_offset,
+            len(file_hash)))
+
+    def close(self):
+        self._file.close()
+
+class SegmentSpillWriter(object):
+    """
+    spill segment rows (segment_row_template, with file_hash as bytes) for
+    one node. Rows must be added in (unified_id, conjoined_part) order.
+    """
+    def __init__(self, work_dir, node_name):
+        records_path, handoffs_path, heap_path = \
+            compute_segment_spill_file_paths(work_dir, node_name)
+        self._heap = open(heap_path, "wb")
+        self._records = _SpillFileWriter(records_path, self._heap)
+        self._handoffs = _SpillFileWriter(handoffs_path, self._heap)
+        self.segment_row_count = 0
+        self.handoff_row_count = 0
+
+    def add(self, segment_row):
+        if segment_row.handoff_node_id is None:
+            self._records.write(segment_row)
+            self.segment_row_count += 1
+        else:
+            self._handoffs.write(segment_row)
+            self.handoff_row_count += 1
+
+    def close(self):
+        self._records.close()
+        self._handoffs.close()
+        self._heap.close()
+
+def _map_file(path):
+    """
+    return a read only mmap of the file, or None if it is empty
+    (mmap will not map an empty file)
+    """
+    if os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as input_file:
+        return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _first_index(records, record_count, low_unified_id):
+    """
+    binary search for the first record with unified_id >= low_unified_id
+    """
+    low_index = 0
+    high_index = record_count
+    while low_index < high_index:
+        index = (low_index + high_index) // 2
+        (unified_id, _, ) = _key_struct.unpack_from(records,
+                                                    index * _record_size)
+        if unified_id < low_unified_id:
+            low_index = index + 1
+        else:
+            high_index = index
+    return low_index
+
+def _generate_records(records, heap, low_unified_id, high_unified_id):
+    """
+    yield segment row dicts from the records with
+    low_unified_id <= unified_id < high_unified_id (None for no limit)
+    """
+    if records is None:
+        return
+
+    record_count = len(records) // _record_size
+    index = 0
+    if low_unified_id is not None:
+        index = _first_index(records, record_count, low_unified_id)
+
+    while index < record_count:
+        (unified_id,
+         conjoined_part,
+         row_id,
+         collection_id,
+         status,
+         null_flags,
+         timestamp,
+         segment_num,
+         file_size,
+         file_adler32,
+         file_tombstone_unified_id,
+         source_node_id,
+         handoff_node_id,
+         key_offset,
+         key_length,
+         hash_offset,
+         hash_length, ) = \
+            _record_struct.unpack_from(records, index * _record_size)
+        index += 1
+
+        if high_unified_id is not None and unified_id >= high_unified_id:
+            return
+
+        segment_dict = {
+            "id"                        : row_id,
+            "collection_id"             : collection_id,
+            "key"                       : heap[key_offset:
+                                               key_offset+key_length].decode(
+                                                   "utf-8"),
+            "status"                    : status.decode("ascii"),
+            "unified_id"                : unified_id,
+            "timestamp"                 : _epoch + (timestamp * _microsecond),
+            "segment_num"               : segment_num,
+            "conjoined_part"            : conjoined_part,
+            "file_size"                 : file_size,
+            "file_adler32"              : file_adler32,
+            "file_hash"                 : heap[hash_offset:
+                                               hash_offset+hash_length],
+            "file_tombstone_unified_id" : file_tombstone_unified_id,
+            "source_node_id"            : source_node_id,
+            "handoff_node_id"           : handoff_node_id,
+        }
+        for name, bit in _null_bits:
+            if null_flags & bit:
+                segment_dict[name] = None
+
+        yield segment_dict
+
+def _row_key(row):
+    return (row["unified_id"], row["conjoined_part"], )
+
+def generate_spilled_segment_rows(work_dir,
+                                  node_name,
+                                  low_unified_id=None,
+                                  high_unified_id=None):
+    """
+    yield the segment rows spilled for node_name, as dicts, in
+    (unified_id, conjoined_part) order, with
+    low_unified_id <= unified_id < high_unified_id (None for no limit).
+
+    Each dict has the columns of segment_row_template, plus "handoff_rows":
+    a list of dicts for the node's handoff rows with the same
+    (unified_id, conjoined_part)
+    """
+    records_path, handoffs_path, heap_path = \
+        compute_segment_spill_file_paths(work_dir, node_name)
+    records = _map_file(records_path)
+    handoffs = _map_file(handoffs_path)
+    heap = _map_file(heap_path)
+    heap_data = (b"" if heap is None else heap)
+
+    handoff_generator = _generate_records(handoffs,
+                                          heap_data,
+                                          low_unified_id,
+                                          high_unified_id)
+    handoff_dict = next(handoff_generator, None)
+
+    try:
+        for segment_dict in _generate_records(records,
+                                               heap_data,
+                                               low_unified_id,
+                                               high_unified_id):
+            row_key = _row_key(segment_dict)
+            while handoff_dict is not None and _row_key(handoff_dict) < row_key:
+                handoff_dict = next(handoff_generator, None)
+            segment_dict["handoff_rows"] = list()
+            while handoff_dict is not None and \
+                  _row_key(handoff_dict) == row_key:
+                segment_dict["handoff_rows"].append(handoff_dict)
+                handoff_dict = next(handoff_generator, None)
+            yield segment_dict
+    finally:
+        handoff_generator.close()
+        for mapped_file in [records, handoffs, heap, ]:
+            if mapped_file is not None:
+                mapped_file.close()
+
+def sample_unified_ids(work_dir, node_name, sample_count):
+    """
+    return up to sample_count unified_ids, evenly spaced through the
+    spilled segment rows for node_name
+    """
+    records_path, _, _ = compute_segment_spill_file_paths(work_dir, node_name)
+    records = _map_file(records_path)
+    if records is None:
+        return list()
+
+    try:
+        record_count = len(records) // _record_size
+        step = max(record_count // sample_count, 1)
+        samples = list()
+        for index in range(0, record_count, step):
+            (unified_id, _, ) = _key_struct.unpack_from(records,
+                                                        index * _record_size)
+            samples.append(unified_id)
+        return samples
+    finally:
+        records.close()
+
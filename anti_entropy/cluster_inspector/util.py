@@ -6,11 +6,22 @@ utility routines shared wiht subprocesses
 """
 import os.path
 
-def compute_segment_file_path(work_dir, node_name):
-    segment_file_name = "segment-{0}.gzip".format(node_name)
-    return os.path.join(work_dir, segment_file_name)
+def compute_segment_spill_file_paths(work_dir, node_name):
+    """
+    return the paths of the records, handoffs and heap files for the
+    segment rows spilled from node_name
+    """
+    return [os.path.join(work_dir, "segment-{0}.{1}".format(node_name, suffix))
+            for suffix in ["records", "handoffs", "heap", ]]
 
 def compute_damaged_segment_file_path(work_dir, node_name):
     segment_file_name = "damaged-segment-{0}.gzip".format(node_name)
     return os.path.join(work_dir, segment_file_name)
 
+
+def compute_shard_file_path(path, shard_index):
+    return "{0}.shard-{1:03}".format(path, shard_index)
+
+def compute_audit_counts_path(work_dir, shard_index):
+    counts_file_name = "audit-counts-{0:03}".format(shard_index)
+    return os.path.join(work_dir, counts_file_name)
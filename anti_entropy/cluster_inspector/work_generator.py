@@ -5,20 +5,19 @@ work_generator.py
 generate work packets from segment files retrieved by pullers
 """
 import gzip
+import heapq
+import itertools
 import os
 import logging
 
-from tools.data_definitions import segment_row_template
-from tools.database_connection import get_central_connection
 from tools.sized_pickle import retrieve_sized_pickle
 
-from web_public_reader.central_database_util import get_cluster_row, \
-        get_node_rows
-
 from anti_entropy.anti_entropy_util import anti_entropy_pre_audit
 
-from anti_entropy.cluster_inspector.util import compute_segment_file_path, \
+from anti_entropy.cluster_inspector.util import \
         compute_damaged_segment_file_path
+from anti_entropy.cluster_inspector.segment_spill import \
+        generate_spilled_segment_rows
 
 def _row_key(row):
     return (row["unified_id"], row["conjoined_part"], )
@@ -32,96 +31,102 @@ def _row_key_check(segment_data):
             row_key_set.add(_row_key(entry["segment-row"]))
     assert len(row_key_set) == 1, str(row_key_set)
 
-class NodeRowGenerator(object):
-    """
-    generate segment row information for one node
-    """
-    def __init__(self, work_dir, node_name):
-        path = compute_segment_file_path(work_dir, node_name)
-        self._segment_file = gzip.GzipFile(filename=path, mode="rb")
-        path = compute_damaged_segment_file_path(work_dir, node_name)
-        self._damaged_file = gzip.GzipFile(filename=path, mode="rb")
-        self.segment_dict = None
-        try:
-            self._damaged_dict = retrieve_sized_pickle(self._damaged_file)
-        except EOFError:
-            self._damaged_dict = None
-        self.advance()
-
-    def advance(self):
-        try:
-            self.segment_dict = retrieve_sized_pickle(self._segment_file)
-        except EOFError:
-            self.segment_dict = None
-            self._segment_file.close()
-            self._segment_file = None
-            return
-
-        segment_row_key = _row_key(self.segment_dict)
-
-        while self._damaged_dict is not None and \
-              segment_row_key > _row_key(self._damaged_dict):
+def _generate_damaged_dicts(work_dir, node_name):
+    path = compute_damaged_segment_file_path(work_dir, node_name)
+    damaged_file = gzip.GzipFile(filename=path, mode="rb")
+    try:
+        while True:
             try:
-                self._damaged_dict = retrieve_sized_pickle(self._damaged_file)
+                yield retrieve_sized_pickle(damaged_file)
             except EOFError:
-                self._damaged_dict = None
+                return
+    finally:
+        damaged_file.close()
+
+def _generate_node_rows(work_dir, 
+                        node_name, 
+                        low_unified_id, 
+                        high_unified_id):
+    """
+    generate segment row information for one node, with the damaged 
+    sequence numbers for each row
+    """
+    damaged_generator = _generate_damaged_dicts(work_dir, node_name)
+    damaged_dict = next(damaged_generator, None)
+
+    for segment_dict in generate_spilled_segment_rows(work_dir, 
+                                                      node_name,
+                                                      low_unified_id,
+                                                      high_unified_id):
+        segment_row_key = _row_key(segment_dict)
+
+        while damaged_dict is not None and \
+              segment_row_key > _row_key(damaged_dict):
+            damaged_dict = next(damaged_generator, None)
+
+        if damaged_dict is not None and \
+           segment_row_key == _row_key(damaged_dict):
+            segment_dict["damaged_sequence_numbers"] = \
+                damaged_dict["sequence_numbers"]
+        else:
+            segment_dict["damaged_sequence_numbers"] = list()
+
+        yield segment_dict
 
-        if self._damaged_dict is None:
-            self.segment_dict["damaged_sequence_numbers"] = list()
-            return
+    damaged_generator.close()
 
-        if segment_row_key < _row_key(self._damaged_dict):
-            self.segment_dict["damaged_sequence_numbers"] = list()
-            return
+def _generate_merge_entries(work_dir, 
+                            node_index, 
+                            node_name, 
+                            low_unified_id, 
+                            high_unified_id):
+    """
+    yield the rows from one node as entries for heapq.merge: the sort key
+    first, then enough to make the entries unique, so the dicts themselves
+    are never compared
+    """
+    for row_index, segment_dict in enumerate(
+        _generate_node_rows(work_dir, 
+                            node_name, 
+                            low_unified_id, 
+                            high_unified_id)
+    ):
+        yield (_row_key(segment_dict), node_index, row_index, segment_dict, )
 
-        if segment_row_key == _row_key(self._damaged_dict):
-            self.segment_dict["damaged_sequence_numbers"] = \
-                self._damaged_dict["sequence_numbers"]
+def _entry_key(entry):
+    return entry[0]
 
 _node_names = os.environ["NIMBUSIO_NODE_NAME_SEQ"].split()
 
-def generate_work(work_dir):
+def generate_work(work_dir, low_unified_id=None, high_unified_id=None):
     """
     generate work data structures for segment audit
     We use dicts instead of named tuples for easy pickling
     We yield a tuple of ((unified_id, conjoined_part), status, [segment_rows],)
     with segment rows in order of node_name
+
+    We only look at the segments with 
+    low_unified_id <= unified_id < high_unified_id (None for no limit), 
+    so the audit can be split into shards
     """
     log = logging.getLogger("generate_work")
-    row_generators = [NodeRowGenerator(work_dir, n) for n in _node_names]
-
-    while True:
-
-        # find the minimum row_key (unified_id, conjoined_part)
-        minimum_row_key = None
-        for row_generator in row_generators:
-            if row_generator.segment_dict is None:
-                continue
-
-            row_key = _row_key(row_generator.segment_dict)
-            if minimum_row_key is None:
-                minimum_row_key = row_key
-            else:
-                minimum_row_key = min(minimum_row_key, row_key)
-
-        # if we don't find one, we have used up all segment rows
-        if minimum_row_key is None:
-            raise StopIteration()
-        
-        segment_data = list()
-        for row_generator in row_generators:
-            if row_generator.segment_dict is None:
-                segment_data.append(None)
+    log.debug("unified_id range {0} to {1}".format(low_unified_id, 
+                                                   high_unified_id))
+    entry_generators = [_generate_merge_entries(work_dir, 
+                                                node_index, 
+                                                node_name,
+                                                low_unified_id, 
+                                                high_unified_id) \
+                        for node_index, node_name in enumerate(_node_names)]
+
+    merged_entries = heapq.merge(*entry_generators)
+    for row_key, entries in itertools.groupby(merged_entries, _entry_key):
+        segment_data = [None for _ in _node_names]
+        for _row_key, node_index, _row_index, segment_dict in entries:
+            if segment_data[node_index] is not None:
+                log.warn("duplicate row {0} from {1}".format(
+                    row_key, _node_names[node_index]))
                 continue
+            segment_data[node_index] = segment_dict
 
-            row_key = _row_key(row_generator.segment_dict)
-            if row_key != minimum_row_key:
-                assert row_key > minimum_row_key
-                segment_data.append(None)
-                continue
-
-            segment_data.append(row_generator.segment_dict)
-            row_generator.advance()
-
-        yield (minimum_row_key, anti_entropy_pre_audit, segment_data, )
-
+        yield (row_key, anti_entropy_pre_audit, segment_data, )
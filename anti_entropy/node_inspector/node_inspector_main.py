@@ -2,10 +2,9 @@
 """
 node_inspector_main.py
 """
-import errno
-import hashlib
 import logging
 import os
+import os.path
 import sys
 
 import zmq
@@ -14,14 +13,19 @@ from tools.standard_logging import initialize_logging
 from tools.database_connection import get_node_local_connection
 from tools.event_push_client import EventPushClient, unhandled_exception_topic
 from tools.data_definitions import compute_expected_slice_count, \
-        compute_value_file_path, \
         parse_timedelta_str, \
-        create_timestamp, \
         damaged_segment_defective_sequence, \
         damaged_segment_missing_sequence
+from tools.file_space import load_file_space_info
+from tools.token_bucket import TokenBucket
 
 from anti_entropy.node_inspector.work_generator import \
         make_batch_key, generate_work
+from anti_entropy.node_inspector.value_file_verifier import \
+        value_file_missing, \
+        value_file_row_template, \
+        inspect_value_file, \
+        verify_value_files
 
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
 _log_path = "{0}/nimbusio_node_inspector_{1}.log".format(
@@ -32,25 +36,11 @@ _max_value_file_time_str = \
         os.environ.get("NIMBUSIO_MAX_TIME_BETWEEN_VALUE_FILE_INTEGRITY_CHECK",
                        "weeks=1")
 _max_value_file_time = None
-_read_buffer_size = 1024 ** 2
 _always_check_entries = bool(
     int(os.environ.get("NIMBUSIO_NODE_INSPECTOR_CHECK_ENTRIES", "0")))
-
-# If the value file is missing, 
-# consider all of the segment_sequences to be missing
-_value_file_missing = 1
-
-# If the value file exists, is closed, and has an md5 in the database, 
-# has a size in the database, and the size in the stat matches the size in 
-# the database, and has a close_time or a last_integrity_check_time that is 
-# younger than (MAX_TIME_BETWEEN_VALUE_FILE_INTEGRITY_CHECK) 
-# consider all records in the file undammaged
-_value_file_valid = 2
-
-# If none of the above branches were fruitful, then all records in the database 
-# that point to this value file must be verified by opening, seeking, reading, 
-# and hashing the record pointed to in the value file
-_value_file_questionable = 3
+_progress_path = os.path.join(_repository_path, 
+                              "node_inspector", 
+                              "value_file_progress")
 
 def _store_damaged_segment(connection, entry, status, sequence_numbers):
     connection.execute("""
@@ -91,118 +81,32 @@ def _update_value_file_last_integrity_check_time(connection,
         set last_integrity_check_time = %s
         where id = %s""", [timestamp, value_file_id, ])
 
-def _value_file_status(connection, entry):
-    log = logging.getLogger("_value_file_status")
-    batch_key = make_batch_key(entry)
-
-    value_file_path = compute_value_file_path(_repository_path, 
-                                              entry.space_id, 
-                                              entry.value_file_id)
-    # Always do a stat on the value file. 
-    try:
-        stat_result = os.stat(value_file_path)
-    except OSError as instance:
-        # If the value file is missing, consider all of the segment_sequences 
-        # to be missing, and handle it as such.
-        if instance.errno == errno.ENOENT:
-            log.error("value file missing {0} {1}".format(batch_key,
-                                                          value_file_path))
-            return _value_file_missing
-        log.error("Error stat'ing value file {0} {1} {2}".format(
-            str(instance), batch_key, value_file_path))
-        raise
-
-    # If the value file is still open, consider all data in it undammaged.
-    if entry.value_file_close_time is None:
-        return _value_file_valid
-
-    # If the value file exists, is closed, and has an md5 in the database, 
-    # has a size in the database, and the size in the stat matches the size 
-    # in the database, and has a close_time or a last_integrity_check_time 
-    # that is younger than (MAX_TIME_BETWEEN_VALUE_FILE_INTEGRITY_CHECK) 
-    # consider all records in the file undammaged. (This is the common case.)
-    if entry.value_file_hash is None:
-        log.info("Value file row has no md5 hash {0} {1}".format(batch_key,
-                                                                 entry))
-        return _value_file_questionable
-
-    if entry.value_file_size is None:
-        log.info("Value file row has no size {0} {1}".format(batch_key,
-                                                             entry))
-        return _value_file_questionable
-
-    if entry.value_file_size != stat_result.st_size:
-        log.info("Value file row size {0} != stat size {1} {2}".format(
-            entry.value_file_size, stat_result.st_size, batch_key))
-        return _value_file_questionable
+def _value_file_result(connection, value_file_results, entry):
+    """
+    return the result of verifying the entry's value file. 
     
-    current_time = create_timestamp()
-    value_file_row_age = current_time - entry.value_file_close_time
-    if entry.value_file_last_integrity_check_time is not None:
-        value_file_row_age = \
-                current_time - entry.value_file_last_integrity_check_time
-
-    if value_file_row_age < _max_value_file_time:
-        return _value_file_valid
-
-    value_file_result = _value_file_valid
-
-    # If the value matches all the previous criteria EXCEPT the 
-    # MAX_TIME_BETWEEN_VALUE_FILE_INTEGRITY_CHECK, then read the whole file, 
-    # and calculate the md5. If it matches, consider the whole file good as 
-    # above. Update last_integrity_check_time regardless.
-
-    md5_sum = hashlib.md5()
-    try:
-        with open(value_file_path, "rb") as input_file:
-            while True:
-                data = input_file.read(_read_buffer_size)
-                if len(data) == 0:
-                    break
-                md5_sum.update(data)
-    except (OSError, IOError) as instance:
-        log.error("Error reading {0} {1}".format(value_file_path, 
-                                                 instance))
-        value_file_result =  _value_file_questionable
-
-    if value_file_result == _value_file_valid and \
-       md5_sum.digest() != bytes(entry.value_file_hash):
-        log.error(
-            "md5 mismatch {0} {1} {2} {3}".format(md5_sum.digest(),
-                                                  bytes(entry.value_file_hash),
-                                                  batch_key,
-                                                  value_file_path))
-        value_file_result =  _value_file_questionable
-
-
-    # we're only supposed to do this after we've also read the file
-    # and inserted any damage. not before. otherwise it's a race condition --
-    # we may crash before finishing checking the file, and then the file
-    # doesn't get checked, but it's marked as checked.
-
-    _update_value_file_last_integrity_check_time(connection,
-                                                 entry.value_file_id,
-                                                 create_timestamp())
-
-    return value_file_result
-
-def _verify_entry_against_value_file(entry):
-    log = logging.getLogger("_verify_entry_against_vaue_file")
-    value_file_path = compute_value_file_path(_repository_path, 
-                                              entry.space_id,
-                                              entry.value_file_id)
-    md5_sum = hashlib.md5()
-    try:
-        with open(value_file_path, "rb") as input_file:
-            input_file.seek(entry.value_file_offset)
-            md5_sum.update(input_file.read(entry.sequence_size))
-    except (OSError, IOError) as instance:
-        log.error("Error seek/reading {0} {1}".format(value_file_path, 
-                                                      instance))
-        return False
-    return md5_sum.digest() == bytes(entry.sequence_hash)
-
-def _process_work_batch(connection, known_value_files, batch):
+    We verified all the value files before we started on the segments, 
+    but a value file may have been closed since then.
+    """
+    if entry.value_file_id not in value_file_results:
+        value_file_row = value_file_row_template(
+            id=entry.value_file_id,
+            space_id=entry.space_id,
+            close_time=entry.value_file_close_time,
+            size=entry.value_file_size,
+            hash=entry.value_file_hash,
+            last_integrity_check_time=\
+                entry.value_file_last_integrity_check_time)
+        value_file_results[entry.value_file_id] = \
+            inspect_value_file(connection,
+                               _repository_path,
+                               value_file_row,
+                               _max_value_file_time,
+                               _always_check_entries,
+                               TokenBucket(None))
+    return value_file_results[entry.value_file_id]
+
+def _process_work_batch(connection, value_file_results, batch):
     log = logging.getLogger("_process_work_batch")
 
     assert len(batch) > 0
@@ -219,33 +123,20 @@ def _process_work_batch(connection, known_value_files, batch):
             list(expected_sequence_numbers - actual_sequence_numbers))
 
     for entry in batch:
-        if not entry.value_file_id in known_value_files:
-            known_value_files[entry.value_file_id] = \
-                    _value_file_status(connection, entry)
-        value_file_status = known_value_files[entry.value_file_id]
+        value_file_result = \
+            _value_file_result(connection, value_file_results, entry)
 
         # if we don't have a value_file for any sequence, 
         # treat that as missing too
-        if value_file_status == _value_file_missing:
+        if value_file_result["status"] == value_file_missing:
             log.info("Missing value file {0} for {1} sequence {2}".format(
                 entry.value_file_id, batch_key, entry.sequence_num))
             missing_sequence_numbers.append(entry.sequence_num)
             continue
 
-        if not _always_check_entries:
-            if value_file_status == _value_file_valid:
-                continue
-
-            # if none of the above branches were fruitful, 
-            # then all records in the database that point to this value file 
-            # must be verified by opening, seeking, reading, and hashing the 
-            # record pointed to in the value file. This will be terribly costly 
-            # in terms of IO because our work is not sorted by value file. 
-            # Fortunately, data corruption should be rare enough that the 
-            # efficiency will be irrelevant
-            assert value_file_status == _value_file_questionable
-
-        if not _verify_entry_against_value_file(entry):
+        # the verifier has checked every sequence in a questionable 
+        # value file (or in every value file, if _always_check_entries)
+        if entry.value_file_offset in value_file_result["defective-offsets"]:
             log.info("Defective value file {0} for {1} sequence {2}".format(
                 entry.value_file_id, batch_key, entry.sequence_num))
             defective_sequence_numbers.append(entry.sequence_num)
@@ -305,12 +196,31 @@ def main():
         )
         return -1
 
-    known_value_files = dict()
-
-    connection.begin_transaction()
+    batch = None
+    progress_file = None
     try:
+        file_space_info = load_file_space_info(connection)
+        value_file_results, progress_file = \
+            verify_value_files(connection,
+                               _repository_path,
+                               file_space_info,
+                               _progress_path,
+                               _max_value_file_time,
+                               _always_check_entries)
+
+        # we're only supposed to update last_integrity_check_time after 
+        # we've also inserted any damage. not before. otherwise it's a race 
+        # condition -- we may crash before finishing checking the file, and 
+        # then the file doesn't get checked, but it's marked as checked.
+        connection.begin_transaction()
         for batch in generate_work(connection):
-            _process_work_batch(connection, known_value_files, batch)
+            _process_work_batch(connection, value_file_results, batch)
+        for value_file_result in value_file_results.values():
+            if value_file_result["check-time"] is not None:
+                _update_value_file_last_integrity_check_time(
+                    connection,
+                    value_file_result["value-file-id"],
+                    value_file_result["check-time"])
     except Exception as instance:
         connection.rollback()
         log.exception("Exception processing batch {0} {1}".format(
@@ -323,7 +233,10 @@ def main():
         return -1
     else:
         connection.commit()
+        progress_file.remove()
     finally:
+        if progress_file is not None:
+            progress_file.close()
         connection.close()
         event_push_client.close()
         zmq_context.term()
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+value_file_verifier.py
+
+verify the value files referenced by the node's finished segments, before
+node_inspector walks the segments.
+
+The value files are grouped by volume, with one worker thread per volume,
+each held to an I/O rate. A questionable value file is read once,
+sequentially, checking every referenced sequence in the same pass, rather
+than with a seek and read for each sequence.
+
+The result for each value file is appended to a progress file as soon as
+we have it, so an interrupted inspection resumes where it stopped.
+"""
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import hashlib
+import logging
+import os
+import os.path
+from pickle import UnpicklingError
+from threading import Lock
+import time
+
+from tools.database_connection import get_node_local_connection
+from tools.data_definitions import compute_value_file_path, \
+        create_timestamp
+from tools.file_space import compute_volume_by_space_id
+from tools.sized_pickle import store_sized_pickle, retrieve_sized_pickle
+from tools.token_bucket import TokenBucket
+
+# If the value file is missing,
+# consider all of the segment_sequences to be missing
+value_file_missing = 1
+
+# If the value file exists, is closed, and has an md5 in the database,
+# has a size in the database, and the size in the stat matches the size in
+# the database, and has a close_time or a last_integrity_check_time that is
+# younger than (MAX_TIME_BETWEEN_VALUE_FILE_INTEGRITY_CHECK)
+# consider all records in the file undammaged
+value_file_valid = 2
+
+# If none of the above branches were fruitful, then all records in the database
+# that point to this value file must be verified against the value file
+value_file_questionable = 3
+
+_read_buffer_size = 1024 ** 2
+_max_mb_per_second = float(
+    os.environ.get("NIMBUSIO_NODE_INSPECTOR_MAX_MB_PER_SECOND", "0")
+)
+
+value_file_row_template = namedtuple("ValueFileRow", [
+    "id",
+    "space_id",
+    "close_time",
+    "size",
+    "hash",
+    "last_integrity_check_time", ])
+
+_sequence_row_template = namedtuple("SequenceRow", [
+    "value_file_offset",
+    "size",
+    "hash", ])
+
+_value_file_query = """
+select vf.id, vf.space_id, vf.close_time, vf.size, vf.hash,
+vf.last_integrity_check_time
+from nimbusio_node.value_file vf
+where exists (
+    select 1 from nimbusio_node.segment_sequence sq
+    inner join nimbusio_node.segment seg on (sq.segment_id = seg.id)
+    where sq.value_file_id = vf.id and seg.status = 'F'
+)
+"""
+
+if not int(os.environ.get("NIMBUSIO_INSPECT_JOURNALS", "0")):
+    _value_file_query = _value_file_query + """
+    and vf.space_id not in (select space_id
+                            from nimbusio_node.file_space
+                            where purpose='journal')
+    """
+
+_sequence_query = """
+select sq.value_file_offset, sq.size, sq.hash
+from nimbusio_node.segment_sequence sq
+inner join nimbusio_node.segment seg on (sq.segment_id = seg.id)
+where sq.value_file_id = %s and seg.status = 'F'
+order by sq.value_file_offset
+"""
+
+def _stat_status(value_file_row, value_file_path, max_value_file_time):
+    """
+    classify the value file from the database row and a stat
+
+    return (status, full_check_due) where full_check_due means the value
+    file looks valid, but it is time to check the md5 of the whole file
+    """
+    log = logging.getLogger("_stat_status")
+
+    # Always do a stat on the value file.
+    try:
+        stat_result = os.stat(value_file_path)
+    except OSError as instance:
+        # If the value file is missing, consider all of the segment_sequences
+        # to be missing, and handle it as such.
+        if instance.errno == errno.ENOENT:
+            log.error("value file missing {0} {1}".format(value_file_row.id,
+                                                          value_file_path))
+            return value_file_missing, False
+        log.error("Error stat'ing value file {0} {1} {2}".format(
+            str(instance), value_file_row.id, value_file_path))
+        raise
+
+    # If the value file is still open, consider all data in it undammaged.
+    if value_file_row.close_time is None:
+        return value_file_valid, False
+
+    if value_file_row.hash is None:
+        log.info("Value file row has no md5 hash {0}".format(value_file_row))
+        return value_file_questionable, False
+
+    if value_file_row.size is None:
+        log.info("Value file row has no size {0}".format(value_file_row))
+        return value_file_questionable, False
+
+    if value_file_row.size != stat_result.st_size:
+        log.info("Value file row size {0} != stat size {1} {2}".format(
+            value_file_row.size, stat_result.st_size, value_file_row.id))
+        return value_file_questionable, False
+
+    current_time = create_timestamp()
+    value_file_row_age = current_time - value_file_row.close_time
+    if value_file_row.last_integrity_check_time is not None:
+        value_file_row_age = \
+                current_time - value_file_row.last_integrity_check_time
+
+    return value_file_valid, value_file_row_age >= max_value_file_time
+
+def _compute_file_md5(value_file_path, token_bucket):
+    """
+    return the md5 digest of the whole value file, None if we can't read it
+    """
+    log = logging.getLogger("_compute_file_md5")
+    md5_sum = hashlib.md5()
+    try:
+        with open(value_file_path, "rb") as input_file:
+            while True:
+                data = input_file.read(_read_buffer_size)
+                if len(data) == 0:
+                    break
+                token_bucket.consume(len(data))
+                md5_sum.update(data)
+    except (OSError, IOError) as instance:
+        log.error("Error reading {0} {1}".format(value_file_path, instance))
+        return None
+    return md5_sum.digest()
+
+def _verify_sequences(value_file_path, sequence_rows, token_bucket):
+    """
+    read the value file once, sequentially, computing the md5 of the whole
+    file, and of each sequence in sequence_rows (ordered by
+    value_file_offset) as we pass it
+
+    return (md5 digest of the file, set of the offsets of defective
+    sequences). The digest is None if we can't read the file.
+    """
+    log = logging.getLogger("_verify_sequences")
+    file_md5 = hashlib.md5()
+    pending_rows = deque(sequence_rows)
+    active_rows = list()
+    defective_offsets = set()
+    position = 0
+
+    try:
+        with open(value_file_path, "rb") as input_file:
+            while True:
+                data = input_file.read(_read_buffer_size)
+                if len(data) == 0:
+                    break
+                token_bucket.consume(len(data))
+                file_md5.update(data)
+                data_view = memoryview(data)
+                data_end = position + len(data)
+
+                while len(pending_rows) > 0 and \
+                      pending_rows[0].value_file_offset < data_end:
+                    active_rows.append((pending_rows.popleft(),
+                                        hashlib.md5(), ))
+
+                still_active_rows = list()
+                for sequence_row, md5_sum in active_rows:
+                    sequence_end = \
+                        sequence_row.value_file_offset + sequence_row.size
+                    start = max(sequence_row.value_file_offset - position, 0)
+                    end = min(sequence_end - position, len(data))
+                    md5_sum.update(data_view[start:end])
+                    if sequence_end > data_end:
+                        still_active_rows.append((sequence_row, md5_sum, ))
+                    elif md5_sum.digest() != bytes(sequence_row.hash):
+                        defective_offsets.add(sequence_row.value_file_offset)
+                active_rows = still_active_rows
+
+                position = data_end
+    except (OSError, IOError) as instance:
+        log.error("Error reading {0} {1}".format(value_file_path, instance))
+        return None, set([r.value_file_offset for r in sequence_rows])
+
+    # any sequence we have not finished runs past the end of the file
+    for sequence_row, _ in active_rows:
+        defective_offsets.add(sequence_row.value_file_offset)
+    for sequence_row in pending_rows:
+        defective_offsets.add(sequence_row.value_file_offset)
+
+    return file_md5.digest(), defective_offsets
+
+def inspect_value_file(connection,
+                       repository_path,
+                       value_file_row,
+                       max_value_file_time,
+                       always_check_entries,
+                       token_bucket):
+    """
+    return a dict of
+        "value-file-id"
+        "status"            value_file_missing, value_file_valid or
+                            value_file_questionable
+        "check-time"        if we checked the md5 of the whole file,
+                            the time to record as last_integrity_check_time
+        "defective-offsets" the value_file_offsets of the sequences that
+                            failed verification
+    """
+    log = logging.getLogger("inspect_value_file")
+    value_file_path = compute_value_file_path(repository_path,
+                                              value_file_row.space_id,
+                                              value_file_row.id)
+    status, full_check_due = _stat_status(value_file_row,
+                                          value_file_path,
+                                          max_value_file_time)
+    result = {"value-file-id"       : value_file_row.id,
+              "status"              : status,
+              "check-time"          : None,
+              "defective-offsets"   : set(), }
+
+    if status == value_file_missing:
+        return result
+
+    verify_sequences = \
+        status == value_file_questionable or always_check_entries
+
+    # If the value matches all the previous criteria EXCEPT the
+    # MAX_TIME_BETWEEN_VALUE_FILE_INTEGRITY_CHECK, then read the whole file,
+    # and calculate the md5. If it matches, consider the whole file good as
+    # above. Update last_integrity_check_time regardless.
+    # If we are going to verify the sequences anyway, we get the md5 of
+    # the whole file from the same pass.
+    if full_check_due and not verify_sequences:
+        file_md5_digest = _compute_file_md5(value_file_path, token_bucket)
+        result["check-time"] = create_timestamp()
+        if file_md5_digest != bytes(value_file_row.hash):
+            log.error("md5 mismatch {0} {1} {2}".format(
+                file_md5_digest,
+                bytes(value_file_row.hash),
+                value_file_path))
+            result["status"] = value_file_questionable
+            verify_sequences = True
+
+    if not verify_sequences:
+        return result
+
+    sequence_rows = [_sequence_row_template._make(row) for row in \
+                     connection.fetch_all_rows(_sequence_query,
+                                               [value_file_row.id, ])]
+    file_md5_digest, defective_offsets = \
+        _verify_sequences(value_file_path, sequence_rows, token_bucket)
+    result["defective-offsets"] = defective_offsets
+
+    if full_check_due and result["check-time"] is None:
+        result["check-time"] = create_timestamp()
+        if file_md5_digest != bytes(value_file_row.hash):
+            log.error("md5 mismatch {0} {1} {2}".format(
+                file_md5_digest,
+                bytes(value_file_row.hash),
+                value_file_path))
+            result["status"] = value_file_questionable
+
+    if len(defective_offsets) > 0:
+        log.info("{0} defective sequences in {1}".format(
+            len(defective_offsets), value_file_path))
+
+    return result
+
+class _ProgressFile(object):
+    """
+    the value file results of an inspection, appended as sized pickles
+    as we get them, after a header with the time the inspection started
+    """
+    def __init__(self, path):
+        self._log = logging.getLogger("ProgressFile")
+        self._path = path
+        self._lock = Lock()
+        self._file = None
+
+    def load(self, max_age):
+        """
+        return a dict of the results saved by an interrupted inspection,
+        keyed by value_file_id. Results older than max_age are discarded.
+        """
+        results = dict()
+        if not os.path.exists(self._path):
+            return results
+
+        with open(self._path, "rb") as input_file:
+            try:
+                header = retrieve_sized_pickle(input_file)
+            except (EOFError, AssertionError, UnpicklingError, ValueError):
+                self._log.warn("no header in {0}".format(self._path))
+                return results
+
+            age = time.time() - header["start-time"]
+            if age > max_age.total_seconds():
+                self._log.info("discarding old progress file {0}".format(
+                    self._path))
+                return results
+
+            while True:
+                try:
+                    result = retrieve_sized_pickle(input_file)
+                except EOFError:
+                    break
+                # the last result may be cut short if we were interrupted
+                except (AssertionError, UnpicklingError, ValueError):
+                    self._log.warn("incomplete result in {0}".format(
+                        self._path))
+                    break
+                results[result["value-file-id"]] = result
+
+        self._log.info("resuming with {0:,} value files done".format(
+            len(results)))
+        return results
+
+    def open(self, resuming):
+        """
+        append to the progress file we are resuming, or start a new one
+        """
+        if resuming:
+            self._file = open(self._path, "ab")
+            return
+
+        progress_dir = os.path.dirname(self._path)
+        if not os.path.exists(progress_dir):
+            os.makedirs(progress_dir)
+        self._file = open(self._path, "wb")
+        store_sized_pickle({"start-time" : time.time()}, self._file)
+        self._file.flush()
+
+    def append(self, result):
+        with self._lock:
+            store_sized_pickle(result, self._file)
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+def _verify_volume(repository_path,
+                   volume_name,
+                   value_file_rows,
+                   max_value_file_time,
+                   always_check_entries,
+                   progress_file):
+    """
+    run in a worker thread: verify the value files on one volume,
+    one at a time, in value_file_id order (roughly the order they were
+    written)
+
+    return a list of results
+    """
+    log = logging.getLogger("_verify_volume")
+    log.info("{0}: {1:,} value files".format(volume_name,
+                                             len(value_file_rows)))
+    token_bucket = TokenBucket(_max_mb_per_second * 1024 * 1024)
+    connection = get_node_local_connection()
+    results = list()
+    try:
+        for value_file_row in sorted(value_file_rows):
+            result = inspect_value_file(connection,
+                                        repository_path,
+                                        value_file_row,
+                                        max_value_file_time,
+                                        always_check_entries,
+                                        token_bucket)
+            progress_file.append(result)
+            results.append(result)
+    finally:
+        connection.close()
+    log.info("{0}: done".format(volume_name))
+    return results
+
+def verify_value_files(connection,
+                       repository_path,
+                       file_space_info,
+                       progress_path,
+                       max_value_file_time,
+                       always_check_entries):
+    """
+    verify the value files referenced by finished segments, one worker
+    per volume.
+
+    return (results, progress_file) where results is a dict of the
+    results from inspect_value_file keyed by value_file_id. The caller
+    removes progress_file when it has stored the results.
+    """
+    log = logging.getLogger("verify_value_files")
+
+    progress_file = _ProgressFile(progress_path)
+    results = progress_file.load(max_value_file_time)
+    progress_file.open(len(results) > 0)
+
+    volume_by_space_id = compute_volume_by_space_id(file_space_info)
+    work_by_volume = dict()
+    for row in connection.fetch_all_rows(_value_file_query, []):
+        value_file_row = value_file_row_template._make(row)
+        if value_file_row.id in results:
+            continue
+        volume_name = volume_by_space_id.get(value_file_row.space_id,
+                                             value_file_row.space_id)
+        work_by_volume.setdefault(volume_name, list()).append(value_file_row)
+
+    log.info("{0:,} value files to verify on {1} volumes".format(
+        sum([len(rows) for rows in work_by_volume.values()]),
+        len(work_by_volume)))
+    if len(work_by_volume) == 0:
+        return results, progress_file
+
+    with ThreadPoolExecutor(max_workers=len(work_by_volume)) as executor:
+        futures = [executor.submit(_verify_volume,
+                                   repository_path,
+                                   volume_name,
+                                   value_file_rows,
+                                   max_value_file_time,
+                                   always_check_entries,
+                                   progress_file) \
+                   for volume_name, value_file_rows in work_by_volume.items()]
+        for future in futures:
+            for result in future.result():
+                results[result["value-file-id"]] = result
+
+    return results, progress_file
+
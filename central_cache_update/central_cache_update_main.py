@@ -3,14 +3,10 @@
 """
 Ticket #47 Update/Invalidate memcache records when central DB changes
 """
-import base64
 import logging
 import os
-import pickle
 import sys
 from threading import Event
-import time
-import zlib
 
 import memcache
 
@@ -21,11 +17,15 @@ from tools.zeromq_util import is_interrupted_system_call, \
         prepare_ipc_path
 from tools.process_util import set_signal_handler
 from tools.data_definitions import memcached_central_key_template
+from tools.central_cache_event import cache_update_channel, \
+        parse_cache_update_meta, \
+        parse_cache_update_data, \
+        compute_stale_lookups, \
+        is_cached_table
 
 _log_path = "{0}/nimbusio_central_cache_update.log".format(
     os.environ["NIMBUSIO_LOG_DIR"]) 
 _skeeter_pub_socket_uri = os.environ["NIMBUSIO_CENTRAL_SKEETER_URI"]
-_cache_update_channel = "nimbusio_central_cache_update"
 _memcached_host = os.environ.get("NIMBUSIO_MEMCACHED_HOST", "localhost")
 _memcached_port = int(os.environ.get("NIMBUSIO_MEMCACHED_PORT", "11211"))
 _memcached_nodes = ["{0}:{1}".format(_memcached_host, _memcached_port), ]
@@ -37,83 +37,15 @@ def _create_sub_socket(zeromq_context):
     sub_socket = zeromq_context.socket(zmq.SUB)
     log.info("connecting to {0}".format(_skeeter_pub_socket_uri))
     sub_socket.connect(_skeeter_pub_socket_uri)
-    log.info("subscribing to {0}".format(_cache_update_channel))
-    sub_socket.setsockopt(zmq.SUBSCRIBE, _cache_update_channel)
+    log.info("subscribing to {0}".format(cache_update_channel))
+    sub_socket.setsockopt(zmq.SUBSCRIBE, cache_update_channel)
 
     return sub_socket
 
-def _process_collection_event(memcached_client, event_data):
-    log = logging.getLogger("_process_collection_event")
-    if event_data["event"] != "UPDATE":
-        log.error("unknown event {0}".format(event_data))
-        return
-
-    lookup_fields = ["id", "name", ]
-    for lookup_field in lookup_fields:
-        key = memcached_central_key_template.format(
-            "collection", 
-            lookup_field, 
-            event_data["old"][lookup_field])
-        result = memcached_client.delete(key)
-        log.info("delete {0} result = {1}".format(key, result))
-
-    # deleted collections have their name changed to have __deleted__$id__ at
-    # the front so that they do not conflict with future collections.  in order
-    # to clear caches even when we have mass updates.
-    name = event_data['old']['name']
-    if name.startswith("__deleted__"):
-        undecorated_name = name[name.rindex("_") + 1:]
-        key = memcached_central_key_template.format(
-            "collection", "name", undecorated_name)
-        result = memcached_client.delete(key)
-        log.info("delete {0} result = {1}".format(key, result))
-
-def _process_customer_event(memcached_client, event_data):
-    log = logging.getLogger("_process_customer_event")
-    if event_data["event"] != "UPDATE":
-        log.error("unknown event {0}".format(event_data))
-        return
-
-    lookup_fields = ["id", "username", ]
-    for lookup_field in lookup_fields:
-        key = memcached_central_key_template.format(
-            "customer", 
-            lookup_field, 
-            event_data["old"][lookup_field])
-        result = memcached_client.delete(key)
-        log.info("delete {0} result = {1}".format(key, result))
-
-def _process_customer_key_event(memcached_client, event_data):
-    log = logging.getLogger("_process_customer_key_event")
-    if event_data["event"] != "UPDATE":
-        log.error("unknown event {0}".format(event_data))
-        return
-
-    lookup_field = "id"
-    key = memcached_central_key_template.format(
-        "customer_key", 
-        lookup_field, 
-        event_data["old"][lookup_field])
-    result = memcached_client.delete(key)
-    log.info("delete {0} result = {1}".format(key, result))
-
-_dispatch_table = {
-    "collection"   : _process_collection_event,
-    "customer"     : _process_customer_event,
-    "customer_key" : _process_customer_key_event,
-}
-
 def _process_one_event(memcached_client, expected_sequence, topic, meta, data):
     log = logging.getLogger("event")
 
-    meta_dict = dict()
-    for entry in meta.strip().split(";"):
-        [key, value] = entry.split("=")
-        meta_dict[key.strip()] = value.strip()
-
-    # every event should have a sequence and a timestamp
-    meta_dict["timestamp"] = time.ctime(int(meta_dict["timestamp"]))
-    meta_dict["sequence"] = int(meta_dict["sequence"])
+    meta_dict = parse_cache_update_meta(meta)
 
     if expected_sequence[topic] is None:
         expected_sequence[topic] = meta_dict["sequence"] + 1
@@ -126,20 +58,32 @@ def _process_one_event(memcached_client, expected_sequence, topic, meta, data):
         log.error(message)
         expected_sequence[topic] = None
 
-    table_name, uuid, raw_data = data.split("\n", 2)
     try:
-        event_data = \
-            pickle.loads(zlib.decompress(base64.b64decode(raw_data)))
+        event_data = parse_cache_update_data(data)
     except Exception:
-        log.exception("unable to parse {0} data '{1}'".format(
-            table_name, raw_data))
+        log.exception("unable to parse data '{0}'".format(data))
         return 
 
     if "table_name" not in event_data or \
-        event_data["table_name"] not in _dispatch_table:
+        not is_cached_table(event_data["table_name"]):
         log.error("invalid event data {0}".format(event_data))
+        return
 
-    _dispatch_table[event_data["table_name"]](memcached_client, event_data)
+    if event_data["event"] != "UPDATE":
+        log.error("unknown event {0}".format(event_data))
+        return
+
+    stale_lookups = compute_stale_lookups(event_data)
+    if stale_lookups is None:
+        log.error("no row data in event {0}".format(event_data))
+        return
+
+    for table_name, lookup_field, lookup_field_value in stale_lookups:
+        key = memcached_central_key_template.format(table_name,
+                                                    lookup_field,
+                                                    lookup_field_value)
+        result = memcached_client.delete(key)
+        log.info("delete {0} result = {1}".format(key, result))
 
 def main():
     """
@@ -160,7 +104,7 @@ def main():
     sub_socket = _create_sub_socket(zeromq_context)
 
     expected_sequence = {
-        _cache_update_channel : None,
+        cache_update_channel : None,
     }
 
     while not halt_event.is_set():
@@ -29,6 +29,7 @@ from web_public_reader.central_database_util import get_cluster_row, \
 from data_writer.reply_pull_server import ReplyPULLServer
 from data_writer.writer_thread import WriterThread
 from data_writer.sync_thread import SyncThread
+from data_writer.sync_state import SyncState
 
 class AppendQueue(queue.Queue):
     """
@@ -64,6 +65,7 @@ def _create_state():
         "node-id-dict"          : None,
         "writer-thread"         : None,
         "sync-thread"           : None,
+        "sync-state"            : SyncState(),
     }
 
 def _setup(state):
@@ -134,11 +136,14 @@ def _setup(state):
     state["writer-thread"] = WriterThread(state["halt-event"],
                                           state["node-id-dict"],
                                           state["message-queue"],
-                                          state["reply-push-client"])
+                                          state["reply-push-client"],
+                                          state["sync-state"])
     state["writer-thread"].start()
 
     state["sync-thread"] = SyncThread(state["halt-event"],
-                                      state["message-queue"])
+                                      state["message-queue"],
+                                      state["sync-state"],
+                                      state["zmq-context"])
     state["sync-thread"].start()
 
 def _tear_down(state):
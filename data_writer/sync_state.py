@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+sync_state.py
+
+State shared between the writer thread and the sync thread: what is
+waiting to be fsync'd, and how long the fsyncs are taking.
+"""
+import os
+from threading import Event, Lock
+import time
+
+# fsync as soon as this many PostSyncCompletions are waiting
+_max_pending_completions = int(os.environ.get(
+    "NIMBUSIO_DATA_WRITER_SYNC_MAX_PENDING_COMPLETIONS", "64")
+)
+
+# fsync as soon as this many bytes have been written since the last sync
+_max_pending_bytes = int(os.environ.get(
+    "NIMBUSIO_DATA_WRITER_SYNC_MAX_PENDING_BYTES", str(64 * 1024 * 1024))
+)
+
+# fsync when the oldest PostSyncCompletion has waited this long
+_completion_latency_target = float(os.environ.get(
+    "NIMBUSIO_DATA_WRITER_SYNC_LATENCY_TARGET", "0.1")
+)
+
+# fsync data that has no completion waiting for it after this long
+_max_sync_interval = 1.0
+
+def _percentile(sorted_values, percent):
+    index = int(round((len(sorted_values) - 1) * percent / 100.0))
+    return sorted_values[index]
+
+def compute_distribution(values):
+    """
+    return a dict describing the distribution of a list of numbers
+    """
+    if len(values) == 0:
+        return {"count" : 0}
+    sorted_values = sorted(values)
+    return {
+        "count" : len(sorted_values),
+        "min"   : sorted_values[0],
+        "max"   : sorted_values[-1],
+        "mean"  : sum(sorted_values) / float(len(sorted_values)),
+        "p50"   : _percentile(sorted_values, 50),
+        "p90"   : _percentile(sorted_values, 90),
+        "p99"   : _percentile(sorted_values, 99),
+    }
+
+class SyncState(object):
+    """
+    State shared between the writer thread and the sync thread: what is
+    waiting to be fsync'd, and how long the fsyncs are taking.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.wakeup_event = Event()
+        self._pending_bytes = 0
+        self._pending_completions = 0
+        self._oldest_write_time = None
+        self._oldest_completion_time = None
+        self._sync_requested = False
+        self._sync_latencies = list()
+        self._batch_sizes = list()
+
+    def add_write(self, byte_count):
+        """
+        the writer thread has written data that is not yet synced
+        """
+        with self._lock:
+            if self._oldest_write_time is None:
+                self._oldest_write_time = time.time()
+            self._pending_bytes += byte_count
+            if self._pending_bytes >= _max_pending_bytes:
+                self.wakeup_event.set()
+
+    def add_completion(self, byte_count):
+        """
+        the writer thread has written data and queued a
+        PostSyncCompletion that waits for the sync
+        """
+        self.add_write(byte_count)
+        with self._lock:
+            if self._oldest_completion_time is None:
+                self._oldest_completion_time = time.time()
+            self._pending_completions += 1
+            if self._pending_completions >= _max_pending_completions:
+                self.wakeup_event.set()
+            elif self._pending_completions == 1:
+                # let the sync thread start timing the latency target
+                self.wakeup_event.set()
+
+    def time_until_sync(self):
+        """
+        return the number of seconds until we should sync,
+        0.0 if we should sync now,
+        None if there is nothing to sync (or a sync is already requested)
+        """
+        with self._lock:
+            if self._sync_requested:
+                return None
+            if self._pending_completions >= _max_pending_completions or \
+               self._pending_bytes >= _max_pending_bytes:
+                return 0.0
+            if self._oldest_completion_time is not None:
+                deadline = \
+                    self._oldest_completion_time + _completion_latency_target
+            elif self._oldest_write_time is not None:
+                deadline = self._oldest_write_time + _max_sync_interval
+            else:
+                return None
+        return max(0.0, deadline - time.time())
+
+    def sync_requested(self):
+        """
+        the sync thread has sent a sync message to the writer thread
+        """
+        with self._lock:
+            self._sync_requested = True
+
+    def sync_complete(self, batch_size, elapsed_time):
+        """
+        the writer thread has synced the value file and run batch_size
+        PostSyncCompletions
+        """
+        with self._lock:
+            self._pending_bytes = 0
+            self._pending_completions = 0
+            self._oldest_write_time = None
+            self._oldest_completion_time = None
+            self._sync_requested = False
+            self._sync_latencies.append(elapsed_time)
+            self._batch_sizes.append(batch_size)
+
+    def pop_stats(self):
+        """
+        return (sync_latencies, batch_sizes) accumulated since the
+        last call
+        """
+        with self._lock:
+            sync_latencies = self._sync_latencies
+            batch_sizes = self._batch_sizes
+            self._sync_latencies = list()
+            self._batch_sizes = list()
+        return sync_latencies, batch_sizes
@@ -2,25 +2,74 @@
 """
 sync_thread.py
 
-A timer thread to perioidically tell the writer thread to sync the output
-value file.
+A timer thread to tell the writer thread to sync the output value file.
+
+We sync as soon as enough PostSyncCompletions or bytes are waiting, or
+the oldest completion has waited for the latency target. When nothing is
+waiting we send no sync messages at all.
 """
+import logging
 from threading import Thread
+import time
+
+from tools.event_push_client import EventPushClient
+
+from data_writer.sync_state import compute_distribution
 
-_sync_interval = 1.0
+_idle_interval = 1.0
+_reporting_interval = 60.0
 _sync_message = {"message-type" : "sync-value-file"}
 
 class SyncThread(Thread):
     """
-    A timer thread to perioidically tell the writer thread to sync the output
-    value file.
+    A timer thread to tell the writer thread to sync the output value file.
     """
-    def __init__(self, halt_event, message_queue):
+    def __init__(self, halt_event, message_queue, sync_state, zmq_context):
         Thread.__init__(self, name="SyncThread")
+        self._log = logging.getLogger("SyncThread")
         self._halt_event = halt_event
         self._message_queue = message_queue
+        self._sync_state = sync_state
+        self._zmq_context = zmq_context
 
     def run(self):
-        while not self._halt_event.is_set():
-            self._halt_event.wait(_sync_interval)
-            self._message_queue.put((_sync_message, None))
+        # zeromq sockets must not be shared between threads,
+        # so we have an event push client of our own
+        event_push_client = EventPushClient(self._zmq_context, "data_writer")
+        last_report_time = time.time()
+        try:
+            while not self._halt_event.is_set():
+                wait_time = self._sync_state.time_until_sync()
+                if wait_time is None:
+                    wait_time = _idle_interval
+                elif wait_time == 0.0:
+                    self._sync_state.sync_requested()
+                    self._message_queue.put((_sync_message, None))
+                    continue
+
+                self._sync_state.wakeup_event.wait(wait_time)
+                self._sync_state.wakeup_event.clear()
+
+                current_time = time.time()
+                if current_time - last_report_time >= _reporting_interval:
+                    self._report_stats(event_push_client)
+                    last_report_time = current_time
+        finally:
+            event_push_client.close()
+
+    def _report_stats(self, event_push_client):
+        sync_latencies, batch_sizes = self._sync_state.pop_stats()
+        if len(sync_latencies) == 0:
+            return
+        sync_latency_distribution = compute_distribution(sync_latencies)
+        batch_size_distribution = compute_distribution(batch_sizes)
+        self._log.info("{0} syncs p99 latency {1:.3f} p99 batch size {2}".format(
+            sync_latency_distribution["count"],
+            sync_latency_distribution["p99"],
+            batch_size_distribution["p99"]))
+        event_push_client.info(
+            "data-writer-sync-stats",
+            "data writer sync stats",
+            sync_latency=sync_latency_distribution,
+            batch_size=batch_size_distribution
+        )
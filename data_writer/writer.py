@@ -6,11 +6,13 @@ Manage writing segment values to disk
 """
 import logging
 import os
+import time
 import psycopg2
 
 from tools.data_definitions import segment_sequence_template, \
         parse_timestamp_repr, \
         segment_status_active, \
+        segment_status_cancelled, \
         segment_status_tombstone
 from tools.file_space import find_least_volume_space_id
 from data_writer.output_value_file import OutputValueFile
@@ -19,6 +21,44 @@ _max_value_file_size = int(os.environ.get(
     "NIMBUS_IO_MAX_VALUE_FILE_SIZE", str(1024 * 1024 * 1024))
 )
 
+# we allocate segment ids from the database sequence in blocks, so starting
+# a new segment does not cost a database round trip
+_segment_id_block_size = int(os.environ.get(
+    "NIMBUSIO_DATA_WRITER_SEGMENT_ID_BLOCK_SIZE", "64")
+)
+
+# segment and segment_sequence rows are buffered and inserted in a single
+# transaction when the value file is synced. If the buffer grows past this
+# many rows, we force a sync
+_max_pending_rows = int(os.environ.get(
+    "NIMBUSIO_DATA_WRITER_MAX_PENDING_ROWS", "1024")
+)
+
+_segment_columns = [
+    "id",
+    "collection_id",
+    "key",
+    "status",
+    "unified_id",
+    "timestamp",
+    "segment_num",
+    "conjoined_part",
+    "source_node_id",
+    "handoff_node_id",
+]
+
+_segment_sequence_columns = [
+    "collection_id",
+    "segment_id",
+    "zfec_padding_size",
+    "value_file_id",
+    "sequence_num",
+    "value_file_offset",
+    "size",
+    "hash",
+    "adler32",
+]
+
 def _insert_conjoined_row(connection, conjoined_dict):
     connection.execute("""
         insert into nimbusio_node.conjoined (
@@ -71,53 +111,42 @@ def _set_conjoined_complete_timestamp(connection, conjoined_dict):
             and handoff_node_id = %(handoff_node_id)s
             """, conjoined_dict) 
 
-def _insert_new_segment_row(
-    connection,
-    collection_id, 
-    unified_id,
-    key, 
-    timestamp, 
-    conjoined_part,
-    segment_num,
-    source_node_id,
-    handoff_node_id
-):
+def _allocate_segment_ids(connection, count):
     """
-    Insert a new segment row in 'A'ctive status and return the id
+    reserve a block of ids from the segment id sequence
     """
-    return connection.execute_and_return_id("""
-        insert into nimbusio_node.segment (
-            collection_id,
-            key,
-            status,
-            unified_id,
-            timestamp,
-            segment_num,
-            conjoined_part,
-            source_node_id,
-            handoff_node_id
-        ) values (
-            %(collection_id)s,
-            %(key)s,
-            %(status)s,
-            %(unified_id)s,
-            %(timestamp)s::timestamp,
-            %(segment_num)s,
-            %(conjoined_part)s,
-            %(source_node_id)s,
-            %(handoff_node_id)s
-        ) returning id""", {
-            "collection_id"         : collection_id,
-            "key"                   : key,
-            "status"                : segment_status_active,
-            "unified_id"            : unified_id,
-            "timestamp"             : timestamp,
-            "conjoined_part"        : conjoined_part,
-            "segment_num"           : segment_num,
-            "source_node_id"        : source_node_id,
-            "handoff_node_id"       : handoff_node_id,
-        }
+    result = connection.fetch_all_rows("""
+        select nextval('nimbusio_node.segment_id_seq')
+        from generate_series(1, %s)""", [count, ])
+    return [segment_id for (segment_id, ) in result]
+
+def _insert_multiple_rows(connection, table_name, columns, rows):
+    """
+    Insert a list of row dicts with a single multi-row insert
+    """
+    if len(rows) == 0:
+        return
+    row_placeholder = "({0})".format(
+        ", ".join(["%s" for _ in columns])
+    )
+    query = "insert into {0} ({1}) values {2}".format(
+        table_name,
+        ", ".join(['"{0}"'.format(column) for column in columns]),
+        ", ".join([row_placeholder for _ in rows])
     )
+    args = list()
+    for row in rows:
+        args.extend([row[column] for column in columns])
+    connection.execute(query, args)
+
+def _insert_new_segment_rows(connection, segment_rows):
+    """
+    Insert segment rows (in 'A'ctive status, with preallocated ids)
+    """
+    _insert_multiple_rows(connection, 
+                          "nimbusio_node.segment", 
+                          _segment_columns, 
+                          segment_rows)
 
 def _insert_segment_tombstone_row(
     connection,
@@ -217,33 +246,16 @@ def _cancel_segment_row(connection, unified_id, conjoined_part, segment_num):
               "conjoined_part"   : conjoined_part,
               "segment_num"      : segment_num})
 
-def _insert_segment_sequence_row(connection, segment_sequence_row):
+def _insert_segment_sequence_rows(connection, segment_sequence_rows):
     """
-    Insert one segment_sequence entry
+    Insert segment_sequence entries
     """
-    connection.execute("""
-        insert into nimbusio_node.segment_sequence (
-            "collection_id",
-            "segment_id",
-            "zfec_padding_size",
-            "value_file_id",
-            "sequence_num",
-            "value_file_offset",
-            "size",
-            "hash",
-            "adler32"
-        ) values (
-            %(collection_id)s,
-            %(segment_id)s,
-            %(zfec_padding_size)s,
-            %(value_file_id)s,
-            %(sequence_num)s,
-            %(value_file_offset)s,
-            %(size)s,
-            %(hash)s,
-            %(adler32)s
-        )
-    """, segment_sequence_row._asdict())
+    _insert_multiple_rows(
+        connection, 
+        "nimbusio_node.segment_sequence", 
+        _segment_sequence_columns,
+        [row._asdict() for row in segment_sequence_rows]
+    )
 
 def _get_segment_id(connection, collection_id, key, timestamp, segment_num): 
     result = connection.fetch_one_row(""" 
@@ -266,7 +278,8 @@ class Writer(object):
                  file_space_info, 
                  repository_path, 
                  active_segments, 
-                 completions
+                 completions,
+                 sync_state
     ):
         self._log = logging.getLogger("Writer")
         self._connection = connection
@@ -274,6 +287,14 @@ class Writer(object):
         self._repository_path = repository_path
         self._active_segments = active_segments
         self._completions = completions
+        self._sync_state = sync_state
+
+        # ids reserved from the segment id sequence, not yet used
+        self._available_segment_ids = list()
+
+        # rows waiting to be inserted when the value file is synced
+        self._pending_segment_rows = list()
+        self._pending_segment_sequence_rows = list()
         
         space_id = find_least_volume_space_id("journal", self._file_space_info)
 
@@ -292,33 +313,79 @@ class Writer(object):
 
     def sync_value_file(self):
         """
-        sync the current value file
+        sync the current value file, and tell the sync state.
+        we also sync when we close, or have too many pending rows, so the
+        sync state must hear about those syncs from us
         """
+        batch_size = len(self._completions)
+        start_time = time.time()
+        self._sync_value_file()
+        self._sync_state.sync_complete(batch_size, time.time() - start_time)
+
+    def _sync_value_file(self):
         assert self._value_file is not None
         self._value_file.sync()
 
         # Ticket #70 Data writer causes "already a transaction in progress" 
         # warning in the PostgreSQL log
-        if len(self._completions) == 0:
+        if len(self._completions) == 0 and self._pending_row_count == 0:
             return
 
-        # at this point we can complete all pending archives
+        # at this point we can insert the buffered rows 
+        # and complete all pending archives
 
         self._connection.begin_transaction()
         try:
+            self._flush_pending_rows()
             for completion in self._completions:
                 completion.pre_commit_process()
         except Exception:
-            self._log.exception("sync_value_file")
+            self._log.exception("_sync_value_file")
             self._connection.rollback()
             raise
         self._connection.commit()
 
+        self._pending_segment_rows[:] = []
+        self._pending_segment_sequence_rows[:] = []
+
         for completion in self._completions:
             completion.post_commit_process()
 
         self._completions[:] = []
 
+    @property
+    def _pending_row_count(self):
+        return len(self._pending_segment_rows) + \
+               len(self._pending_segment_sequence_rows)
+
+    def _flush_pending_rows(self):
+        """
+        insert the buffered segment and segment_sequence rows.
+        we expect to be called inside a transaction, segment rows first,
+        because segment_sequence rows refer to them
+        """
+        if self._pending_row_count == 0:
+            return
+        self._log.debug("flushing {0} segment rows {1} sequence rows".format(
+            len(self._pending_segment_rows),
+            len(self._pending_segment_sequence_rows)))
+        _insert_new_segment_rows(self._connection, 
+                                 self._pending_segment_rows)
+        _insert_segment_sequence_rows(self._connection, 
+                                      self._pending_segment_sequence_rows)
+
+    def _next_segment_id(self):
+        """
+        return a segment id from the block we have reserved,
+        reserve a new block if we have run out
+        """
+        if len(self._available_segment_ids) == 0:
+            self._available_segment_ids = _allocate_segment_ids(
+                self._connection, _segment_id_block_size
+            )
+            self._available_segment_ids.reverse()
+        return self._available_segment_ids.pop()
+
     @property
     def value_file_is_synced(self):
         assert self._value_file is not None
@@ -361,16 +428,23 @@ class Writer(object):
 
         timestamp = parse_timestamp_repr(timestamp_repr)
 
+        # the segment row is not inserted until the value file is synced
+        segment_id = self._next_segment_id()
+        self._pending_segment_rows.append({
+            "id"                    : segment_id,
+            "collection_id"         : collection_id,
+            "key"                   : key,
+            "status"                : segment_status_active,
+            "unified_id"            : unified_id,
+            "timestamp"             : timestamp,
+            "conjoined_part"        : conjoined_part,
+            "segment_num"           : segment_num,
+            "source_node_id"        : source_node_id,
+            "handoff_node_id"       : handoff_node_id,
+        })
+
         self._active_segments[segment_key] = {
-            "segment-id" : _insert_new_segment_row(self._connection,
-                                                   collection_id, 
-                                                   unified_id,
-                                                   key, 
-                                                   timestamp, 
-                                                   conjoined_part,
-                                                   segment_num,
-                                                   source_node_id,
-                                                   handoff_node_id),
+            "segment-id" : segment_id,
         }
 
     def store_sequence(
@@ -431,7 +505,9 @@ class Writer(object):
             collection_id, segment_entry["segment-id"], data
         )
 
-        _insert_segment_sequence_row(self._connection, segment_sequence_row)
+        self._pending_segment_sequence_rows.append(segment_sequence_row)
+        if self._pending_row_count >= _max_pending_rows:
+            self.sync_value_file()
 
     def set_tombstone(
         self, 
@@ -468,6 +544,11 @@ class Writer(object):
            * with a timestamp earlier than the specified time. 
         This is triggered by a web server restart
         """
+        for segment_row in self._pending_segment_rows:
+            if segment_row["source_node_id"] == source_node_id and \
+               segment_row["status"] == segment_status_active and \
+               segment_row["timestamp"] < timestamp:
+                segment_row["status"] = segment_status_cancelled
         _cancel_segment_rows(self._connection, source_node_id, timestamp)
 
     def cancel_active_archive(self, 
@@ -490,6 +571,12 @@ class Writer(object):
             self._active_segments.pop(segment_key)
         except KeyError:
             pass
+
+        for segment_row in self._pending_segment_rows:
+            if segment_row["unified_id"] == unified_id and \
+               segment_row["conjoined_part"] == conjoined_part and \
+               segment_row["segment_num"] == segment_num:
+                segment_row["status"] = segment_status_cancelled
         
         _cancel_segment_row(self._connection, 
                             unified_id, 
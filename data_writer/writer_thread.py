@@ -35,11 +35,17 @@ class WriterThread(Thread):
     """
     manage writes to filesystem
     """
-    def __init__(self, halt_event, node_id_dict, message_queue, push_client):
+    def __init__(self, 
+                 halt_event, 
+                 node_id_dict, 
+                 message_queue, 
+                 push_client, 
+                 sync_state):
         Thread.__init__(self, name="WriterThread")
         self._halt_event = halt_event
         self._node_id_dict = node_id_dict
         self._message_queue = message_queue
+        self._sync_state = sync_state
         self._database_connection = get_node_local_connection()
         self._active_segments = dict()
         self._completions = list()
@@ -88,7 +94,8 @@ class WriterThread(Thread):
                              file_space_info,
                              _repository_path,
                              self._active_segments,
-                             self._completions)
+                             self._completions,
+                             self._sync_state)
 
         log.debug("start halt_event loop")
         while not self._halt_event.is_set():
@@ -216,6 +223,7 @@ class WriterThread(Thread):
         reply["result"] = "success"
         # we don't send the reply until all value file dependencies have
         # been synced
+        self._sync_state.add_completion(message["segment-size"])
         self._completions.append(
             PostSyncCompletion(self._database_connection,
                                self._reply_pusher,
@@ -318,8 +326,35 @@ class WriterThread(Thread):
         )
 
         reply["result"] = "success"
+        self._sync_state.add_write(message["segment-size"])
         self._reply_pusher.send(reply)
 
+    def _check_active_segment(self, message, reply):
+        """
+        return True if the message is for a segment we are archiving,
+        otherwise send an error reply and return False
+        """
+        segment_key = (message["unified-id"], 
+                       message["conjoined-part"], 
+                       message["segment-num"], )
+        if segment_key in self._active_segments:
+            return True
+
+        # the web writer may have several sequences in flight, so it can
+        # send us the next sequence of an archive whose start failed
+        log = logging.getLogger("_check_active_segment")
+        error_message = "unknown segment {0} {1} {2} {3}".format(
+            message["collection-id"],
+            message["key"],
+            message["timestamp-repr"],
+            message["segment-num"])
+        log.error("request {0}: {1}".format(message["user-request-id"],
+                                            error_message))
+        reply["result"] = "unknown-segment"
+        reply["error-message"] = "segment is not being archived"
+        self._reply_pusher.send(reply)
+        return False
+
     def _handle_archive_key_next(self, message, data):
         log = logging.getLogger("_handle_archive_key_next")
         log.info("request {0}: {1} {2} {3} {4}".format(
@@ -381,6 +416,9 @@ class WriterThread(Thread):
             self._reply_pusher.send(reply)
             return
 
+        if not self._check_active_segment(message, reply):
+            return
+
         self._writer.store_sequence(
             message["collection-id"],
             message["key"],
@@ -398,6 +436,7 @@ class WriterThread(Thread):
         )
 
         reply["result"] = "success"
+        self._sync_state.add_write(message["segment-size"])
         self._reply_pusher.send(reply)
 
     def _handle_archive_key_final(self, message, data):
@@ -460,6 +499,9 @@ class WriterThread(Thread):
             self._reply_pusher.send(reply)
             return
 
+        if not self._check_active_segment(message, reply):
+            return
+
         self._writer.store_sequence(
             message["collection-id"],
             message["key"],
@@ -479,6 +521,7 @@ class WriterThread(Thread):
         reply["result"] = "success"
         # we don't send the reply until all value file dependencies have
         # been synced
+        self._sync_state.add_completion(message["segment-size"])
         self._completions.append(
             PostSyncCompletion(self._database_connection,
                                self._reply_pusher,
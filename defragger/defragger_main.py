@@ -4,7 +4,8 @@
 """
 defragger.py
 """
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import logging
 import os
@@ -19,8 +20,11 @@ from tools.event_push_client import EventPushClient, unhandled_exception_topic
 from tools.data_definitions import value_file_template
 from tools.file_space import load_file_space_info, \
         file_space_sanity_check, \
-        find_least_volume_space_id
+        find_least_volume_space_id, \
+        compute_volume_by_space_id
 from tools.output_value_file import OutputValueFile
+from tools.relocation_journal import RelocationJournal
+from tools.token_bucket import TokenBucket
 from tools.process_util import set_signal_handler
 
 from defragger.input_value_file import InputValueFile
@@ -41,6 +45,19 @@ _repository_path = os.environ["NIMBUSIO_REPOSITORY_PATH"]
 _max_value_file_size = int(os.environ.get(
     "NIMBUS_IO_MAX_VALUE_FILE_SIZE", str(1024 * 1024 * 1024))
 )
+# each volume holding input value files gets its own pool of reader threads.
+# we keep up to _max_pending_reads reads in flight ahead of the writer
+_readers_per_volume = int(
+    os.environ.get("NIMBUSIO_DEFRAGGER_READERS_PER_VOLUME", "2")
+)
+_max_pending_reads = int(
+    os.environ.get("NIMBUSIO_DEFRAGGER_MAX_PENDING_READS", "16")
+)
+# limit the bandwidth we read at, so foreground reads are not starved.
+# 0 means no limit
+_max_mb_per_second = float(
+    os.environ.get("NIMBUSIO_DEFRAGGER_MAX_MB_PER_SECOND", "0")
+)
 
 _reference_template = namedtuple("Reference", [
     "segment_id",
@@ -137,11 +154,25 @@ def _query_value_file_references(connection, value_file_ids):
     for row in result:
         yield  _reference_template._make(row)
 
-def _generate_work(connection, file_space_info, value_file_rows):
+def _generate_work(connection, 
+                   file_space_info, 
+                   value_file_rows, 
+                   close_output_value_file):
+    """
+    yield (reference, output_value_file) for each reference to the value
+    files, in the order they are to be written.
+
+    When we are finished with an output value file we pass it to
+    close_output_value_file, rather than closing it here, because the
+    caller may not have written all its data yet
+    """
     log = logging.getLogger("_generate_work")
     prev_handoff_node_id = None
     prev_collection_id = None
     output_value_file = None
+    # the caller writes behind us, so we keep track of how much we have
+    # handed out for the current output value file ourselves
+    output_size = 0
     for reference in _query_value_file_references(
         connection, [row.id for row in value_file_rows]
     ):
@@ -155,7 +186,7 @@ def _generate_work(connection, file_space_info, value_file_rows):
                         )
                     )
                     assert output_value_file is not None
-                    output_value_file.close()
+                    close_output_value_file(output_value_file)
                     output_value_file = None
                 log.debug(
                     "opening value file for handoff node {0}".format(
@@ -168,6 +199,7 @@ def _generate_work(connection, file_space_info, value_file_rows):
                 output_value_file = OutputValueFile(connection, 
                                                     space_id, 
                                                     _repository_path)
+                output_size = 0
                 prev_handoff_node_id = reference.handoff_node_id
         elif reference.collection_id != prev_collection_id:
             if prev_handoff_node_id is not None:
@@ -177,7 +209,7 @@ def _generate_work(connection, file_space_info, value_file_rows):
                     )
                 )
                 assert output_value_file is not None
-                output_value_file.close()
+                close_output_value_file(output_value_file)
                 output_value_file = None
                 prev_handoff_node_id = None
 
@@ -189,7 +221,7 @@ def _generate_work(connection, file_space_info, value_file_rows):
                     )
                 )
                 assert output_value_file is not None
-                output_value_file.close()
+                close_output_value_file(output_value_file)
                 output_value_file = None
 
             log.debug(
@@ -203,22 +235,25 @@ def _generate_work(connection, file_space_info, value_file_rows):
             output_value_file = OutputValueFile(
                 connection, space_id, _repository_path
             )
+            output_size = 0
             prev_collection_id = reference.collection_id
 
         assert output_value_file is not None
 
         # if this write would put us over the max size,
         # start a new output value file
-        expected_size = output_value_file.size + reference.sequence_size
+        expected_size = output_size + reference.sequence_size
         if expected_size > _max_value_file_size:
             log.debug("closing value_file and opening new one due to size")
-            output_value_file.close()
+            close_output_value_file(output_value_file)
             space_id = find_least_volume_space_id("storage", 
                                                   file_space_info)
             output_value_file = OutputValueFile(
                 connection, space_id, _repository_path
             )
+            output_size = 0
 
+        output_size += reference.sequence_size
         yield reference, output_value_file
     
     if prev_handoff_node_id is not None:
@@ -235,7 +270,39 @@ def _generate_work(connection, file_space_info, value_file_rows):
             )
         )
 
-    output_value_file.close()
+    close_output_value_file(output_value_file)
+
+def _read_and_verify(input_value_file, reference, token_bucket):
+    """
+    read one segment sequence from an input value file and check its md5
+    this runs in a reader thread
+    return the data, or None if it does not match the database
+    """
+    log = logging.getLogger("_read_and_verify")
+    token_bucket.consume(reference.sequence_size)
+    data = input_value_file.read(
+        reference.value_file_offset, reference.sequence_size
+    )
+    sequence_md5 = hashlib.md5()
+    sequence_md5.update(data)
+    if sequence_md5.digest() != bytes(reference.sequence_hash):
+        log.error(
+            "md5 mismatch {0} {1} {2} {3} {4} {5} {6} {7} {8}".format(
+                reference.segment_id,
+                reference.handoff_node_id,
+                reference.collection_id, 
+                reference.key, 
+                reference.timestamp,
+                reference.sequence_num,
+                reference.value_file_id,
+                reference.value_file_offset,
+                reference.sequence_size
+            )
+        )
+        #TODO - insert into repair table
+        return None
+
+    return data
 
 def _defrag_pass(connection, file_space_info, event_push_client):
     """
@@ -245,6 +312,10 @@ def _defrag_pass(connection, file_space_info, event_push_client):
      * one distinct value file per handoff node, regardless of collection_id
      * one distinct value file per collection_id
 
+    Segment sequences are read and verified by a pool of threads for each
+    volume, up to _max_pending_reads ahead of the writer. We write them
+    here, in order, so each output value file is written sequentially.
+
     return the number of bytes defragged
     """
     log = logging.getLogger("_defrag_pass")
@@ -255,7 +326,9 @@ def _defrag_pass(connection, file_space_info, event_push_client):
     if defraggable_bytes == 0:
         return 0
 
+    volume_by_space_id = compute_volume_by_space_id(file_space_info)
     input_value_files = dict()
+    input_volumes = dict()
     for value_file_row in value_file_rows:
         try:
             input_value_file = InputValueFile(
@@ -266,34 +339,35 @@ def _defrag_pass(connection, file_space_info, event_push_client):
             continue
 
         input_value_files[input_value_file.value_file_id] = input_value_file
+        input_volumes[input_value_file.value_file_id] = \
+            volume_by_space_id.get(value_file_row.space_id, 
+                                   value_file_row.space_id)
+
+    reader_pools = dict()
+    for volume_name in set(input_volumes.values()):
+        reader_pools[volume_name] = \
+            ThreadPoolExecutor(max_workers=_readers_per_volume)
+    token_bucket = TokenBucket(_max_mb_per_second * 1024 * 1024)
+
+    # the write pipeline holds, in order:
+    # (reference, output_value_file, future) for a sequence to be written 
+    # (None, output_value_file, None) for an output value file to be closed
+    write_pipeline = deque()
+    def _close_output_value_file(output_value_file):
+        write_pipeline.append((None, output_value_file, None, ))
 
     bytes_defragged = 0
-    for reference, output_value_file in _generate_work(
-        connection, file_space_info, value_file_rows
-    ):
-        # read the segment sequence from the old value_file
-        input_value_file = input_value_files[reference.value_file_id]
-        data = input_value_file.read(
-            reference.value_file_offset, reference.sequence_size
-        )
-        sequence_md5 = hashlib.md5()
-        sequence_md5.update(data)
-        if sequence_md5.digest() != bytes(reference.sequence_hash):
-            log.error(
-                "md5 mismatch {0} {1} {2} {3} {4} {5} {6} {7} {8}".format(
-                    reference.segment_id,
-                    reference.handoff_node_id,
-                    reference.collection_id, 
-                    reference.key, 
-                    reference.timestamp,
-                    reference.sequence_num,
-                    reference.value_file_id,
-                    reference.value_file_offset,
-                    reference.sequence_size
-                )
-            )
-            #TODO - insert into repair table
-            continue
+    relocation_journal = RelocationJournal()
+
+    def _write_one():
+        reference, output_value_file, future = write_pipeline.popleft()
+        if reference is None:
+            output_value_file.close()
+            return 0
+
+        data = future.result()
+        if data is None:
+            return 0
 
         # write the segment_sequence to the new value file
         new_value_file_offset = output_value_file.size
@@ -302,19 +376,45 @@ def _defrag_pass(connection, file_space_info, event_push_client):
             reference.segment_id, 
             data
         )
-        bytes_defragged += reference.sequence_size
 
         # adjust segment_sequence row
-        connection.execute("""
-            update nimbusio_node.segment_sequence
-            set value_file_id = %s, value_file_offset = %s
-            where collection_id = %s and segment_id = %s
-            and sequence_num = %s
-        """, [output_value_file.value_file_id, 
-              new_value_file_offset,
-              reference.collection_id,
-              reference.segment_id,
-              reference.sequence_num])
+        relocation_journal.add(reference.collection_id,
+                               reference.segment_id,
+                               reference.sequence_num,
+                               output_value_file.value_file_id, 
+                               new_value_file_offset)
+
+        return reference.sequence_size
+
+    try:
+        for reference, output_value_file in _generate_work(
+            connection, 
+            file_space_info, 
+            value_file_rows, 
+            _close_output_value_file
+        ):
+            input_value_file = input_value_files[reference.value_file_id]
+            reader_pool = reader_pools[input_volumes[reference.value_file_id]]
+            future = reader_pool.submit(_read_and_verify,
+                                        input_value_file,
+                                        reference,
+                                        token_bucket)
+            write_pipeline.append((reference, output_value_file, future, ))
+
+            while len(write_pipeline) > _max_pending_reads:
+                bytes_defragged += _write_one()
+
+        while len(write_pipeline) > 0:
+            bytes_defragged += _write_one()
+    finally:
+        for _, _, future in write_pipeline:
+            if future is not None:
+                future.cancel()
+        for reader_pool in reader_pools.values():
+            reader_pool.shutdown(wait=True)
+
+    relocation_count = relocation_journal.apply(connection)
+    log.info("relocated {0:,} segment sequences".format(relocation_count))
 
     # close (and remove) the old value files
     for input_value_file in input_value_files.values():
@@ -37,7 +37,7 @@ class InputValueFile(object):
     def read(self, offset, size):
         """
         return data from the file
+        we use pread, so several threads can read from the same file
         """
-        self._value_file.seek(offset)
-        return self._value_file.read(size)
+        return os.pread(self._value_file.fileno(), size, offset)
 
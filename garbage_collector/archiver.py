@@ -55,7 +55,10 @@ and age(timestamp) > %(max_node_offline_time)s::interval;
 """
 
 def _archive_collectable_segment_rows(
-    connection, collectable_segment_ids, max_node_offline_time
+    connection, 
+    collectable_segment_ids, 
+    max_node_offline_time,
+    archive_old_tombstones
 ):
     connection.execute(_create_temp_table, [])
 
@@ -78,11 +81,16 @@ def _archive_collectable_segment_rows(
     connection.execute(_delete_segment_sequences, [])
 
     # finally clean out old tombstones
-    connection.execute(_archive_old_tombstones, 
-                       {"max_node_offline_time" : max_node_offline_time, })
+    if archive_old_tombstones:
+        connection.execute(_archive_old_tombstones, 
+                           {"max_node_offline_time" : max_node_offline_time, })
 
 def archive_collectable_segment_rows(
-    connection, collectable_segment_ids, max_node_offline_time
+    connection, 
+    collectable_segment_ids, 
+    max_node_offline_time,
+    archive_old_tombstones=True,
+    before_commit=None
 ):
     """
     In a DB transaction:
@@ -93,12 +101,19 @@ def archive_collectable_segment_rows(
       * with an ID in the temp table, 
       * OR are a tombstone older than MAX_NODE_OFFLINE_TIME
     insert the rows from the table expression into segment_archived
+
+    When we archive in chunks, the caller can skip archiving old tombstones
+    for all but one chunk, and use before_commit(connection) to record its
+    progress in the same transaction.
     """
     connection.begin_transaction()
     try:
         _archive_collectable_segment_rows(connection, 
                                           collectable_segment_ids,
-                                          max_node_offline_time)
+                                          max_node_offline_time,
+                                          archive_old_tombstones)
+        if before_commit is not None:
+            before_commit(connection)
     except Exception:
         connection.rollback()
         raise
@@ -31,6 +31,35 @@ with batched_rows as (
 select * from batched_rows where key_row_count > 1;
 """
 
+# the same, but only for the keys claimed from gc_dirty_key at the start of
+# the current run.
+# When we resume an interrupted run, we skip the keys we have already done.
+_dirty_rows_for_key_query = """
+set search_path to nimbusio_node, public;
+with dirty_keys as (
+    select distinct collection_id, key
+    from gc_dirty_key
+    where claimed
+    and (%(last_collection_id)s::int4 is null 
+         or (collection_id, key) > 
+            (%(last_collection_id)s::int4, %(last_key)s::varchar))
+),
+batched_rows as (
+    select id, collection_id, key, status, unified_id, 
+        file_tombstone_unified_id,
+        row_number() over key_rows as key_row_num,
+        count(*) over key_rows as key_row_count
+        from segment
+        inner join dirty_keys using (collection_id, key)
+        where handoff_node_id is null 
+    window key_rows as (partition by collection_id, key order by unified_id asc
+            range between unbounded preceding and unbounded following 
+    )
+    order by collection_id, key, unified_id
+)
+select * from batched_rows where key_row_count > 1;
+"""
+
 def _test_partition(partition):
     """
     Consistency checks suggested by Alan 
@@ -39,20 +68,18 @@ def _test_partition(partition):
         list(range(1, 1 + len(partition)))
     assert all([r.key_row_count == len(partition) for r in partition])
 
-def generate_candidate_partitions(connection):
+def _generate_partitions(rows):
     """
-    * Select all records ordered by collection_id, key, unified_id, 
-      having more than one row per collection_id and key
-    * Gather rows into partitions within memory. 
-      A partition is all rows for the same collection_id and key 
-      (the same thing that the SQL window functions are partitioning by. 
-      So at the start of every partition, key_row_num=1, 
-      and at the end of every partition, key_row_num=key_row_count.)
-    * Yield one partition at a time
+    Gather rows into partitions within memory. 
+    A partition is all rows for the same collection_id and key 
+    (the same thing that the SQL window functions are partitioning by. 
+    So at the start of every partition, key_row_num=1, 
+    and at the end of every partition, key_row_num=key_row_count.)
+    Yield one partition at a time
     """
     current_partition_id = None
     current_partition = list()
-    for row in connection.generate_all_rows(_multiple_rows_for_key_query, []):
+    for row in rows:
         entry = _partition_entry._make(row)
         partition_id = (entry.collection_id, entry.key, )
 
@@ -70,3 +97,31 @@ def generate_candidate_partitions(connection):
         _test_partition(current_partition)
         yield current_partition
 
+def generate_candidate_partitions(connection):
+    """
+    * Select all records ordered by collection_id, key, unified_id, 
+      having more than one row per collection_id and key
+    * Yield one partition at a time
+    """
+    return _generate_partitions(
+        connection.generate_all_rows(_multiple_rows_for_key_query, [])
+    )
+
+def generate_dirty_partitions(connection, 
+                              last_collection_id,
+                              last_key):
+    """
+    * Select records, ordered by collection_id, key, unified_id, 
+      having more than one row per collection_id and key, for only
+      those collection_id and key claimed from gc_dirty_key
+    * skip the keys up to and including (last_collection_id, last_key),
+      unless last_collection_id is None
+    * Yield one partition at a time
+    """
+    return _generate_partitions(
+        connection.generate_all_rows(
+            _dirty_rows_for_key_query, 
+            {"last_collection_id"   : last_collection_id,
+             "last_key"             : last_key, }
+        )
+    )
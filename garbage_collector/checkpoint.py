@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+checkpoint.py
+
+progress of the garbage collector, kept in the single row
+nimbusio_node.gc_checkpoint table, so it is updated in the same
+transaction as the segment rows we archive.
+
+A trigger on segment logs the (collection_id, key) of every row inserted,
+or changing status, in nimbusio_node.gc_dirty_key, in the same transaction
+as the change. So the log holds exactly the keys whose changes have
+committed, whatever order their segment ids were allocated in.
+
+At the start of a run we claim the committed log rows. An incremental run
+only re-evaluates the claimed keys. Rows committed while the run is in
+progress are left unclaimed for the next run. The claimed rows are deleted
+in the transaction that finishes the run.
+"""
+from collections import namedtuple
+import logging
+
+checkpoint_template = namedtuple("Checkpoint", [
+    "run_in_progress",
+    "last_collection_id",
+    "last_key", ])
+
+def load_checkpoint(connection):
+    """
+    return the checkpoint, creating it if this is our first run
+    """
+    row = connection.fetch_one_row("""
+        select run_in_progress,
+               last_collection_id,
+               last_key
+        from nimbusio_node.gc_checkpoint""", [])
+    if row is None:
+        connection.execute("""
+            insert into nimbusio_node.gc_checkpoint (run_in_progress)
+            values (false)""", [])
+        return checkpoint_template(run_in_progress=False,
+                                   last_collection_id=None,
+                                   last_key=None)
+
+    return checkpoint_template._make(row)
+
+def start_run(connection, checkpoint):
+    """
+    claim the dirty keys committed so far, and record that a run is in
+    progress, so an interrupted run resumes with the same keys
+
+    return the updated checkpoint
+    """
+    connection.begin_transaction()
+    try:
+        claimed_count = connection.execute("""
+            update nimbusio_node.gc_dirty_key
+            set claimed = true
+            where not claimed""", [])
+        connection.execute("""
+            update nimbusio_node.gc_checkpoint
+            set run_in_progress = true,
+                last_collection_id = null,
+                last_key = null""", [])
+    except Exception:
+        connection.rollback()
+        raise
+    else:
+        connection.commit()
+
+    log = logging.getLogger("start_run")
+    log.info("claimed {0:,} dirty key rows".format(claimed_count))
+
+    return checkpoint._replace(run_in_progress=True,
+                               last_collection_id=None,
+                               last_key=None)
+
+def save_progress(connection, last_collection_id, last_key):
+    """
+    record the last partition archived by the current run
+    """
+    connection.execute("""
+        update nimbusio_node.gc_checkpoint
+        set last_collection_id = %s,
+            last_key = %s""", [last_collection_id, last_key, ])
+
+def finish_run(connection):
+    """
+    forget the dirty keys claimed at the start of the run
+    """
+    connection.execute("""
+        delete from nimbusio_node.gc_dirty_key
+        where claimed""", [])
+    connection.execute("""
+        update nimbusio_node.gc_checkpoint
+        set run_in_progress = false,
+            last_collection_id = null,
+            last_key = null""", [])
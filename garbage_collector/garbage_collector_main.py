@@ -22,8 +22,13 @@ from tools.data_definitions import segment_status_active, \
 from garbage_collector.options import get_options
 from garbage_collector.versioned_collections import get_versioned_collections
 from garbage_collector.candidate_partition_generator import \
-        generate_candidate_partitions
+        generate_candidate_partitions, \
+        generate_dirty_partitions
 from garbage_collector.archiver import archive_collectable_segment_rows
+from garbage_collector.checkpoint import load_checkpoint, \
+        start_run, \
+        save_progress, \
+        finish_run
 
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
 _log_path = "{0}/nimbusio_garbage_collector_{1}.log".format(
@@ -127,6 +132,88 @@ def _evaluate_partition(
 
     return collectable_count
 
+def _save_progress_closure(collection_id, key):
+    def _save_progress(connection):
+        save_progress(connection, collection_id, key)
+    return _save_progress
+
+def _collect_garbage(connection, options, versioned_collections, partitions):
+    """
+    evaluate the partitions, archiving the collectable segments in chunks 
+    of about options.archive_chunk_size segments, each in its own 
+    transaction. A partition is never split across chunks.
+
+    In incremental mode, each chunk records the last partition it
+    archived in the checkpoint. In either mode, the last chunk finishes 
+    the run.
+
+    return (partition_count, collectable_count, )
+    """
+    log = logging.getLogger("_collect_garbage")
+    partition_count = 0
+    collectable_count = 0
+    chunk_count = 0
+    collectable_segment_ids = io.StringIO()
+
+    for partition in partitions:
+        partition_count += 1
+        versioned_collection = \
+                partition[0].collection_id in versioned_collections
+        count = _evaluate_partition(collectable_segment_ids, 
+                                    partition,
+                                    versioned_collection)
+        collectable_count += count
+        chunk_count += count
+
+        if chunk_count >= options.archive_chunk_size:
+            log.info("archiving chunk of {0:,} segments".format(chunk_count))
+            before_commit = None
+            if options.incremental:
+                before_commit = _save_progress_closure(
+                    partition[0].collection_id, partition[0].key
+                )
+            archive_collectable_segment_rows(connection, 
+                                             collectable_segment_ids,
+                                             options.max_node_offline_time,
+                                             archive_old_tombstones=False,
+                                             before_commit=before_commit)
+            collectable_segment_ids.close()
+            collectable_segment_ids = io.StringIO()
+            chunk_count = 0
+
+    archive_collectable_segment_rows(
+        connection, 
+        collectable_segment_ids,
+        options.max_node_offline_time,
+        before_commit=finish_run
+    )
+    collectable_segment_ids.close()
+
+    return partition_count, collectable_count
+
+def _candidate_partitions(connection, options):
+    """
+    return a generator of the partitions to evaluate
+    """
+    log = logging.getLogger("_candidate_partitions")
+    checkpoint = load_checkpoint(connection)
+
+    if not options.incremental:
+        # we evaluate every key, so we take care of all the dirty keys
+        # committed before we start
+        start_run(connection, checkpoint)
+        return generate_candidate_partitions(connection)
+
+    if not checkpoint.run_in_progress:
+        checkpoint = start_run(connection, checkpoint)
+    else:
+        log.info("resuming run after ({0}, {1})".format(
+            checkpoint.last_collection_id, checkpoint.last_key))
+
+    return generate_dirty_partitions(connection,
+                                     checkpoint.last_collection_id,
+                                     checkpoint.last_key)
+
 def main():
     """
     main entry point
@@ -151,25 +238,17 @@ def main():
 
     return_code = 0
 
-    collectable_segment_ids = io.StringIO()
-
     partition_count = 0
     collectable_count = 0
 
     try:
         versioned_collections = get_versioned_collections()
-        for partition in generate_candidate_partitions(connection):
-            partition_count += 1
-            versioned_collection = \
-                    partition[0].collection_id in versioned_collections
-            count = _evaluate_partition(collectable_segment_ids, 
-                                        partition,
-                                        versioned_collection)
-            collectable_count += count
-        archive_collectable_segment_rows(connection, 
-                                         collectable_segment_ids,
-                                         options.max_node_offline_time)
-        collectable_segment_ids.close()
+        partitions = _candidate_partitions(connection, options)
+        partition_count, collectable_count = \
+            _collect_garbage(connection, 
+                             options, 
+                             versioned_collections, 
+                             partitions)
     except Exception:
         log.exception("_garbage_collection")
         return_code = -2
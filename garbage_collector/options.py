@@ -24,6 +24,10 @@ _min_savings_size = int(
 _min_savings_ratio = float(
     os.environ.get("NIMBUSIO_GC_MIN_SAVINGS_RATIO", "0.03")
 )
+_incremental = os.environ.get("NIMBUSIO_GC_INCREMENTAL", "0") == "1"
+_archive_chunk_size = int(
+    os.environ.get("NIMBUSIO_GC_ARCHIVE_CHUNK_SIZE", "100000")
+)
 
 def _parse_command_line():
     """
@@ -50,6 +54,16 @@ def _parse_command_line():
     parser.add_argument("-c", "--collection-id", 
                          type=int,
                          default=None)
+    parser.add_argument("-i", "--incremental", 
+                         action="store_true",
+                         default=_incremental,
+                         help="only evaluate keys with segment rows changed "
+                              "since the last run")
+    parser.add_argument("-a", "--archive-chunk-size", 
+                         type=int,
+                         default=_archive_chunk_size,
+                         help="archive collectable segments in transactions"
+                              " of about this many segments")
     return parser.parse_args()
         
 def get_options():
@@ -70,6 +84,8 @@ def get_options():
     log.info("min_savings_ratio = {0}".format( options.min_savings_ratio))
     if options.collection_id is not None:
         log.info("collection = ${0}".format(options.collection_id))
+    log.info("incremental = {0}".format(options.incremental))
+    log.info("archive_chunk_size = {0}".format(options.archive_chunk_size))
 
     return options
 
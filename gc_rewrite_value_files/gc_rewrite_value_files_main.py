@@ -62,7 +62,7 @@ def main():
         unreachable_value_file_size = unlink_unreachable_value_files(
             connection, _repository_path)
         ref_generator =  generate_value_file_references(options, connection)
-        savings = rewrite_value_files(
+        savings, savings_per_gib = rewrite_value_files(
             options, connection, _repository_path, ref_generator)
     except Exception:
         log.exception("_garbage_collection")
@@ -75,7 +75,8 @@ def main():
             "garbage_collector finished",
             unused_value_file_bytes_reclaimed=total_unused_value_file_size,
             unreachable_value_file_bytes_reclaimed=unreachable_value_file_size,
-            rewrite_value_file_savings=savings
+            rewrite_value_file_savings=savings,
+            rewrite_value_file_savings_per_gib=savings_per_gib
         )  
 
     connection.close()
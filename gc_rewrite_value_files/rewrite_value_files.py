@@ -13,11 +13,80 @@ from tools.file_space import load_file_space_info, \
                              file_space_sanity_check, \
                              find_least_volume_space_id
 from tools.output_value_file import OutputValueFile
+from tools.relocation_journal import RelocationJournal
 
 _max_value_file_size = int(os.environ.get(
     "NIMBUS_IO_MAX_VALUE_FILE_SIZE", str(1024 ** 3))
 )
 
+# when we read the live references from an input value file, we read 
+# neighboring references with a single pread if the garbage between them
+# is no larger than this, and no larger than the reference we would read
+# with it, so a read is never more than half garbage
+_max_coalesce_gap = int(os.environ.get(
+    "NIMBUSIO_GC_MAX_COALESCE_GAP", str(64 * 1024))
+)
+
+def _coalesce_ranges(refs):
+    """
+    refs 
+        the references to a single value file, sorted by value_file_offset
+
+    return a list of (read_offset, read_size, refs, ) for the preads 
+    needed to read all the references
+    """
+    ranges = list()
+    for ref in refs:
+        if len(ranges) > 0:
+            read_offset, read_size, range_refs = ranges[-1]
+            gap = ref.value_file_offset - (read_offset + read_size)
+            if 0 <= gap <= min(_max_coalesce_gap, ref.data_size):
+                ranges[-1] = (read_offset, 
+                              ref.value_file_offset + ref.data_size - \
+                                read_offset,
+                              range_refs + [ref, ], )
+                continue
+
+        ranges.append((ref.value_file_offset, ref.data_size, [ref, ], ))
+
+    return ranges
+
+def _read_live_data(repository_path, refs):
+    """
+    refs 
+        the references to a single value file, sorted by value_file_offset
+
+    read only the referenced data, not the garbage between it
+    return (live_data, memory_size, ) where live_data maps value_file_offset
+    to the data for each reference, and memory_size is the number of bytes 
+    we hold
+
+    Each reference is copied out of the read, so the garbage a coalesced
+    read picked up is freed with it, and we hold only live bytes.
+    """
+    value_file_path = compute_value_file_path(repository_path, 
+                                              refs[0].space_id, 
+                                              refs[0].value_file_id)
+    live_data = dict()
+    memory_size = 0
+    value_file_fd = os.open(value_file_path, os.O_RDONLY)
+    try:
+        for read_offset, read_size, range_refs in _coalesce_ranges(refs):
+            range_data = memoryview(
+                os.pread(value_file_fd, read_size, read_offset)
+            )
+            for ref in range_refs:
+                data_offset = ref.value_file_offset - read_offset
+                live_data[ref.value_file_offset] = \
+                    range_data[data_offset:data_offset+ref.data_size].tobytes()
+                memory_size += ref.data_size
+            range_data.release()
+            del range_data
+    finally:
+        os.close(value_file_fd)
+
+    return live_data, memory_size
+
 def _allocate_output_value_files(connection, repository_path, refs):
     output_value_file_sizes = defaultdict(list)
 
@@ -62,6 +131,7 @@ def _process_batch(connection, repository_path, refs, value_file_data):
                                                       repository_path, refs)
 
     # Within each target file, records sorted by key and unified_id.
+    relocation_journal = RelocationJournal()
     work_collection_id = None
     value_files = None
     index = 0
@@ -81,10 +151,7 @@ def _process_batch(connection, repository_path, refs, value_file_data):
             index += 1
 
         value_file_key = (ref.value_file_id, ref.space_id, )
-        data_block = value_file_data[value_file_key]
-        data = data_block[
-            ref.value_file_offset:ref.value_file_offset+ref.data_size
-        ]
+        data = value_file_data[value_file_key][ref.value_file_offset]
         data_md5 = hashlib.md5(data)
         if data_md5.digest() != bytes(ref.data_hash):
             log.error(
@@ -108,16 +175,13 @@ def _process_batch(connection, repository_path, refs, value_file_data):
         )
 
         # adjust segment_sequence row
-        connection.execute("""
-            update nimbusio_node.segment_sequence
-            set value_file_id = %s, value_file_offset = %s
-            where collection_id = %s and segment_id = %s
-            and sequence_num = %s
-        """, [value_files[index].value_file_id, 
-              value_file_offset,
-              ref.collection_id,
-              ref.segment_id,
-              ref.sequence_num])
+        relocation_journal.add(ref.collection_id,
+                               ref.segment_id,
+                               ref.sequence_num,
+                               value_files[index].value_file_id, 
+                               value_file_offset)
+
+    relocation_journal.apply(connection)
 
     # heave all the old value files from the database
     for value_file_id, _space_id in value_file_data.keys():
@@ -146,15 +210,33 @@ def _remove_old_value_files(repository_path, value_file_keys):
         except Exception:       
             log.exception(value_file_path)
 
+def _log_batch(batch_size, output_size, memory_size):
+    log = logging.getLogger("_log_batch")
+    savings = batch_size - output_size
+    log.debug(
+        "batch_size={0:,}, output_size={1:,}, savings={2:,}, "
+        "memory_size={3:,}".format(
+            batch_size, output_size, savings, memory_size
+    ))
+
 def rewrite_value_files(options, connection, repository_path, ref_generator):
+    """
+    rewrite the live references from value files with a lot of garbage
+    into new value files, in batches of no more than max_sort_mem bytes
+
+    return (savings, savings_per_gib, ) where savings_per_gib is the
+    number of bytes reclaimed for each GiB of memory used by the
+    largest batch
+    """
     log = logging.getLogger("_rewrite_value_files")
     max_sort_mem = options.max_sort_mem * 1024 ** 3
 
     total_batch_size = 0
     total_output_size = 0
-    savings = 0
+    max_memory_size = 0
 
     batch_size = 0
+    memory_size = 0
     refs = list()
     value_file_data = dict()
 
@@ -168,7 +250,17 @@ def rewrite_value_files(options, connection, repository_path, ref_generator):
         # this should be the start of a partition
         assert ref.value_row_num == 1, ref
 
-        if batch_size + ref.value_file_size > max_sort_mem:
+        # load up the refs for this partition (value file)
+        partition_refs = [ref, ]
+        for _ in range(ref.value_row_count-1):
+            partition_refs.append(next(ref_generator)) 
+
+        # we budget memory only for the live references, not the 
+        # garbage in the value file: _read_live_data holds only live bytes,
+        # and its coalesced reads are at most twice the live bytes in them
+        live_size = sum([r.data_size for r in partition_refs])
+
+        if len(refs) > 0 and memory_size + live_size > max_sort_mem:
             connection.begin_transaction()
             try:
                 output_size = _process_batch(connection, 
@@ -183,39 +275,23 @@ def rewrite_value_files(options, connection, repository_path, ref_generator):
 
             total_batch_size += batch_size
             total_output_size += output_size
-            savings = batch_size - output_size
-            log.debug(
-                "batch_size={0:,}, output_size={1:,}, savings={2:,}".format(
-                    batch_size, output_size, savings
-            ))
+            max_memory_size = max(max_memory_size, memory_size)
+            _log_batch(batch_size, output_size, memory_size)
 
             batch_size = 0
+            memory_size = 0
             refs = list()
             value_file_data = dict()
             
         batch_size += ref.value_file_size
 
-        # get the value file data
-        # TODO: we should only store the actual references from the files into 
-        # memory, not keep the whole files into memory.  Keeping the whole file 
-        # in memory means we're using memory for parts of the files that are 
-        # garbage, effectively decreasing the size of our output sort batch.  
-        # We could end up with very small outputs from each batch if a large 
-        # portion of the input value files are garbage.
-
         value_file_key = (ref.value_file_id, ref.space_id, )
         assert value_file_key not in value_file_data
-        value_file_path = \
-                compute_value_file_path(repository_path, 
-                                        ref.space_id, 
-                                        ref.value_file_id)
-        with open(value_file_path, "rb") as input_file:
-            value_file_data[value_file_key] = input_file.read()
+        value_file_data[value_file_key], partition_memory_size = \
+                _read_live_data(repository_path, partition_refs)
+        memory_size += partition_memory_size
 
-        # load up the refs for this partition
-        refs.append(ref)
-        for _ in range(ref.value_row_count-1):
-            refs.append(next(ref_generator)) 
+        refs.extend(partition_refs)
 
     if len(refs) > 0:
         connection.begin_transaction()
@@ -233,16 +309,21 @@ def rewrite_value_files(options, connection, repository_path, ref_generator):
 
         total_batch_size += batch_size
         total_output_size += output_size
-        savings = batch_size - output_size
-        log.debug("batch_size={0:,}, output_size={1:,}, savings={2:,}".format(
-            batch_size, output_size, savings
-        ))
+        max_memory_size = max(max_memory_size, memory_size)
+        _log_batch(batch_size, output_size, memory_size)
 
     savings = total_batch_size - total_output_size
+    savings_per_gib = 0
+    if max_memory_size > 0:
+        savings_per_gib = int(savings * (1024 ** 3) / max_memory_size)
     log.info(
-        "total_batch_size={0:,} total_output_size={1:,} savings={2:,}".format(
-            total_batch_size, total_output_size, savings
+        "total_batch_size={0:,} total_output_size={1:,} savings={2:,} "
+        "max_memory_size={3:,} savings_per_gib={4:,}".format(
+            total_batch_size, 
+            total_output_size, 
+            savings, 
+            max_memory_size,
+            savings_per_gib
     ))
 
-    return savings
-
+    return savings, savings_per_gib
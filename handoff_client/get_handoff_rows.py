@@ -5,9 +5,18 @@ segment_rows.py
 retrieve segment rows to be handed off
 """
 import base64
+import heapq
+import logging
+import queue
+from threading import Event, Thread
 
 import psycopg2.extras
 
+_cursor_name = "handoff_client_segment_handoffs"
+_batch_size = 1000
+_queue_depth = 4
+_queue_timeout = 1.0
+
 def _retrieve_conjoined_handoffs(cursor, node_id):
     query = """
         select * from nimbusio_node.conjoined
@@ -27,45 +36,151 @@ def _retrieve_conjoined_handoffs(cursor, node_id):
 
     return conjoined_row_list
 
-def _retrieve_segment_handoffs(cursor, node_id):
+def _segment_row_dict(row):
+    # bytea columns come out of the database as buffer objects
+    if row["file_hash"] is not None: 
+        # gotta jump through hoops to get base64 on python 3
+        encoded_bytes = base64.b64encode(bytes(row["file_hash"]))
+        encoded_string = str(encoded_bytes)
+        # this gives us a string of the form "b'<data>'"
+        # what we want is <data>
+        row["file_hash"] = encoded_string[2:-1]
+    # row is of type psycopg2.extras.RealDictRow
+    # we want an honest dict
+    return dict(row.items())
+
+def _put(row_queue, item, stop_event):
+    """
+    put item on the queue, unless the consumer stops first
+    """
+    while not stop_event.is_set():
+        try:
+            row_queue.put(item, timeout=_queue_timeout)
+        except queue.Full:
+            continue
+        return
+
+def _stream_segment_handoffs(connection, node_id, row_queue, stop_event):
+    """
+    run in a thread: read the segment handoffs from one node database 
+    through a server side cursor, and put them on row_queue in batches, 
+    newest first. Put None at the end, or the exception if we fail.
+    """
+    log = logging.getLogger("_stream_segment_handoffs")
     query = """
         select * from nimbusio_node.segment 
         where handoff_node_id = %s
-        order by timestamp desc
+        order by unified_id desc, conjoined_part desc
     """
-    cursor.execute(query, [node_id, ])
-
-    segment_row_list = list()
-    for row in cursor.fetchall():
-        # bytea columns come out of the database as buffer objects
-        if row["file_hash"] is not None: 
-            # gotta jump through hoops to get base64 on python 3
-            encoded_bytes = base64.b64encode(bytes(row["file_hash"]))
-            encoded_string = str(encoded_bytes)
-            # this gives us a string of the form "b'<data>'"
-            # what we want is <data>
-            row["file_hash"] = encoded_string[2:-1]
-        # row is of type psycopg2.extras.RealDictRow
-        # we want an honest dict
-        segment_row_list.append(dict(row.items()))
+    try:
+        cursor = connection.cursor(_cursor_name)
+        cursor.itersize = _batch_size
+        cursor.execute(query, [node_id, ])
+        while not stop_event.is_set():
+            rows = cursor.fetchmany(_batch_size)
+            if len(rows) == 0:
+                break
+            _put(row_queue, 
+                 [_segment_row_dict(row) for row in rows], 
+                 stop_event)
+        cursor.close()
+        connection.rollback()
+    except Exception as instance:
+        log.exception(instance)
+        _put(row_queue, instance, stop_event)
+    else:
+        _put(row_queue, None, stop_event)
 
-    return segment_row_list
+def _generate_merge_entries(node_index, node_name, row_queue):
+    """
+    yield the rows from one node as entries for heapq.merge: the sort key
+    first, then enough to make the entries unique, so the rows themselves
+    are never compared
+    """
+    row_index = 0
+    while True:
+        batch = row_queue.get()
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        for row in batch:
+            row_index += 1
+            yield ((-row["unified_id"], -row["conjoined_part"], ), 
+                   node_index, 
+                   row_index, 
+                   node_name, 
+                   row, )
 
-def get_handoff_rows(node_databases, node_id):
+def get_conjoined_handoff_rows(node_databases, node_id):
     """
-    get segment rows to be handed off
+    get conjoined rows to be handed off
     """
     conjoined_rows = list()
-    segment_rows = list()
 
     for node_name, connection in node_databases.items():
         cursor = connection.cursor()
         conjoined_rows_for_node = _retrieve_conjoined_handoffs(cursor, node_id)
-        segment_rows_for_node = _retrieve_segment_handoffs(cursor, node_id)
         cursor.close()
 
         conjoined_rows.extend([(node_name, r) for r in conjoined_rows_for_node])
-        segment_rows.extend([(node_name, r) for r in segment_rows_for_node])
     
-    return conjoined_rows, segment_rows
+    return conjoined_rows
+
+def count_segment_handoffs(node_databases, node_id):
+    """
+    return the number of segment rows to be handed off, from all nodes
+    """
+    query = """
+        select count(*) as handoff_count from nimbusio_node.segment 
+        where handoff_node_id = %s
+    """
+    handoff_count = 0
+    for connection in node_databases.values():
+        cursor = connection.cursor()
+        cursor.execute(query, [node_id, ])
+        handoff_count += cursor.fetchone()["handoff_count"]
+        cursor.close()
+        connection.rollback()
+    return handoff_count
+
+def generate_segment_handoff_rows(node_databases, node_id):
+    """
+    yield (node_name, segment_row) for the segment rows to be handed off, 
+    from all nodes, newest first, so the rows for the same 
+    (unified_id, conjoined_part) from different nodes are adjacent.
+
+    The node databases are read in parallel, through server side cursors, 
+    with a bounded queue for each, so we start yielding rows as soon as 
+    the first batches arrive, and never hold more than a few batches in 
+    memory.
+
+    node_databases must be dedicated to this generator: the server side 
+    cursors live in a transaction, which anything else committing on the
+    connection would end.
+    """
+    stop_event = Event()
+    threads = list()
+    entry_generators = list()
+    for node_index, (node_name, connection) in \
+        enumerate(node_databases.items()):
+        row_queue = queue.Queue(maxsize=_queue_depth)
+        thread = Thread(target=_stream_segment_handoffs,
+                        name="stream-{0}".format(node_name),
+                        args=(connection, node_id, row_queue, stop_event, ))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+        entry_generators.append(
+            _generate_merge_entries(node_index, node_name, row_queue)
+        )
+
+    try:
+        for _key, _node_index, _row_index, node_name, row in \
+            heapq.merge(*entry_generators):
+            yield (node_name, row, )
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
 
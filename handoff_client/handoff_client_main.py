@@ -18,7 +18,9 @@ from tools.process_util import set_signal_handler
 from handoff_client.options import parse_commandline
 from handoff_client.get_node_ids import get_node_ids
 from handoff_client.node_databases import get_node_databases
-from handoff_client.get_handoff_rows import get_handoff_rows
+from handoff_client.get_handoff_rows import get_conjoined_handoff_rows, \
+        count_segment_handoffs, \
+        generate_segment_handoff_rows
 from handoff_client.process_conjoined_rows import process_conjoined_rows
 from handoff_client.process_segment_rows import process_segment_rows
 
@@ -46,25 +48,40 @@ def main():
 
     return_code = 0
     node_databases = None
+    stream_databases = None
     try:
         node_dict = get_node_ids(args.node_name)
         node_databases = get_node_databases()
-        conjoined_rows, segment_rows = \
-            get_handoff_rows(node_databases, node_dict[args.node_name])
+        conjoined_rows = \
+            get_conjoined_handoff_rows(node_databases, 
+                                       node_dict[args.node_name])
+        segment_handoff_count = \
+            count_segment_handoffs(node_databases, node_dict[args.node_name])
         log.info("found {0} conjoined and {1} segment handoffs".format(
-            len(conjoined_rows), len(segment_rows)))
+            len(conjoined_rows), segment_handoff_count))
         if len(conjoined_rows)  > 0:
             process_conjoined_rows(halt_event, 
                                    args, 
                                    node_databases, 
                                    conjoined_rows)
-        if len(segment_rows)  > 0:
-            process_segment_rows(halt_event, 
-                                 zeromq_context, 
-                                 args, 
-                                 node_dict,
-                                 node_databases,
-                                 segment_rows)
+        if segment_handoff_count  > 0:
+            # the segment rows stream in through their own connections,
+            # because we commit the purges on node_databases as we go
+            stream_databases = get_node_databases()
+            segment_handoff_rows = \
+                generate_segment_handoff_rows(stream_databases, 
+                                              node_dict[args.node_name])
+            try:
+                process_segment_rows(halt_event, 
+                                     zeromq_context, 
+                                     args, 
+                                     node_dict,
+                                     node_databases,
+                                     segment_handoff_rows,
+                                     segment_handoff_count,
+                                     event_push_client)
+            finally:
+                segment_handoff_rows.close()
     except Exception as instance:
         log.exception("Uhandled exception {0}".format(instance))
         event_push_client.exception(
@@ -74,9 +91,10 @@ def main():
         )
         return_code = 1
 
-    if node_databases is not None:
-        for connection in node_databases.values():
-            connection.close()
+    for databases in [node_databases, stream_databases, ]:
+        if databases is not None:
+            for connection in databases.values():
+                connection.close()
     event_push_client.close()
     zeromq_context.term()
 
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+handoff_pipeline.py
+
+keep several handoffs in flight in one worker, each with its own
+PipelinedForwarder, sharing one REQ socket per reader and one for the
+writer. At most max_per_source handoffs are retrieved from the same
+source node at a time.
+"""
+from collections import Counter, deque
+import logging
+import time
+
+from handoff_client.pipelined_forwarder import PipelinedForwarder
+from handoff_client.req_socket import ReqSocket
+
+# if a handoff gets no reply for this long, we give up on that source node
+_reply_timeout_seconds = 300.0
+
+class HandoffPipeline(object):
+    """
+    keep several handoffs in flight
+    """
+    def __init__(self,
+                 zeromq_context,
+                 halt_event,
+                 client_tag,
+                 pull_socket_uri,
+                 reader_address_dict,
+                 writer_address,
+                 max_per_source,
+                 archive_window):
+        self._log = logging.getLogger("HandoffPipeline")
+        self._zeromq_context = zeromq_context
+        self._halt_event = halt_event
+        self._client_tag = client_tag
+        self._pull_socket_uri = pull_socket_uri
+        self._reader_address_dict = reader_address_dict
+        self._writer_address = writer_address
+        self._max_per_source = max_per_source
+        self._archive_window = archive_window
+
+        self._req_sockets = dict()
+        self._waiting = deque()
+        self._active = dict()
+        self._source_counts = Counter()
+        self._results = list()
+
+    def __len__(self):
+        """
+        the number of handoffs we have not finished
+        """
+        return len(self._waiting) + len(self._active)
+
+    def add(self, node_dict, source_node_names, segment_row, result):
+        """
+        start the handoff of segment_row from one of source_node_names,
+        as soon as one of them has a free slot
+
+        result is the 'handoff-complete' result we fill in
+        """
+        self._waiting.append({"node-dict"           : node_dict,
+                              "segment-row"         : segment_row,
+                              "untried-node-names"  : list(source_node_names),
+                              "result"              : result, })
+        self._start_waiting_handoffs()
+
+    def handle_reply(self, message, data):
+        """
+        pass a reply from a reader or the writer to its forwarder
+        """
+        user_request_id = message["user-request-id"]
+        if user_request_id not in self._active:
+            self._log.warn("request {0}: ignoring {1}".format(
+                user_request_id, message["message-type"]))
+            return
+
+        handoff = self._active[user_request_id]
+        handoff["last-activity-time"] = time.time()
+        try:
+            done = handoff["forwarder"].handle_reply(message, data)
+        except Exception as instance:
+            self._log.exception(instance)
+            self._handoff_failed(user_request_id, str(instance))
+        else:
+            if done:
+                self._handoff_succeeded(user_request_id)
+
+        self._start_waiting_handoffs()
+
+    def check_timeouts(self, current_time):
+        """
+        fail the handoffs that have stopped getting replies
+        """
+        timed_out = [user_request_id \
+                     for user_request_id, handoff in self._active.items() \
+                     if current_time - handoff["last-activity-time"] > \
+                        _reply_timeout_seconds]
+        for user_request_id in timed_out:
+            self._log.error("request {0}: timeout waiting reply".format(
+                user_request_id))
+            self._handoff_failed(user_request_id, "timeout waiting reply")
+
+        if len(timed_out) > 0:
+            self._start_waiting_handoffs()
+
+    def pop_results(self):
+        """
+        return the results of the handoffs that have finished since the
+        last call
+        """
+        results, self._results = self._results, list()
+        return results
+
+    def close(self):
+        for req_socket in self._req_sockets.values():
+            req_socket.close()
+        self._req_sockets.clear()
+
+    def _get_req_socket(self, address):
+        # a socket closes itself when it times out waiting for an ack
+        if address not in self._req_sockets \
+        or self._req_sockets[address].closed:
+            self._req_sockets[address] = ReqSocket(self._zeromq_context,
+                                                   address,
+                                                   self._client_tag,
+                                                   self._pull_socket_uri,
+                                                   self._halt_event)
+        return self._req_sockets[address]
+
+    def _start_waiting_handoffs(self):
+        for _ in range(len(self._waiting)):
+            waiting = self._waiting.popleft()
+            source_node_name = None
+            for node_name in waiting["untried-node-names"]:
+                if self._source_counts[node_name] < self._max_per_source:
+                    source_node_name = node_name
+                    break
+            if source_node_name is None:
+                self._waiting.append(waiting)
+                continue
+            waiting["untried-node-names"].remove(source_node_name)
+            self._start_handoff(waiting, source_node_name)
+
+    def _start_handoff(self, waiting, source_node_name):
+        segment_row = waiting["segment-row"]
+        self._log.info("start ({0}, {1}) from {2}".format(
+            segment_row["unified_id"],
+            segment_row["conjoined_part"],
+            source_node_name))
+
+        forwarder = PipelinedForwarder(
+            waiting["node-dict"],
+            segment_row,
+            self._get_req_socket(self._writer_address),
+            self._get_req_socket(self._reader_address_dict[source_node_name]),
+            self._archive_window
+        )
+        handoff = dict(waiting)
+        handoff["forwarder"] = forwarder
+        handoff["source-node-name"] = source_node_name
+        handoff["last-activity-time"] = time.time()
+        self._active[forwarder.user_request_id] = handoff
+        self._source_counts[source_node_name] += 1
+
+        try:
+            forwarder.start()
+        except Exception as instance:
+            self._log.exception(instance)
+            self._handoff_failed(forwarder.user_request_id, str(instance))
+
+    def _handoff_succeeded(self, user_request_id):
+        handoff = self._active.pop(user_request_id)
+        self._source_counts[handoff["source-node-name"]] -= 1
+        segment_row = handoff["segment-row"]
+        self._log.info("done  ({0}, {1}) from {2}".format(
+            segment_row["unified_id"],
+            segment_row["conjoined_part"],
+            handoff["source-node-name"]))
+
+        result = handoff["result"]
+        result["handoff-successful"] = True
+        result["byte-count"] = handoff["forwarder"].byte_count
+        self._results.append(result)
+
+    def _handoff_failed(self, user_request_id, error_message):
+        handoff = self._active.pop(user_request_id)
+        self._source_counts[handoff["source-node-name"]] -= 1
+        result = handoff["result"]
+        result["error-message"] = "".join([result["error-message"],
+                                           error_message])
+
+        # try the next source node, if there is one
+        if len(handoff["untried-node-names"]) > 0:
+            self._waiting.appendleft({
+                "node-dict"             : handoff["node-dict"],
+                "segment-row"           : handoff["segment-row"],
+                "untried-node-names"    : handoff["untried-node-names"],
+                "result"                : result, })
+        else:
+            self._results.append(result)
+
@@ -9,6 +9,15 @@ import os
 import socket
 
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
+_segments_in_flight = int(
+    os.environ.get("NIMBUSIO_HANDOFF_CLIENT_SEGMENTS_IN_FLIGHT", "1")
+)
+_max_per_source = int(
+    os.environ.get("NIMBUSIO_HANDOFF_CLIENT_MAX_PER_SOURCE", "4")
+)
+_archive_window = int(
+    os.environ.get("NIMBUSIO_HANDOFF_CLIENT_ARCHIVE_WINDOW", "4")
+)
 
 def parse_commandline():
     """
@@ -27,6 +36,20 @@ def parse_commandline():
     parser.add_argument("-p", "--base-port", dest="base_port",
                         type=int, default=10000,
                         help="Starting port number for worker PULL addresses")
+    parser.add_argument("-s", "--segments-in-flight", 
+                        dest="segments_in_flight",
+                        type=int, default=_segments_in_flight,
+                        help="The number of segments each worker forwards "
+                        "at once. 1 forwards one segment at a time, "
+                        "waiting for each message.")
+    parser.add_argument("--max-per-source", dest="max_per_source",
+                        type=int, default=_max_per_source,
+                        help="The most segments a worker retrieves from "
+                        "one source node at once.")
+    parser.add_argument("--archive-window", dest="archive_window",
+                        type=int, default=_archive_window,
+                        help="The most sequences of a segment sent to "
+                        "the writer and not yet archived.")
 
     return parser.parse_args()
 
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+pipelined_forwarder.py
+
+retrieve and re-archive a segment that was handed off to us, without
+waiting for the writer to archive each sequence before we retrieve the
+next one.
+
+The data reader only accepts retrieve-key-next after it has replied to the
+previous retrieve, so we have at most one retrieve in flight. The data
+writer handles the messages from a client in order, so we can have up
+to archive_window archive messages in flight.
+"""
+import logging
+import uuid
+
+from tools.data_definitions import create_priority
+
+_archive_reply_types = set(["archive-key-start-reply",
+                            "archive-key-next-reply",
+                            "archive-key-final-reply", ])
+
+class PipelinedForwarder(object):
+    """
+    forward one segment from a reader to the writer
+
+    replies from the reader and the writer (identified by user_request_id)
+    are passed to handle_reply
+    """
+    def __init__(self,
+                 node_dict,
+                 segment_row,
+                 writer_socket,
+                 reader_socket,
+                 archive_window):
+        self._log = logging.getLogger("PipelinedForwarder")
+        self.user_request_id = str(uuid.uuid4())
+        self.byte_count = 0
+
+        self._node_dict = node_dict
+        self._segment_row = segment_row
+        self._writer_socket = writer_socket
+        self._reader_socket = reader_socket
+        self._archive_window = archive_window
+
+        self._archive_priority = create_priority()
+        self._retrieve_id = uuid.uuid1().hex
+        self._retrieve_sequence = 0
+        self._archive_sequence = 0
+        self._retrieve_pending = False
+        self._retrieve_completed = False
+        self._archives_pending = 0
+
+    def start(self):
+        """
+        send retrieve-key-start to the reader
+        """
+        self._send_retrieve("retrieve-key-start")
+
+    def handle_reply(self, reply, data):
+        """
+        handle a reply from the reader or the writer, and send whatever
+        messages it makes possible
+
+        return True when the whole segment has been archived
+        """
+        assert reply["result"] == "success", reply
+
+        if reply["message-type"] == "retrieve-key-reply":
+            assert self._retrieve_pending, reply
+            self._retrieve_pending = False
+            self._retrieve_completed = reply["completed"]
+            if data is not None:
+                self.byte_count += sum(len(segment) for segment in data)
+            self._send_archive(reply, data)
+        else:
+            assert reply["message-type"] in _archive_reply_types, reply
+            assert self._archives_pending > 0, reply
+            self._archives_pending -= 1
+
+        if not self._retrieve_pending \
+        and not self._retrieve_completed \
+        and self._archives_pending < self._archive_window:
+            self._retrieve_sequence += 1
+            self._send_retrieve("retrieve-key-next")
+
+        return self._retrieve_completed and self._archives_pending == 0
+
+    def _send_retrieve(self, message_type):
+        segment_row = self._segment_row
+        message = {
+            "message-type"              : message_type,
+            "user-request-id"           : self.user_request_id,
+            "retrieve-id"               : self._retrieve_id,
+            "retrieve-sequence"         : self._retrieve_sequence,
+            "collection-id"             : segment_row["collection_id"],
+            "key"                       : segment_row["key"],
+            "segment-unified-id"        : segment_row["unified_id"],
+            "segment-conjoined-part"    : segment_row["conjoined_part"],
+            "segment-num"               : segment_row["segment_num"],
+            "handoff-node-id"           : segment_row["handoff_node_id"],
+            "block-offset"              : 0,
+            "block-count"               : None,
+        }
+
+        self._log.debug("request {0}: sending {1} {2} {3}".format(
+            self.user_request_id,
+            message_type,
+            segment_row["unified_id"],
+            segment_row["segment_num"]))
+
+        self._reader_socket.send(message)
+        self._reader_socket.wait_for_ack()
+        self._retrieve_pending = True
+
+    def _send_archive(self, reply, data):
+        segment_row = self._segment_row
+        self._archive_sequence += 1
+        first = self._archive_sequence == 1
+        completed = self._retrieve_completed
+
+        if first and completed:
+            message_type = "archive-key-entire"
+        elif first:
+            message_type = "archive-key-start"
+        elif completed:
+            message_type = "archive-key-final"
+        else:
+            message_type = "archive-key-next"
+
+        message = {
+            "message-type"      : message_type,
+            "user-request-id"   : self.user_request_id,
+            "priority"          : self._archive_priority,
+            "collection-id"     : segment_row["collection_id"],
+            "key"               : segment_row["key"],
+            "unified-id"        : segment_row["unified_id"],
+            "conjoined-part"    : segment_row["conjoined_part"],
+            "timestamp-repr"    : repr(segment_row["timestamp"]),
+            "segment-num"       : segment_row["segment_num"],
+            "segment-size"      : reply["segment-size"],
+            "zfec-padding-size" : reply["zfec-padding-size"],
+            "segment-adler32"   : reply["segment-adler32"],
+            "segment-md5-digest": reply["segment-md5-digest"],
+            "source-node-name"  : self._node_dict[segment_row["source_node_id"]],
+            "handoff-node-name" : None,
+        }
+        if message_type != "archive-key-entire":
+            message["sequence-num"] = self._archive_sequence
+        if completed:
+            message["file-size"] = segment_row["file_size"]
+            message["file-adler32"] = segment_row["file_adler32"]
+            message["file-hash"] = segment_row["file_hash"]
+
+        self._writer_socket.send(message, data=data)
+        self._writer_socket.wait_for_ack()
+        self._archives_pending += 1
+
@@ -9,6 +9,7 @@ import itertools
 import os
 import subprocess
 import sys
+import time
 
 import zmq
 
@@ -23,6 +24,7 @@ from tools.data_definitions import segment_status_final, \
 _socket_dir = os.environ["NIMBUSIO_SOCKET_DIR"]
 _socket_high_water_mark = 1000
 _polling_interval = 1.0
+_reporting_interval = 60.0
 
 def _start_worker_process(worker_id, args, rep_socket_uri):
     module_dir = identify_program_dir("handoff_client")
@@ -34,23 +36,26 @@ def _start_worker_process(worker_id, args, rep_socket_uri):
             args.host_name,
             str(args.base_port),
             args.node_name,
-            rep_socket_uri, ]
+            rep_socket_uri, 
+            str(args.segments_in_flight),
+            str(args.max_per_source),
+            str(args.archive_window), ]
     return subprocess.Popen(args, stderr=subprocess.PIPE)
 
 def _key_function(segment_row):
     return (segment_row[1]["unified_id"], segment_row[1]["conjoined_part"], )
 
-def _generate_segment_rows(raw_segment_rows):
+def _generate_segment_rows(segment_handoff_rows):
     """
     yield tuples of (source_node_ids, segment_row)
     where source_node_names is a list of the nodes where the segment can be 
     retrieved
-    """
-    # sort on (unified_id, conjoined_part) to bring pairs together
-    raw_segment_rows.sort(key=_key_function)
 
+    segment_handoff_rows are (node_name, segment_row) ordered on 
+    (unified_id, conjoined_part), which brings pairs together
+    """
     for (_unified_id, _conjoined_part, ), group in \
-        itertools.groupby(raw_segment_rows, _key_function):
+        itertools.groupby(segment_handoff_rows, _key_function):
         segment_row_list = list(group)
         assert len(segment_row_list) > 0
         assert len(segment_row_list) < 3, str(len(segment_row_list))
@@ -136,14 +141,51 @@ def _purge_handoff_from_source_nodes(node_databases,
         cursor.close()
         node_databases[source_node_name].commit()
 
+def _report_progress(event_push_client, progress, backlog, current_time):
+    log = logging.getLogger("_report_progress")
+    elapsed_time = current_time - progress["report-time"]
+    if elapsed_time <= 0.0:
+        return
+    segments_per_second = \
+        (progress["segments"] - progress["report-segments"]) / elapsed_time
+    bytes_per_second = \
+        (progress["bytes"] - progress["report-bytes"]) / elapsed_time
+    log.info("{0:,} segments handed off ({1:,} failed), "
+             "{2:.1f} segments/s, {3:,.0f} bytes/s, backlog {4:,}".format(
+             progress["segments"], 
+             progress["failed"], 
+             segments_per_second,
+             bytes_per_second,
+             backlog))
+    event_push_client.info("handoff-progress",
+                           "handoff client progress",
+                           segments=progress["segments"],
+                           failed=progress["failed"],
+                           bytes=progress["bytes"],
+                           segments_per_second=segments_per_second,
+                           bytes_per_second=bytes_per_second,
+                           backlog=backlog)
+    progress["report-time"] = current_time
+    progress["report-segments"] = progress["segments"]
+    progress["report-bytes"] = progress["bytes"]
+
 def process_segment_rows(halt_event, 
                          zeromq_context, 
                          args, 
                          node_dict,
                          node_databases,
-                         raw_segment_rows):
+                         segment_handoff_rows,
+                         segment_handoff_count,
+                         event_push_client):
     """
-    process handoffs of segment rows
+    process handoffs of segment rows, as they stream in from 
+    segment_handoff_rows
+
+    segment_handoff_count is the number of rows we expect, for reporting
+    the backlog
+
+    each worker asks for work with a 'ready-count' of the segments it can
+    take, and reports the results of the segments it has finished
     """
     log = logging.getLogger("process_segment_rows")
 
@@ -165,22 +207,87 @@ def process_segment_rows(halt_event,
 
     # loop until all handoffs have been accomplished
     log.debug("start handoffs")
-    work_generator =  _generate_segment_rows(raw_segment_rows)
+    work_generator = _generate_segment_rows(segment_handoff_rows)
+    work_exhausted = False
     pending_handoff_count = 0
+    pending_by_worker = dict()
+    progress = {"rows-done"         : 0,
+                "segments"          : 0,
+                "failed"            : 0,
+                "bytes"             : 0,
+                "report-time"       : time.time(),
+                "report-segments"   : 0,
+                "report-bytes"      : 0, }
+
     while not halt_event.is_set():
+        if work_exhausted and pending_handoff_count == 0:
+            break
+
+        current_time = time.time()
+        if current_time - progress["report-time"] >= _reporting_interval:
+            backlog = max(segment_handoff_count - progress["rows-done"], 0)
+            _report_progress(event_push_client, progress, backlog, current_time)
 
-        # get a segment row to process. If we are at EOF, segment_row = None
+        # wait for a worker to ask for work
         try:
-            source_node_names, segment_row = next(work_generator)
-        except StopIteration:
-            if pending_handoff_count == 0:
+            if rep_socket.poll(timeout=_polling_interval * 1000) == 0:
+                continue
+            request = rep_socket.recv_pyobj()
+        except zmq.ZMQError as zmq_error:
+            if is_interrupted_system_call(zmq_error) and halt_event.is_set():
+                log.warn("breaking due to halt_event")
                 break
-            else:
-                source_node_names, segment_row = None, None
+            raise
+        assert not rep_socket.rcvmore
+
+        worker_id = request["worker-id"]
+
+        # see how the worker handled the previous segments (if any)
+        initial_request = False
+        if request["message-type"] == "start":
+            log.info("{0} initial request".format(worker_id))
+            initial_request = True
+            pending_by_worker[worker_id] = 0
+        else:
+            for result in request["results"]:
+                assert pending_by_worker[worker_id] > 0
+                pending_by_worker[worker_id] -= 1
+                pending_handoff_count -= 1
+                progress["rows-done"] += len(result["source-node-names"])
+                if result["handoff-successful"]:
+                    log.info("{0} handoff ({1}, {2}) successful".format(
+                        worker_id, 
+                        result["unified-id"], 
+                        result["conjoined-part"]))
+                    progress["segments"] += 1
+                    progress["bytes"] += result["byte-count"]
+                    _purge_handoff_from_source_nodes(
+                        node_databases, 
+                        result["source-node-names"],
+                        result["collection-id"],
+                        result["key"],
+                        result["unified-id"],
+                        result["conjoined-part"],
+                        result["handoff-node-id"],
+                        segment_status_final)
+                else:
+                    log.error("{0} handoff ({1}, {2}) failed: {3}".format(
+                        worker_id,
+                        result["unified-id"], 
+                        result["conjoined-part"],
+                        result["error-message"]))
+                    progress["failed"] += 1
 
-        # if we have a segment row, and it is a tombstone, we can act
-        # directly on the node database(s) without sending it to a worker
-        if segment_row is not None:
+        # get segment rows for the worker's free slots.
+        # if a segment row is a tombstone, we can act directly on the node 
+        # database(s) without sending it to a worker
+        segments = list()
+        while not work_exhausted and len(segments) < request["ready-count"]:
+            try:
+                source_node_names, segment_row = next(work_generator)
+            except StopIteration:
+                work_exhausted = True
+                break
             if segment_row["status"] == segment_status_tombstone:
                 _process_tombstone(node_databases, 
                                    source_node_names, 
@@ -193,67 +300,31 @@ def process_segment_rows(halt_event,
                                                  segment_row["conjoined_part"],
                                                  segment_row["handoff_node_id"],
                                                  segment_status_tombstone)
+                progress["rows-done"] += len(source_node_names)
                 continue
             assert segment_row["status"] == segment_status_final, \
                 segment_row["status"]
-    
-        # at this point we eaither have a segment row in final status, or
-        # None, indicating no more data
-        # block until we have a ready worker
-        try:
-            request = rep_socket.recv_pyobj()
-        except zmq.ZMQError as zmq_error:
-            if is_interrupted_system_call(zmq_error) and halt_event.is_set():
-                log.warn("breaking due to halt_event")
-                break
-            raise
-        assert not rep_socket.rcvmore
+            segments.append((source_node_names, segment_row, ))
 
-        # see how the worker handled the previous segment (if any)
-        initial_request = False
-        if request["message-type"] == "start":
-            log.info("{0} initial request".format(request["worker-id"]))
-            initial_request = True
-        elif request["handoff-successful"]:
-            log.info("{0} handoff ({1}, {2}) successful".format(
-                request["worker-id"], 
-                request["unified-id"], 
-                request["conjoined-part"]))
-            assert pending_handoff_count > 0
-            pending_handoff_count -= 1
-            _purge_handoff_from_source_nodes(node_databases, 
-                                             request["source-node-names"],
-                                             request["collection-id"],
-                                             request["key"],
-                                             request["unified-id"],
-                                             request["conjoined-part"],
-                                             request["handoff-node-id"],
-                                             segment_status_final)
-        else:
-            log.error("{0} handoff ({1}, {2}) failed: {3}".format(
-                request["worker-id"],
-                request["unified-id"], 
-                request["conjoined-part"],
-                request["error-message"]))
-            assert pending_handoff_count > 0
-            pending_handoff_count -= 1
-
-        if segment_row is None:
+        if len(segments) == 0 and pending_by_worker[worker_id] == 0:
             # if we have no more work, tell the worker to stop
             work_message = {"message-type"        : "stop"}
         else:
-            # otherwise, send the segment to the worker 
+            # otherwise, send the segments to the worker. This may be
+            # an empty list, if the worker still has segments in flight
             work_message = {"message-type"        : "work",
-                            "source-node-names"   : source_node_names,
-                            "segment-row"         : segment_row}
+                            "segments"            : segments}
             # if this is the worker's first request, send him the node_dict
             if initial_request:
                 work_message["node-dict"] = node_dict
-            pending_handoff_count += 1
+            pending_by_worker[worker_id] += len(segments)
+            pending_handoff_count += len(segments)
 
         rep_socket.send_pyobj(work_message)
 
     log.debug("end of handoffs")
+    backlog = max(segment_handoff_count - progress["rows-done"], 0)
+    _report_progress(event_push_client, progress, backlog, time.time())
 
     for worker in workers:
         terminate_subprocess(worker)
@@ -18,6 +18,7 @@ class ReqSocketAckTimeOut(ReqSocketError):
     pass
 
 _timeout_seconds = 15.0
+_poll_interval_milliseconds = 100
 
 class ReqSocket(object):
     """
@@ -48,6 +49,10 @@ class ReqSocket(object):
     def __str__(self):
         return self._name
 
+    @property
+    def closed(self):
+        return self._socket.closed
+
     def close(self):
         self._socket.close()
 
@@ -84,6 +89,9 @@ class ReqSocket(object):
         raise ReqSocketAckTimeout if ack is not received
         """
         # 2012-09-06 dougfort -- gevent.Timeout goes off into outer space here
+        # we poll in short intervals, rather than sleeping, because the ack
+        # usually arrives within a millisecond or two, and every message
+        # we forward waits for one
         start_time = time.time()
         while not self._halt_event.is_set():
             try:
@@ -92,7 +100,7 @@ class ReqSocket(object):
                 if instance.errno == zmq.EAGAIN:
                     elapsed_time = time.time() - start_time
                     if elapsed_time < _timeout_seconds:
-                        self._halt_event.wait(1.0)
+                        self._socket.poll(timeout=_poll_interval_milliseconds)
                         continue
                     self.close()
                     error_message = "Timout waiting ack {0} seconds".format(
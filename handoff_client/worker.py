@@ -11,6 +11,7 @@ import os
 import socket
 import sys
 from threading import Event
+import time
 
 import zmq
 
@@ -20,6 +21,7 @@ from tools.zeromq_util import is_interrupted_system_call
 
 from handoff_client.forwarder_coroutine import forwarder_coroutine
 from handoff_client.req_socket import ReqSocket
+from handoff_client.handoff_pipeline import HandoffPipeline
 
 class HaltEvent(Exception):
     pass
@@ -27,6 +29,7 @@ class HaltEvent(Exception):
 _socket_high_water_mark = 1000
 _log_path_template = "{0}/nimbusio_handoff_client_worker_{1:03}.log"
 _client_tag_template = "handoff_client_worker_{0:03}"
+_polling_interval_milliseconds = 1000
 
 _node_names = os.environ["NIMBUSIO_NODE_NAME_SEQ"].split()
 
@@ -82,6 +85,7 @@ def _process_handoff(zeromq_context,
                                     reader_socket)
 
     next(forwarder)
+    byte_count = 0
 
     # loop, waiting for messages to the pull socket
     # until the forwarder tells us it is done
@@ -100,6 +104,8 @@ def _process_handoff(zeromq_context,
             data.append(pull_socket.recv())
         if len(data) == 0:
             data = None
+        else:
+            byte_count += sum(len(segment) for segment in data)
 
         result = forwarder.send((message, data, ))
         # the forwarder will yield the string 'done' when it is done
@@ -117,39 +123,43 @@ def _process_handoff(zeromq_context,
                                                 segment_row["conjoined_part"],
                                                 source_node_name))
 
-def main(worker_id, host_name, base_port, dest_node_name, rep_socket_uri):
+    return byte_count
+
+def _handoff_result(worker_id, source_node_names, segment_row):
     """
-    main entry point
-    return 0 on normal termination (exit code)
+    the result we send back, with enough information to purge the handoffs,
+    if successful
     """
-    log = logging.getLogger("main")
-
-    client_tag = _client_tag_template.format(worker_id)
-    halt_event = Event()
-    set_signal_handler(halt_event)
-
-    zeromq_context =  zmq.Context()
-
-    log.debug("creating pull socket")
-    pull_socket_uri = "tcp://{0}:{1}".format(socket.gethostbyname(host_name), 
-                                             base_port+worker_id)
-
-    pull_socket = zeromq_context.socket(zmq.PULL)
-    pull_socket.setsockopt(zmq.HWM, _socket_high_water_mark)
-    log.info("binding pull socket to {0}".format(pull_socket_uri))
-    pull_socket.bind(pull_socket_uri)
-
-    req_socket = zeromq_context.socket(zmq.REQ)
-    req_socket.setsockopt(zmq.HWM, _socket_high_water_mark)
-    req_socket.connect(rep_socket_uri)
+    return {"worker-id"            : worker_id,
+            "handoff-successful"   : False,
+            "unified-id"           : segment_row["unified_id"],
+            "collection-id"        : segment_row["collection_id"],
+            "key"                  : segment_row["key"],
+            "conjoined-part"       : segment_row["conjoined_part"],
+            "handoff-node-id"      : segment_row["handoff_node_id"],
+            "source-node-names"    : source_node_names,
+            "byte-count"           : 0,
+            "error-message"        : ""}
+
+def _sequential_message_loop(zeromq_context,
+                             halt_event,
+                             worker_id,
+                             client_tag,
+                             pull_socket,
+                             pull_socket_uri,
+                             req_socket,
+                             dest_node_name):
+    """
+    handle one segment at a time, waiting for each retrieve and archive
+    """
+    log = logging.getLogger("_sequential_message_loop")
 
-    log.info("sending 'start' message")
     # notify our parent that we are ready to receive work
     request = {"message-type" : "start",
-               "worker-id"    : worker_id}
+               "worker-id"    : worker_id,
+               "ready-count"  : 1}
     req_socket.send_pyobj(request)
 
-    log.info("starting message loop")
     node_dict = None
     while not halt_event.is_set():
         try:
@@ -173,42 +183,212 @@ def main(worker_id, host_name, base_port, dest_node_name, rep_socket_uri):
             node_dict = message["node-dict"]
         assert node_dict is not None
 
-        # aliases for brevity
-        segment_row = message["segment-row"]
-        source_node_names = message["source-node-names"]
-
-        # send back enough information to purge the handoffs, if successful
-        request = {"message-type"         : "handoff-complete",
-                   "worker-id"            : worker_id,
-                   "handoff-successful"   : False,
-                   "unified-id"           : segment_row["unified_id"],
-                   "collection-id"        : segment_row["collection_id"],
-                   "key"                  : segment_row["key"],
-                   "conjoined-part"       : segment_row["conjoined_part"],
-                   "handoff-node-id"      : segment_row["handoff_node_id"],
-                   "source-node-names"    : source_node_names,
-                   "error-message"        : ""}
-
-        for source_node_name in source_node_names:
-            try:
-                _process_handoff(zeromq_context, 
+        results = list()
+        for source_node_names, segment_row in message["segments"]:
+            result = _handoff_result(worker_id, source_node_names, segment_row)
+            for source_node_name in source_node_names:
+                try:
+                    result["byte-count"] = _process_handoff(zeromq_context, 
+                                                            halt_event,
+                                                            node_dict,
+                                                            pull_socket,
+                                                            pull_socket_uri,
+                                                            client_tag,
+                                                            source_node_name, 
+                                                            dest_node_name,
+                                                            segment_row)
+                except Exception as instance:
+                    log.exception(instance)
+                    result["error-message"] = \
+                        "".join([result["error-message"], str(instance)])
+                else:
+                    result["handoff-successful"] = True
+                    break
+            results.append(result)
+
+        request = {"message-type" : "handoff-complete",
+                   "worker-id"    : worker_id,
+                   "ready-count"  : 1,
+                   "results"      : results}
+        req_socket.send_pyobj(request)
+
+def _read_pull_socket(pull_socket, handoff_pipeline):
+    """
+    pass replies from the readers and the writer to the pipeline, until we
+    would block
+    """
+    while True:
+        try:
+            message = pull_socket.recv_json(zmq.NOBLOCK)
+        except zmq.ZMQError as instance:
+            if instance.errno == zmq.EAGAIN:
+                return
+            raise
+
+        data = list()
+        while pull_socket.rcvmore:
+            data.append(pull_socket.recv())
+        if len(data) == 0:
+            data = None
+
+        handoff_pipeline.handle_reply(message, data)
+
+def _pipelined_message_loop(zeromq_context,
+                            halt_event,
+                            worker_id,
+                            client_tag,
+                            pull_socket,
+                            pull_socket_uri,
+                            req_socket,
+                            dest_node_name,
+                            segments_in_flight,
+                            max_per_source,
+                            archive_window):
+    """
+    keep up to segments_in_flight segments in flight, asking our parent
+    for more work as segments finish
+    """
+    log = logging.getLogger("_pipelined_message_loop")
+
+    handoff_pipeline = HandoffPipeline(zeromq_context,
+                                       halt_event,
+                                       client_tag,
+                                       pull_socket_uri,
+                                       _reader_address_dict,
+                                       _writer_address_dict[dest_node_name],
+                                       max_per_source,
+                                       archive_window)
+
+    poller = zmq.Poller()
+    poller.register(pull_socket, zmq.POLLIN)
+    poller.register(req_socket, zmq.POLLIN)
+
+    # notify our parent that we are ready to receive work
+    request = {"message-type" : "start",
+               "worker-id"    : worker_id,
+               "ready-count"  : segments_in_flight}
+    req_socket.send_pyobj(request)
+    awaiting_work = True
+
+    node_dict = None
+    stopped = False
+    while not halt_event.is_set() and not stopped:
+        # REQ socket: we can only ask for more work when our parent has
+        # answered our last request
+        if not awaiting_work:
+            results = handoff_pipeline.pop_results()
+            if len(results) > 0:
+                request = {
+                    "message-type" : "handoff-complete",
+                    "worker-id"    : worker_id,
+                    "ready-count"  : segments_in_flight - len(handoff_pipeline),
+                    "results"      : results}
+                req_socket.send_pyobj(request)
+                awaiting_work = True
+
+        try:
+            result_list = poller.poll(timeout=_polling_interval_milliseconds)
+        except zmq.ZMQError as zmq_error:
+            if is_interrupted_system_call(zmq_error) and halt_event.is_set():
+                log.info("interrupted system call wiht halt_event_set")
+                break
+            log.exception(str(zmq_error))
+            sys.exit(1)
+
+        for active_socket, event_flags in result_list:
+            if event_flags & zmq.POLLERR:
+                log.error("error flags from zmq {0}".format(active_socket))
+                sys.exit(1)
+            if active_socket is pull_socket:
+                _read_pull_socket(pull_socket, handoff_pipeline)
+                continue
+
+            assert active_socket is req_socket
+            message = req_socket.recv_pyobj()
+            assert not req_socket.rcvmore
+            awaiting_work = False
+
+            if message["message-type"] == "stop":
+                log.info("'stop' message received")
+                stopped = True
+                break
+
+            assert message["message-type"] == "work", message["message-type"]
+
+            # we expect our parent to send us the node dict in our first 
+            # message
+            if "node-dict" in message:
+                node_dict = message["node-dict"]
+            assert node_dict is not None
+
+            for source_node_names, segment_row in message["segments"]:
+                handoff_pipeline.add(node_dict,
+                                     source_node_names,
+                                     segment_row,
+                                     _handoff_result(worker_id,
+                                                     source_node_names,
+                                                     segment_row))
+
+        handoff_pipeline.check_timeouts(time.time())
+
+    handoff_pipeline.close()
+
+def main(worker_id, 
+         host_name, 
+         base_port, 
+         dest_node_name, 
+         rep_socket_uri,
+         segments_in_flight,
+         max_per_source,
+         archive_window):
+    """
+    main entry point
+    return 0 on normal termination (exit code)
+    """
+    log = logging.getLogger("main")
+
+    client_tag = _client_tag_template.format(worker_id)
+    halt_event = Event()
+    set_signal_handler(halt_event)
+
+    zeromq_context =  zmq.Context()
+
+    log.debug("creating pull socket")
+    pull_socket_uri = "tcp://{0}:{1}".format(socket.gethostbyname(host_name), 
+                                             base_port+worker_id)
+
+    pull_socket = zeromq_context.socket(zmq.PULL)
+    pull_socket.setsockopt(zmq.HWM, _socket_high_water_mark)
+    log.info("binding pull socket to {0}".format(pull_socket_uri))
+    pull_socket.bind(pull_socket_uri)
+
+    req_socket = zeromq_context.socket(zmq.REQ)
+    req_socket.setsockopt(zmq.HWM, _socket_high_water_mark)
+    req_socket.connect(rep_socket_uri)
+
+    log.info("starting message loop: {0} segments in flight".format(
+        segments_in_flight))
+    if segments_in_flight > 1:
+        _pipelined_message_loop(zeromq_context,
+                                halt_event,
+                                worker_id,
+                                client_tag,
+                                pull_socket,
+                                pull_socket_uri,
+                                req_socket,
+                                dest_node_name,
+                                segments_in_flight,
+                                max_per_source,
+                                archive_window)
+    else:
+        _sequential_message_loop(zeromq_context,
                                  halt_event,
-                                 node_dict,
+                                 worker_id,
+                                 client_tag,
                                  pull_socket,
                                  pull_socket_uri,
-                                 client_tag,
-                                 source_node_name, 
-                                 dest_node_name,
-                                 segment_row)
-            except Exception as instance:
-                log.exception(instance)
-                request["error-message"] = "".join([request["error-message"],
-                                                    str(instance)])
-            else:
-                request["handoff-successful"] = True
-                break
-
-        req_socket.send_pyobj(request)
+                                 req_socket,
+                                 dest_node_name)
     log.info("end message loop")
 
     pull_socket.close()
@@ -223,6 +403,9 @@ if __name__ == "__main__":
     base_port = int(sys.argv[3])
     dest_node_name = sys.argv[4]
     rep_socket_uri = sys.argv[5]
+    segments_in_flight = int(sys.argv[6])
+    max_per_source = int(sys.argv[7])
+    archive_window = int(sys.argv[8])
     log_path = _log_path_template.format(os.environ["NIMBUSIO_LOG_DIR"],
                                          worker_id)
     initialize_logging(log_path)
@@ -233,7 +416,10 @@ if __name__ == "__main__":
                       host_name, 
                       base_port, 
                       dest_node_name, 
-                      rep_socket_uri))
+                      rep_socket_uri,
+                      segments_in_flight,
+                      max_per_source,
+                      archive_window))
     except Exception as instance:
         log.exception(instance)
         sys.exit(1)
@@ -6,6 +6,7 @@ flush_stats_from_redis_main.py
 See Ticket #65 Collect and Flush Stats from Redis on Storage Nodes to Central DB
 """
 from datetime import datetime, timedelta
+import io
 import logging
 import os
 import sys
@@ -21,59 +22,74 @@ from tools.advisory_lock import advisory_lock
 from tools.redis_connection import create_redis_connection
 from tools.operational_stats_redis_key import compute_search_key, parse_key
 
+from redis_stats_collector.redis_stats_reader import \
+        generate_stats_key_batches, \
+        retrieve_stats_hashes, \
+        remove_stats_keys
+
 _node_names = os.environ['NIMBUSIO_NODE_NAME_SEQ'].split()
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
 _log_path = "{0}/nimbusio_redis_stats_collector_{1}.log".format(
     os.environ["NIMBUSIO_LOG_DIR"], _local_node_name)
 
-_collection_ops_accounting_insert = """
-    insert into nimbusio_central.collection_ops_accounting( 
-            collection_id,
-            node_id,
-            timestamp,
-            duration,
-            retrieve_request,
-            retrieve_success,
-            retrieve_error,
-            archive_request,
-            archive_success,
-            archive_error,
-            listmatch_request,
-            listmatch_success,
-            listmatch_error,
-            delete_request,
-            delete_success,
-            delete_error,
-            socket_bytes_in,
-            socket_bytes_out,
-            success_bytes_in,
-            success_bytes_out,
-            error_bytes_in,
-            error_bytes_out)
-   values (
-            %(collection_id)s,
-            %(node_id)s,
-            %(timestamp)s,
-            %(duration)s,
-            %(retrieve_request)s,
-            %(retrieve_success)s,
-            %(retrieve_error)s,
-            %(archive_request)s,
-            %(archive_success)s,
-            %(archive_error)s,
-            %(listmatch_request)s,
-            %(listmatch_success)s,
-            %(listmatch_error)s,
-            %(delete_request)s,
-            %(delete_success)s,
-            %(delete_error)s,
-            %(socket_bytes_in)s,
-            %(socket_bytes_out)s,
-            %(success_bytes_in)s,
-            %(success_bytes_out)s,
-            %(error_bytes_in)s,
-            %(error_bytes_out)s
-          );"""
+_collection_ops_accounting_columns = [
+    "collection_id",
+    "node_id",
+    "timestamp",
+    "duration",
+    "retrieve_request",
+    "retrieve_success",
+    "retrieve_error",
+    "archive_request",
+    "archive_success",
+    "archive_error",
+    "listmatch_request",
+    "listmatch_success",
+    "listmatch_error",
+    "delete_request",
+    "delete_success",
+    "delete_error",
+    "socket_bytes_in",
+    "socket_bytes_out",
+    "success_bytes_in",
+    "success_bytes_out",
+    "error_bytes_in",
+    "error_bytes_out", ]
+_collection_ops_accounting_counts = _collection_ops_accounting_columns[4:]
+
+_create_temp_table = """
+    drop table if exists nimbusio_ops_accounting_load;
+    create temp table nimbusio_ops_accounting_load 
+        (like nimbusio_central.collection_ops_accounting);
+"""
+
+# a key (collection, node, minute) may already have a row, if stats for that
+# minute reached redis after we flushed some of its keys: add to it.
+# Then insert the rows that are new.
+_merge_collection_ops_accounting = """
+    update nimbusio_central.collection_ops_accounting as ops
+    set {0}
+    from nimbusio_ops_accounting_load as load
+    where ops.collection_id = load.collection_id
+    and ops.node_id = load.node_id
+    and ops.timestamp = load.timestamp;
+
+    insert into nimbusio_central.collection_ops_accounting (
+        {1})
+    select 
+        {1}
+    from nimbusio_ops_accounting_load as load
+    where not exists (
+        select 1 from nimbusio_central.collection_ops_accounting as ops
+        where ops.collection_id = load.collection_id
+        and ops.node_id = load.node_id
+        and ops.timestamp = load.timestamp);
+
+    drop table nimbusio_ops_accounting_load;
+""".format(
+    ",\n        ".join(["{0} = ops.{0} + load.{0}".format(name) \
+                         for name in _collection_ops_accounting_counts]),
+    ",\n        ".join(_collection_ops_accounting_columns))
 
 def _collection_ops_accounting_row(node_id, collection_id, timestamp):
     """
@@ -126,66 +142,99 @@ def _process_one_node(node_name,
     log = logging.getLogger("_process_one_node")
     redis_connection = create_redis_connection(host=node_name)
     search_key = compute_search_key(node_name)
-    keys = redis_connection.keys(search_key)
-    log.debug("found {0} keys from {1}".format(len(keys), search_key))
     
     value_dict = dict()
-
-    for key_bytes in keys:
-        key = key_bytes.decode("utf-8")
-
-        node_name, timestamp, partial_key = parse_key(key)
-
-        if timestamp > timestamp_cutoff:
-            log.debug("ignoring recent key {0}".format(key))
-            continue
-
-        node_keys_processed.append(key)
-        if key in dedupe_set:
-            log.debug("ignoring duplicate key {0}".format(key))
-            continue
-
-        log.info("node = {0}, key = {1}".format(node_name, key))
-
-        hash_dict = redis_connection.hgetall(key)
-        for collection_id_bytes, count_bytes in hash_dict.items():
-            collection_id = int(collection_id_bytes)
-            count = int(count_bytes)
-
-            log.info("    collection_id = {0}, count = {1}".format(
-                collection_id, count))
-
-            value_key = (timestamp, collection_id, )
-            if not value_key in value_dict:
-                value_dict[value_key] = \
-                    _collection_ops_accounting_row(node_id, 
-                                                   collection_id, 
-                                                   timestamp)
-            
-            value_dict[value_key][partial_key] += count
-        new_dedupes.append((node_id, key, ))
-
+    key_count = 0
+
+    for key_batch in generate_stats_key_batches(redis_connection, search_key):
+        key_count += len(key_batch)
+        keys_to_retrieve = list()
+        for key in key_batch:
+            node_name, timestamp, partial_key = parse_key(key)
+
+            if timestamp > timestamp_cutoff:
+                log.debug("ignoring recent key {0}".format(key))
+                continue
+
+            node_keys_processed.append(key)
+            if key in dedupe_set:
+                log.debug("ignoring duplicate key {0}".format(key))
+                continue
+
+            keys_to_retrieve.append((key, timestamp, partial_key, ))
+
+        hash_dicts = retrieve_stats_hashes(
+            redis_connection, [key for key, _, _ in keys_to_retrieve])
+
+        for (key, timestamp, partial_key, ), hash_dict in \
+        zip(keys_to_retrieve, hash_dicts):
+            log.debug("node = {0}, key = {1}, {2} collections".format(
+                node_name, key, len(hash_dict)))
+            for collection_id_bytes, count_bytes in hash_dict.items():
+                collection_id = int(collection_id_bytes)
+                count = int(count_bytes)
+
+                value_key = (timestamp, collection_id, )
+                if not value_key in value_dict:
+                    value_dict[value_key] = \
+                        _collection_ops_accounting_row(node_id, 
+                                                       collection_id, 
+                                                       timestamp)
+                
+                value_dict[value_key][partial_key] += count
+            new_dedupes.append((node_id, key, ))
+
+    log.info("found {0} keys from {1}: {2} rows".format(
+        key_count, search_key, len(value_dict)))
     collection_ops_accounting_rows.extend(value_dict.values())
 
+def _copy_rows(central_db_connection, table_name, columns, rows):
+    """
+    load rows (lists of values, in the order of columns) into table_name
+    with a single COPY
+    """
+    copy_buffer = io.StringIO()
+    for row in rows:
+        copy_buffer.write("\t".join([str(value) for value in row]))
+        copy_buffer.write("\n")
+    copy_buffer.seek(0)
+
+    cursor = central_db_connection._connection.cursor()
+    cursor.copy_expert("copy {0} ({1}) from stdin".format(table_name,
+                                                         ", ".join(columns)),
+                       copy_buffer)
+    cursor.close()
+
 def _insert_accounting_rows(central_db_connection, 
                             collection_ops_accounting_rows):
-    for row in collection_ops_accounting_rows:
-        central_db_connection.execute(_collection_ops_accounting_insert,
-                                      row)
+    if len(collection_ops_accounting_rows) == 0:
+        return
+
+    central_db_connection.execute(_create_temp_table, [])
+    _copy_rows(central_db_connection,
+               "nimbusio_ops_accounting_load",
+               _collection_ops_accounting_columns,
+               [[row[name] for name in _collection_ops_accounting_columns] \
+                for row in collection_ops_accounting_rows])
+    central_db_connection.execute(_merge_collection_ops_accounting, [])
 
 def _insert_dedupe_rows(central_db_connection, timestamp_cutoff, new_dedupes):
-    for node_id, redis_key in new_dedupes:
-        central_db_connection.execute("""
-            insert into nimbusio_central.collection_ops_accounting_flush_dedupe
-                   (node_id, redis_key, timestamp)
-            values (%s, %s, %s)""", [node_id, redis_key, timestamp_cutoff, ])
+    if len(new_dedupes) == 0:
+        return
+
+    _copy_rows(central_db_connection,
+               "nimbusio_central.collection_ops_accounting_flush_dedupe",
+               ["node_id", "redis_key", "timestamp", ],
+               [[node_id, redis_key, timestamp_cutoff, ] \
+                for node_id, redis_key in new_dedupes])
 
 def _remove_processed_keys(node_name, keys_processed):
     log = logging.getLogger("_remove_processed_keys")
     redis_connection = create_redis_connection(host=node_name)
-    for key in keys_processed:
-        log.info("removing {0}".format(key))
-        redis_connection.delete(key)
+    removed_count = remove_stats_keys(redis_connection, keys_processed)
+    log.info("removed {0} of {1} keys from {2}".format(removed_count,
+                                                      len(keys_processed),
+                                                      node_name))
 
 def main():
     """
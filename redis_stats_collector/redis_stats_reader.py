@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+redis_stats_reader.py
+
+read and remove the operational stats hashes in a node's redis without
+blocking the web servers that write to it: keys are found with SCAN
+(rather than KEYS, which blocks redis while it walks the whole keyspace)
+and the hashes are read and deleted in pipelined batches, rather than one
+round trip per key.
+"""
+import os
+
+_scan_count = int(os.environ.get(
+    "NIMBUSIO_REDIS_STATS_COLLECTOR_SCAN_COUNT", "1000"))
+_batch_size = int(os.environ.get(
+    "NIMBUSIO_REDIS_STATS_COLLECTOR_BATCH_SIZE", "1000"))
+
+def _generate_batches(items, batch_size):
+    batch = list()
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = list()
+    if len(batch) > 0:
+        yield batch
+
+def generate_stats_key_batches(redis_connection, search_key):
+    """
+    yield lists of the keys (as strings) matching search_key.
+    SCAN may return a key more than once, we yield each key once.
+    """
+    seen = set()
+    keys = redis_connection.scan_iter(match=search_key, count=_scan_count)
+    for batch in _generate_batches(keys, _batch_size):
+        key_batch = list()
+        for key_bytes in batch:
+            key = key_bytes.decode("utf-8")
+            if key not in seen:
+                seen.add(key)
+                key_batch.append(key)
+        yield key_batch
+
+def retrieve_stats_hashes(redis_connection, keys):
+    """
+    return a list of the hashes (dicts) for keys, in one pipelined round
+    trip
+    """
+    pipeline = redis_connection.pipeline(transaction=False)
+    for key in keys:
+        pipeline.hgetall(key)
+    return pipeline.execute()
+
+def remove_stats_keys(redis_connection, keys):
+    """
+    delete keys, with one DEL per batch, in one pipelined round trip
+    return the number of keys deleted
+    """
+    pipeline = redis_connection.pipeline(transaction=False)
+    for batch in _generate_batches(keys, _batch_size):
+        pipeline.delete(*batch)
+    return sum(pipeline.execute())
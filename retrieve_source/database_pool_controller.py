@@ -39,7 +39,8 @@ _resources_tuple = namedtuple("Resources",
                                "event_push_client",
                                "active_retrieves",
                                "pending_work_queue",
-                               "available_ident_queue",])
+                               "available_ident_queue",
+                               "batch_stats",])
 
 _retrieve_state_tuple = namedtuple("RetrieveState", 
                                    ["sequence_rows",
@@ -52,6 +53,8 @@ _retrieve_state_tuple = namedtuple("RetrieveState",
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
 _log_path_template = "{0}/nimbusio_rs_db_pool_controller_{1}.log"
 _worker_count = int(os.environ.get("NIMBUSIO_RETRIEVE_DB_POOL_COUNT", "2"))
+_max_batch_size = int(os.environ.get("NIMBUSIO_RETRIEVE_DB_BATCH_SIZE", "32"))
+_readahead_keys = ["space_id", "value_file_id", "value_file_offset", "size", ]
 _poll_timeout = 3000 # milliseconds
 _reporting_interval = 60.0
 
@@ -69,15 +72,27 @@ def _send_pending_work_to_available_workers(resources):
     """
     send messages from the pending_work_queue 
     to workers in the available_ident_queue
+
+    each worker gets a batch of up to _max_batch_size requests, which it
+    looks up in a single query. We spread the pending work across all
+    the available workers rather than loading up the first one.
     """
-    work_count = min(len(resources.pending_work_queue), 
-                     len(resources.available_ident_queue))
-    for _ in range(work_count):
-        message, control = resources.pending_work_queue.popleft()
+    while len(resources.pending_work_queue) > 0 \
+    and len(resources.available_ident_queue) > 0:
+        batch_size = \
+            -(-len(resources.pending_work_queue) // \
+              len(resources.available_ident_queue))
+        batch_size = min(batch_size, _max_batch_size)
+        batch = [resources.pending_work_queue.popleft() \
+                 for _ in range(batch_size)]
         ident = resources.available_ident_queue.popleft()
         resources.router_socket.send(ident, zmq.SNDMORE)
-        resources.router_socket.send_pyobj(message, zmq.SNDMORE)
-        resources.router_socket.send_pyobj(control)
+        resources.router_socket.send_pyobj(batch)
+
+        resources.batch_stats["batches"] += 1
+        resources.batch_stats["requests"] += batch_size
+        resources.batch_stats["max-batch-size"] = \
+            max(resources.batch_stats["max-batch-size"], batch_size)
 
 def _handle_retrieve_key_start(resources, message, control):
     log = logging.getLogger("_handle_retrieve_key_start")
@@ -248,24 +263,31 @@ def _read_router_socket(resources):
     read a message from the router socket (from one of our worker processes)
     if the message-type is 'ready-for-work' (initial message)
         add the message ident to the resources.available_ident_queue
-    if the message-type is 'retrieve-key-start'
-        use the attached data to start an active_retrieve
+    otherwise the message is a list of results for a batch of 
+    'retrieve-key-start' requests
+        use the attached data to start an active_retrieve for each request
         add the message ident to the resources.available_ident_queue
     """
-    log = logging.getLogger("_read_router_socket")
-
     ident = resources.router_socket.recv()
     assert resources.router_socket.rcvmore
-    message = resources.router_socket.recv_pyobj()
+    reply = resources.router_socket.recv_pyobj()
 
     resources.available_ident_queue.append(ident) 
     _send_pending_work_to_available_workers(resources)
 
-    if message["message-type"] == "ready-for-work":
+    if isinstance(reply, dict):
+        assert reply["message-type"] == "ready-for-work", reply
         return
 
-    assert resources.router_socket.rcvmore
-    control = resources.router_socket.recv_pyobj()
+    for message, control, sequence_rows in reply:
+        _handle_sequence_rows(resources, message, control, sequence_rows)
+
+def _handle_sequence_rows(resources, message, control, sequence_rows):
+    """
+    start an active retrieve from the sequence rows a worker found for
+    one 'retrieve-key-start' request
+    """
+    log = logging.getLogger("_handle_sequence_rows")
 
     if control["result"] != "success":
         log.error("user_request_id = {0}, " \
@@ -276,9 +298,6 @@ def _read_router_socket(resources):
         _send_error_reply(resources, message, control)
         return
 
-    assert resources.router_socket.rcvmore
-    sequence_rows = resources.router_socket.recv_pyobj()
-
     assert  message["message-type"] == "retrieve-key-start", message
     assert sequence_rows is not None
 
@@ -331,17 +350,29 @@ def _send_request_to_io_controller(resources,
     assert next_sequence_index <= retrieve_state.sequence_end
     control["completed"] = next_sequence_index == retrieve_state.sequence_end
 
+    # if there is more to come, tell the io worker where the next sequence
+    # is, so it can ask the kernel to start reading it ahead of the
+    # retrieve-key-next
+    control["readahead"] = None
     if control["completed"]:
         control["right-offset"] = retrieve_state.right_offset
     else:
         control["right-offset"] = 0
         resources.active_retrieves[message["retrieve-id"]] = \
             retrieve_state._replace(sequence_index=next_sequence_index)
+        next_sequence_row = retrieve_state.sequence_rows[next_sequence_index]
+        control["readahead"] = \
+            dict((key, next_sequence_row[key], ) for key in _readahead_keys)
 
     resources.io_controller_push_socket.send_pyobj(message, zmq.SNDMORE)
     resources.io_controller_push_socket.send_pyobj(control, zmq.SNDMORE)
     resources.io_controller_push_socket.send_pyobj(sequence_row)
 
+def _new_batch_stats():
+    return {"batches"           : 0,
+            "requests"          : 0,
+            "max-batch-size"    : 0, }
+
 def main():
     """
     main entry point
@@ -373,7 +404,8 @@ def main():
                                             "rs_db_pool_controller"),
                          active_retrieves=dict(),
                          pending_work_queue=deque(),
-                         available_ident_queue=deque())
+                         available_ident_queue=deque(),
+                         batch_stats=_new_batch_stats())
 
     log.debug("binding to {0}".format(db_controller_pull_socket_uri))
     resources.pull_socket.bind(db_controller_pull_socket_uri)
@@ -415,20 +447,39 @@ def main():
             current_time = time.time()
             elapsed_time = current_time - last_report_time
             if elapsed_time > _reporting_interval:
+                batch_stats = resources.batch_stats
+                mean_batch_size = 0.0
+                if batch_stats["batches"] > 0:
+                    mean_batch_size = \
+                        float(batch_stats["requests"]) / batch_stats["batches"]
+                queries_saved = batch_stats["requests"] - batch_stats["batches"]
                 report_message = \
                     "{0:,} active_retrives, " \
                     "{1:,} pending_work_queue entries, " \
-                    "{2:,} available_ident_queue entries" \
+                    "{2:,} available_ident_queue entries, " \
+                    "{3:,} requests in {4:,} batches " \
+                    "(mean {5:.1f}, max {6:,}, {7:,} queries saved)" \
                     "".format(len(resources.active_retrieves),
                               len(resources.pending_work_queue),
-                              len(resources.available_ident_queue))
+                              len(resources.available_ident_queue),
+                              batch_stats["requests"],
+                              batch_stats["batches"],
+                              mean_batch_size,
+                              batch_stats["max-batch-size"],
+                              queries_saved)
                 log.info(report_message)
                 resources.event_push_client.info(
                     "queue_sizes", 
                     report_message,
                     active_retrieves=len(resources.active_retrieves),
                     pending_work_queue=len(resources.pending_work_queue),
-                    available_ident_queue=len(resources.available_ident_queue))
+                    available_ident_queue=len(resources.available_ident_queue),
+                    batch_count=batch_stats["batches"],
+                    batched_requests=batch_stats["requests"],
+                    mean_batch_size=mean_batch_size,
+                    max_batch_size=batch_stats["max-batch-size"],
+                    queries_saved=queries_saved)
+                resources.batch_stats.update(_new_batch_stats())
 
                 last_report_time = current_time
 
@@ -59,6 +59,42 @@ where seq.segment_id = (
 )
 order by seq.sequence_num asc"""
 
+# look up the sequence rows for a batch of requests in one query.
+# requests are identified by their index in the batch, which comes
+# back as the first column of each row
+_batch_request_values = \
+    "(%s::int4, %s::int4, %s::varchar, %s::int8, %s::int4, %s::int2, %s::int4)"
+_all_sequence_rows_for_batch_query = """
+select req_seg.request_index, {0}
+from nimbusio_node.segment_sequence seq 
+inner join nimbusio_node.value_file val
+on seq.value_file_id = val.id
+inner join (
+    select distinct on (req.request_index) 
+        req.request_index, seg.id as segment_id
+    from (values {1}) as req (
+        request_index, 
+        collection_id, 
+        key, 
+        unified_id, 
+        conjoined_part, 
+        segment_num, 
+        handoff_node_id
+    )
+    inner join nimbusio_node.segment seg
+    on seg.collection_id = req.collection_id
+    and seg.key = req.key
+    and seg.unified_id = req.unified_id
+    and seg.conjoined_part = req.conjoined_part
+    and seg.segment_num = req.segment_num
+    and (seg.handoff_node_id = req.handoff_node_id
+         or (seg.handoff_node_id is null and req.handoff_node_id is null))
+    and seg.status = 'F'
+    order by req.request_index, seg.id
+) as req_seg
+on seq.segment_id = req_seg.segment_id
+order by req_seg.request_index, seq.sequence_num asc"""
+
 def _send_initial_work_request(dealer_socket):
     """
     start the work cycle by notifying the controller that we are available
@@ -74,72 +110,106 @@ def _define_seq_val_fields():
     fields = ",".join([fields, "val.space_id"])
     return fields
 
+def _sequence_row_dict(row):
+    row_list = list(row)
+    segment_sequence_row = segment_sequence_template._make(row_list[:-1]) 
+    space_id = row_list[-1]
+    row_dict = dict(segment_sequence_row._asdict().items())
+    row_dict["hash"] = bytes(row_dict["hash"])
+    row_dict["space_id"] = space_id
+    return row_dict
+
+def _query_one_request(database_connection, request):
+    """
+    return the sequence rows for a single request
+    """
+    fields = _define_seq_val_fields()
+    if request["handoff-node-id"] is None:
+        query = _all_sequence_rows_for_segment_query.format(fields)
+    else:
+        query = _all_sequence_rows_for_handoff_query.format(fields)
+
+    result = database_connection.fetch_all_rows(query, request)    
+    return [[_sequence_row_dict(row) for row in result], ]
+
+def _query_batch(database_connection, batch):
+    """
+    return a list of sequence rows for each request in the batch
+    """
+    fields = _define_seq_val_fields()
+    query = _all_sequence_rows_for_batch_query.format(
+        fields, ", ".join([_batch_request_values for _ in batch])
+    )
+    args = list()
+    for request_index, (request, _control, ) in enumerate(batch):
+        args.extend([request_index,
+                     request["collection-id"],
+                     request["key"],
+                     request["segment-unified-id"],
+                     request["segment-conjoined-part"],
+                     request["segment-num"],
+                     request["handoff-node-id"], ])
+
+    result_lists = [list() for _ in batch]
+    for row in database_connection.fetch_all_rows(query, args):
+        request_index = row[0]
+        result_lists[request_index].append(_sequence_row_dict(row[1:]))
+    return result_lists
+
 def _process_one_transaction(dealer_socket, 
                              database_connection, 
                              event_push_client):
     """
     Wait for a reply to our last message from the controller.
-    This will be a query request.
+    This will be a batch of one or more query requests.
     We send the results to the controller and repeat the cycle, waiting for
     a reply
     """
     log = logging.getLogger("_process_one_transaction")
     log.debug("waiting work request")
     try:
-        request = dealer_socket.recv_pyobj()
+        batch = dealer_socket.recv_pyobj()
     except zmq.ZMQError as zmq_error:
         if is_interrupted_system_call(zmq_error):
             raise InterruptedSystemCall()
         raise
-    assert dealer_socket.rcvmore
-    control = dealer_socket.recv_pyobj()
-
-    fields = _define_seq_val_fields()
-    if request["handoff-node-id"] is None:
-        query = _all_sequence_rows_for_segment_query.format(fields)
-    else:
-        query = _all_sequence_rows_for_handoff_query.format(fields)
 
-    control["result"] = "success"
-    control["error-message"] = ""
     try:
-        result = database_connection.fetch_all_rows(query, request)    
+        if len(batch) == 1:
+            request, _control = batch[0]
+            result_lists = _query_one_request(database_connection, request)
+        else:
+            result_lists = _query_batch(database_connection, batch)
     except psycopg2.OperationalError as instance:
         error_message = "database error {0}".format(instance)
         event_push_client.error("database_error", error_message)
-        control["result"] = "database_error"
-        control["error-message"] = error_message
-    else:        
-        if len(result) == 0:
+        result_lists = [None for _ in batch]
+
+    reply_list = list()
+    for (request, control, ), result_list in zip(batch, result_lists):
+        control["result"] = "success"
+        control["error-message"] = ""
+        if result_list is None:
+            control["result"] = "database_error"
+            control["error-message"] = error_message
+        elif len(result_list) == 0:
             control["result"] = "no_sequence_rows_found"
             control["error-message"] = "no sequence rows found"
 
-    if control["result"] != "success":
-        log.error("user_request_id = {0}, " \
-                  "{1} {2}".format(request["user-request-id"],
-                                  control["result"], 
-                                  control["error-message"]))
-        dealer_socket.send_pyobj(request, zmq.SNDMORE)
-        dealer_socket.send_pyobj(control)
-        return
-
-    result_list = list()
-    for row in result:
-        row_list = list(row)
-        segment_sequence_row = segment_sequence_template._make(row_list[:-1]) 
-        space_id = row_list[-1]
-        row_dict = dict(segment_sequence_row._asdict().items())
-        row_dict["hash"] = bytes(row_dict["hash"])
-        row_dict["space_id"] = space_id
-        result_list.append(row_dict)
-
-    log.debug("user_request_id = {0}, " \
-              " sending request back to controller".format(
-              request["user-request-id"]))
+        if control["result"] != "success":
+            log.error("user_request_id = {0}, " \
+                      "{1} {2}".format(request["user-request-id"],
+                                      control["result"], 
+                                      control["error-message"]))
+            reply_list.append((request, control, None, ))
+            continue
+
+        reply_list.append((request, control, result_list, ))
+
+    log.debug("sending {0} requests back to controller".format(
+              len(reply_list)))
     
-    dealer_socket.send_pyobj(request, zmq.SNDMORE)
-    dealer_socket.send_pyobj(control, zmq.SNDMORE)
-    dealer_socket.send_pyobj(result_list)
+    dealer_socket.send_pyobj(reply_list)
 
 def main():
     """
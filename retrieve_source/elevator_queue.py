@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+elevator_queue.py
+
+A queue of pending reads for one volume, served in disk order.
+
+Entries are kept sorted by (space_id, value_file_id, value_file_offset).
+Each pop returns the next entry at or beyond the position of the last one
+served, wrapping back to the start when we run off the end (C-SCAN). So
+under concurrent load we sweep across the volume, instead of seeking back
+and forth in arrival order, and no entry waits longer than one sweep.
+"""
+from bisect import bisect_left, insort
+
+class ElevatorQueue(object):
+    """
+    A queue of pending reads for one volume, served in disk order.
+    """
+    def __init__(self):
+        self._entries = list()
+        self._position = None
+        self._arrival_count = 0
+        self.sweep_count = 0
+        self.sequential_count = 0
+        self.pop_count = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def push(self, space_id, value_file_id, value_file_offset, item):
+        """
+        add an item to be read from value_file_offset in value_file_id.
+        The arrival count keeps entries for the same offset in FIFO order
+        and means we never compare the items themselves.
+        """
+        self._arrival_count += 1
+        insort(self._entries,
+               ((space_id, value_file_id, value_file_offset,
+                 self._arrival_count, ),
+                item, ))
+
+    def pop(self):
+        """
+        remove and return the next item in disk order
+        raise IndexError if the queue is empty
+        """
+        if len(self._entries) == 0:
+            raise IndexError("pop from empty ElevatorQueue")
+
+        index = 0
+        if self._position is not None:
+            index = bisect_left(self._entries, (self._position, ))
+            if index == len(self._entries):
+                index = 0
+                self.sweep_count += 1
+
+        key, item = self._entries.pop(index)
+        space_id, value_file_id, value_file_offset, _ = key
+        if self._position is not None \
+        and self._position[:2] == (space_id, value_file_id, ):
+            self.sequential_count += 1
+        self._position = (space_id, value_file_id, value_file_offset, )
+        self.pop_count += 1
+
+        return item
@@ -28,6 +28,7 @@ from tools.zeromq_util import PollError, \
 
 from retrieve_source.internal_sockets import io_controller_pull_socket_uri, \
         io_controller_router_socket_uri
+from retrieve_source.elevator_queue import ElevatorQueue
 
 _resources_tuple = namedtuple("Resources", 
                               ["halt_event",
@@ -59,6 +60,9 @@ def _send_pending_work_to_available_workers(resources):
     """
     send messages from the pending_work_queue 
     to workers in the available_ident_queue
+
+    each volume's pending work is an ElevatorQueue, so workers get reads
+    in disk order rather than arrival order
     """
     log = logging.getLogger("_send_pending_work_to_available_workers")
     for volume_name in set(resources.volume_by_space_id.values()):
@@ -68,7 +72,7 @@ def _send_pending_work_to_available_workers(resources):
                                                          volume_name))
         for _ in range(work_count):
             message, control, sequence_row = \
-                resources.pending_work_by_volume[volume_name].popleft()
+                resources.pending_work_by_volume[volume_name].pop()
             ident = resources.available_ident_by_volume[volume_name].popleft()
             resources.router_socket.send(ident, zmq.SNDMORE)
             resources.router_socket.send_pyobj(message, zmq.SNDMORE)
@@ -107,9 +111,12 @@ def _read_pull_socket(resources):
             return
 
         log.debug("work for volume {0} {1}".format(volume_name, sequence_row))
-        resources.pending_work_by_volume[volume_name].append((message,
-                                                              control,
-                                                              sequence_row, ))
+        resources.pending_work_by_volume[volume_name].push(
+            space_id,
+            sequence_row["value_file_id"],
+            sequence_row["value_file_offset"],
+            (message, control, sequence_row, )
+        )
 
     _send_pending_work_to_available_workers(resources)
 
@@ -190,7 +197,7 @@ def main():
                          event_push_client=\
                             EventPushClient(zeromq_context, 
                                             "rs_io_controller"),
-                         pending_work_by_volume=defaultdict(deque),
+                         pending_work_by_volume=defaultdict(ElevatorQueue),
                          available_ident_by_volume=defaultdict(deque))
 
     log.debug("binding to {0}".format(io_controller_pull_socket_uri))
@@ -233,15 +240,27 @@ def main():
             elapsed_time = current_time - last_report_time
             if elapsed_time > _reporting_interval:
                 pending_work = 0
+                dispatched_work = 0
+                sequential_work = 0
+                sweeps = 0
                 for volume_queue in resources.pending_work_by_volume.values():
                     pending_work += len(volume_queue)
+                    dispatched_work += volume_queue.pop_count
+                    sequential_work += volume_queue.sequential_count
+                    sweeps += volume_queue.sweep_count
                 report_message = \
-                    "{0:,} pending_work entries".format(pending_work)
+                    "{0:,} pending_work entries, " \
+                    "{1:,} dispatched, {2:,} in the same value file " \
+                    "as the previous read, {3:,} sweeps".format(
+                    pending_work, dispatched_work, sequential_work, sweeps)
                 log.info(report_message)
                 resources.event_push_client.info(
                     "queue_sizes", 
                     report_message,
-                    pending_work=pending_work)
+                    pending_work=pending_work,
+                    dispatched_work=dispatched_work,
+                    sequential_work=sequential_work,
+                    sweeps=sweeps)
 
                 last_report_time = current_time
 
@@ -35,13 +35,28 @@ _repository_path = os.environ["NIMBUSIO_REPOSITORY_PATH"]
 _max_file_cache_size = 1000
 _unused_file_close_interval = 120.0
 
+# when we read a whole sequence, we reply with the md5 and adler32 stored in
+# its segment_sequence row instead of recomputing them. If this is > 0,
+# we also verify one in this many whole sequence reads against the stored
+# md5, after the reply has been sent
+_verify_interval = int(os.environ.get(
+    "NIMBUSIO_RETRIEVE_SOURCE_VERIFY_INTERVAL", "0")
+)
+
+# when a retrieve has more sequences to come, we ask the kernel to start
+# reading the next one (posix_fadvise WILLNEED) after we send our reply
+_readahead_enabled = \
+    os.environ.get("NIMBUSIO_RETRIEVE_SOURCE_READAHEAD", "1") == "1" \
+    and hasattr(os, "posix_fadvise")
+
 _resources_tuple = namedtuple("Resources", 
                               ["halt_event",
                                "zeromq_context",
                                "reply_push_sockets",
                                "dealer_socket",
                                "event_push_client",
-                               "file_cache", ])
+                               "file_cache", 
+                               "stats", ])
 
 def _send_work_request(resources, volume_name):
     """
@@ -81,6 +96,22 @@ def _send_error_reply(resources, message, control):
               "error-message"        : control["error-message"],}
     push_socket.send_json(reply)
 
+def _read_encoded_data(value_file, read_offset, read_size):
+    """
+    read directly into a single buffer, without the copies made by
+    a buffered read. return a memoryview of the data actually read.
+    """
+    encoded_data = bytearray(read_size)
+    encoded_view = memoryview(encoded_data)
+    value_file.seek(read_offset)
+    bytes_read = 0
+    while bytes_read < read_size:
+        read_count = value_file.readinto(encoded_view[bytes_read:])
+        if read_count == 0:
+            break
+        bytes_read += read_count
+    return encoded_view[:bytes_read]
+
 def _process_request(resources):
     """
     Wait for a reply to our last message from the controller.
@@ -110,24 +141,18 @@ def _process_request(resources):
     control["result"] = "success"
     control["error-message"] = ""
 
-    if value_file_path in resources.file_cache:
-        value_file, _ = resources.file_cache[value_file_path]
-        del resources.file_cache[value_file_path]
-    else:
-        try:
-            value_file = open(value_file_path, "rb")
-        except Exception as instance:
-            log.exception("user_request_id = {0}, " \
-                          "read {1}".format(request["user-request-id"],
-                                            value_file_path))
-            resources.event_push_client.exception("error_opening_value_file", 
-                                                  str(instance))
-            control["result"] = "error_opening_value_file"
-            control["error-message"] = str(instance)
-            
-        if control["result"] != "success":
-            _send_error_reply(resources, request, control)
-            return
+    try:
+        value_file = _get_value_file(resources, value_file_path)
+    except Exception as instance:
+        log.exception("user_request_id = {0}, " \
+                      "read {1}".format(request["user-request-id"],
+                                        value_file_path))
+        resources.event_push_client.exception("error_opening_value_file", 
+                                              str(instance))
+        control["result"] = "error_opening_value_file"
+        control["error-message"] = str(instance)
+        _send_error_reply(resources, request, control)
+        return
 
     read_offset = \
         sequence_row["value_file_offset"] + \
@@ -150,8 +175,7 @@ def _process_request(resources):
         read_size += last_block_delta 
 
     try:
-        value_file.seek(read_offset)
-        encoded_data = value_file.read(read_size)
+        encoded_data = _read_encoded_data(value_file, read_offset, read_size)
     except Exception as instance:
         log.exception("user_request_id = {0}, " \
                       "read {1}".format(request["user-request-id"],
@@ -183,16 +207,19 @@ def _process_request(resources):
         _send_error_reply(resources, request, control)
         return
 
+    # these are memoryview slices of encoded_data, not copies
     encoded_block_list = list(encoded_block_generator(encoded_data))
 
-    segment_size = 0
-    segment_adler32 = 0
-    segment_md5 = hashlib.md5()
-    for encoded_block in encoded_block_list:
-        segment_size += len(encoded_block)
-        segment_adler32 = zlib.adler32(encoded_block, segment_adler32) 
-        segment_md5.update(encoded_block)
-    segment_md5_digest = segment_md5.digest()
+    segment_size = len(encoded_data)
+    whole_sequence = segment_size == sequence_row["size"]
+    if whole_sequence:
+        segment_adler32 = sequence_row["adler32"]
+        segment_md5_digest = sequence_row["hash"]
+    else:
+        # hashing the whole buffer gives the same result as hashing
+        # the blocks in order
+        segment_adler32 = zlib.adler32(encoded_data, 0)
+        segment_md5_digest = hashlib.md5(encoded_data).digest()
 
     reply = {
         "message-type"          : "retrieve-key-reply",
@@ -213,10 +240,95 @@ def _process_request(resources):
     }
 
     push_socket = _get_reply_push_socket(resources, request["client-address"])
+    # zeromq takes the blocks without copying them into python bytes;
+    # each frame keeps a reference to encoded_data until it is sent
     push_socket.send_json(reply, zmq.SNDMORE)
     for encoded_block in encoded_block_list[:-1]:
-        push_socket.send(encoded_block, zmq.SNDMORE)
-    push_socket.send(encoded_block_list[-1])
+        push_socket.send(encoded_block, zmq.SNDMORE, copy=False)
+    push_socket.send(encoded_block_list[-1], copy=False)
+
+    if _readahead_enabled and control.get("readahead") is not None:
+        _advise_readahead(resources, request, control["readahead"])
+
+    if whole_sequence and _verify_interval > 0:
+        resources.stats["whole-sequence-reads"] += 1
+        if resources.stats["whole-sequence-reads"] % _verify_interval == 0:
+            _verify_sequence(resources, 
+                             request, 
+                             sequence_row, 
+                             value_file_path,
+                             encoded_data)
+
+def _get_value_file(resources, value_file_path):
+    """
+    return an open value file from the cache, or open a new one
+    the caller must put it back in the cache when it is done with it
+    """
+    if value_file_path in resources.file_cache:
+        value_file, _ = resources.file_cache[value_file_path]
+        del resources.file_cache[value_file_path]
+        return value_file
+
+    # unbuffered, so we can readinto our own buffer
+    return open(value_file_path, "rb", buffering=0)
+
+def _advise_readahead(resources, request, readahead):
+    """
+    tell the kernel we will soon need the next sequence of this retrieve
+    this is only a hint, so we log failures and carry on
+    """
+    log = logging.getLogger("_advise_readahead")
+    value_file_path = compute_value_file_path(_repository_path, 
+                                              readahead["space_id"], 
+                                              readahead["value_file_id"]) 
+    try:
+        value_file = _get_value_file(resources, value_file_path)
+    except Exception as instance:
+        log.warn("user_request_id = {0}, " \
+                 "unable to open {1} {2}".format(request["user-request-id"],
+                                                value_file_path,
+                                                instance))
+        return
+
+    try:
+        os.posix_fadvise(value_file.fileno(), 
+                         readahead["value_file_offset"], 
+                         readahead["size"], 
+                         os.POSIX_FADV_WILLNEED)
+    except Exception as instance:
+        log.warn("user_request_id = {0}, " \
+                 "fadvise {1} {2}".format(request["user-request-id"],
+                                          value_file_path,
+                                          instance))
+    else:
+        resources.stats["readahead-hints"] += 1
+
+    resources.file_cache[value_file_path] = value_file, time.time()
+
+def _verify_sequence(resources, 
+                     request, 
+                     sequence_row, 
+                     value_file_path, 
+                     encoded_data):
+    """
+    check data we have sent against the md5 stored in the database
+    """
+    log = logging.getLogger("_verify_sequence")
+    resources.stats["verified-sequences"] += 1
+    if hashlib.md5(encoded_data).digest() == sequence_row["hash"]:
+        return
+
+    resources.stats["verify-failures"] += 1
+    error_message = "{0} md5 mismatch segment_id {1} " \
+                    "sequence_num {2} {3} offset {4}".format(
+                    request["retrieve-id"],
+                    sequence_row["segment_id"],
+                    sequence_row["sequence_num"],
+                    value_file_path,
+                    sequence_row["value_file_offset"])
+    log.error("user_request_id = {0}, {1}".format(request["user-request-id"],
+                                                  error_message))
+    resources.event_push_client.error("sequence_md5_mismatch", error_message)
         
 def _make_close_pass(resources, current_time):
     log = logging.getLogger("_make_close_pass")
@@ -266,7 +378,11 @@ def main():
                          event_push_client=EventPushClient(zeromq_context, 
                                                            event_source_name),
                          dealer_socket=zeromq_context.socket(zmq.DEALER),
-                         file_cache=LRUCache(_max_file_cache_size))
+                         file_cache=LRUCache(_max_file_cache_size),
+                         stats={"whole-sequence-reads"  : 0,
+                                "verified-sequences"    : 0,
+                                "verify-failures"       : 0, 
+                                "readahead-hints"       : 0, })
 
     resources.dealer_socket.setsockopt(zmq.LINGER, 1000)
     log.debug("connecting to {0}".format(io_controller_router_socket_uri))
@@ -282,6 +398,14 @@ def main():
             if elapsed_time > _unused_file_close_interval:
                 _make_close_pass(resources, current_time)
                 last_close_pass_time = current_time 
+                if _verify_interval > 0:
+                    log.info("{whole-sequence-reads} whole sequence reads, "
+                             "{verified-sequences} verified, "
+                             "{verify-failures} failures".format(
+                             **resources.stats))
+                if _readahead_enabled:
+                    log.info("{readahead-hints} readahead hints".format(
+                             **resources.stats))
 
             _send_work_request(resources, volume_name)
             _process_request(resources)
@@ -80,6 +80,7 @@ More examples:
     python2.7 ./gc.py -c 1 -k key-10 -q collectable_archive > /tmp/test.sql ; vim /tmp/test.sql
     python2.7 ./gc.py -c 1 -v -q list_versions > /tmp/test.sql ; vim /tmp/test.sql
     python2.7 ./gc.py -c 1 -v -q list_versions -p key-10 -km key-100 -vm 140914007 > /tmp/test.sql ; vim /tmp/test.sql
+    python2.7 ./gc.py -c 1 -q list_key_prefixes -p photos/ -d / > /tmp/test.sql ; vim /tmp/test.sql
 
 """
 
@@ -796,6 +797,129 @@ def list_versions(collection_id, versioned=False, prefix=None, key_marker=None,
                    limit = limit)
     return sql
 
+def _delimited_prefix_length(key_sql):
+    """
+    sql expression for the length of the part of key_sql up to and including
+    the first %(delimiter)s after %(prefix)s, 0 if there is no delimiter after
+    the prefix
+    """
+    rest_sql = u"substr(%s, char_length(%%(prefix)s) + 1)" % (key_sql, )
+    return u"""
+CASE WHEN strpos(%(rest)s, %%(delimiter)s) > 0
+     THEN char_length(%%(prefix)s)
+          + strpos(%(rest)s, %%(delimiter)s)
+          + char_length(%%(delimiter)s) - 1
+     ELSE 0
+END""".strip() % dict(rest=rest_sql)
+
+def list_key_prefixes(collection_id,
+                      versioned=False,
+                      prefix=None,
+                      key_marker=None,
+                      limit=10001):
+    """
+    return sql to select the distinct delimited prefixes (a key cut after the
+    first %(delimiter)s that follows %(prefix)s) of final, not-garbage keys,
+    in key order. The same prefixes serve list_keys and list_versions.
+
+    Rather than reading every row, this is a skip scan: a recursive query
+    where each step finds the next key with a bare probe of
+    segment_key_c_idx, then applies the visibility rules (the same as
+    list_keys) to the rows of that one key. When the key is visible and has
+    a delimited prefix, the next step jumps past every key with that prefix;
+    otherwise it steps to the key after it. So the cost is about one probe
+    and one key's rows per prefix (and per undelimited or invisible key)
+    instead of one row per key. Keys without a delimiter after the prefix are
+    skipped over, not returned.
+
+    The jump compares against the prefix with its last character
+    incremented, which is only correct when keys sharing a prefix sort
+    together, so all the key comparisons here are in the "C" collation.
+
+    If key_marker has a delimited prefix, we start after that prefix,
+    otherwise after key_marker. %(key_marker)s and %(prefix)s must always be
+    bound ('' for none.)
+    """
+
+    if key_marker is not None and prefix is not None:
+        if key_marker < prefix:
+            raise ValueError("key_marker should be >= prefix")
+        if not key_marker.startswith(prefix):
+            raise ValueError("key_marker should start with prefix")
+
+    # scan_bound is the smallest key that can follow prefix_scan.scan_key:
+    # the start of the prefix range for an empty marker; the prefix with the
+    # last character of the delimiter incremented, when the key is visible
+    # and has a delimited prefix; otherwise the key itself followed by the
+    # lowest character. It is constant for each step, so key >= scan_bound is
+    # an index range.
+    prefix_length = _delimited_prefix_length(u"prefix_scan.scan_key")
+    scan_bound = u"""
+CASE WHEN prefix_scan.is_marker AND prefix_scan.scan_key = ''
+     THEN %%(prefix)s
+     WHEN prefix_scan.is_visible AND (%(prefix_length)s) > 0
+     THEN left(prefix_scan.scan_key, (%(prefix_length)s) - 1)
+          || chr(ascii(right(%%(delimiter)s, 1)) + 1)
+     ELSE prefix_scan.scan_key || chr(1)
+END""".strip() % dict(prefix_length=prefix_length)
+
+    next_key_sql = u"""
+SELECT key
+  FROM nimbusio_node.segment
+ WHERE collection_id = %%(collection_id)s
+   AND key COLLATE "C" >= (%(scan_bound)s)
+ ORDER BY key COLLATE "C"
+ LIMIT 1""".strip() % dict(scan_bound=scan_bound)
+
+    base_where = _base_where(
+        collection_id = collection_id,
+        exclude_later_parts = True,
+        exclude_active = True,
+        exclude_canceled = True,
+        pre_formed_clauses = [u"key = (%s)" % (next_key_sql, ), ]
+    )
+
+    next_key_visible_sql = _compose([u"1", ],
+                                    _from(exclude_handoffs = True,
+                                          base_where = base_where),
+                                    where = _where(final = True,
+                                                   garbage = False,
+                                                   versioned = versioned),
+                                    sort = None,
+                                    limit = None)
+
+    in_prefix = u"left(%s, char_length(%%(prefix)s)) = %%(prefix)s"
+
+    sql = u"""
+WITH RECURSIVE prefix_scan(scan_key, is_visible, is_marker) AS (
+SELECT %%(key_marker)s::varchar, true, true
+UNION ALL
+SELECT (
+%(next_key_sql)s
+), EXISTS (
+%(next_key_visible_sql)s
+), false
+  FROM prefix_scan
+ WHERE prefix_scan.scan_key IS NOT NULL
+   AND (prefix_scan.is_marker OR %(scan_key_in_prefix)s)
+)
+SELECT left(scan_key, %(prefix_length)s) AS prefix
+  FROM prefix_scan
+ WHERE NOT is_marker
+   AND is_visible
+   AND %(in_prefix)s
+   AND (%(prefix_length)s) > 0
+""".lstrip() % dict(next_key_sql=next_key_sql,
+                    next_key_visible_sql=next_key_visible_sql,
+                    scan_key_in_prefix=in_prefix % (u"prefix_scan.scan_key", ),
+                    in_prefix=in_prefix % (u"scan_key", ),
+                    prefix_length=_delimited_prefix_length(u"scan_key"))
+
+    if limit:
+        sql += u" LIMIT %d" % (limit, )
+
+    return sql
+
 def version_for_key(collection_id, versioned=False, key=None, unified_id=None):
     """
     Select all the final, not-garbage rows (including handoffs and conjoined
@@ -875,6 +999,8 @@ def _parse_command_line():
     parser.add_argument("-vm", "--version_marker", dest="version_marker", 
         help=u"version_marker when listing versions (a unified_id)", 
         default=None)
+    parser.add_argument("-d", "--delimiter", dest="delimiter", 
+        help=u"delimiter when listing key prefixes", default='/')
     parser.add_argument("-l", "--limit", dest="limit", 
         help=u"limit query to N results", default=None)
     args = parser.parse_args()
@@ -901,6 +1027,10 @@ def run_as_utility():
     elif args.query == 'list_keys':
         sql = func(args.collection_id, args.versioned, 
                    args.prefix, args.key_marker, args.limit)
+    elif args.query == 'list_key_prefixes':
+        query_params.setdefault("key_marker", '')
+        sql = func(args.collection_id, args.versioned, 
+                   args.prefix, args.key_marker, args.limit)
     elif args.query == 'version_for_key':
         sql = func(args.collection_id, args.versioned,
                    args.key, args.unified_id)
@@ -19,6 +19,33 @@ INSERT INTO nimbusio_central.space_accounting
 VALUES(%s, '%s'::timestamp, %s, %s, %s);
 """.strip()
 
+_update_total_command = """
+UPDATE nimbusio_central.space_accounting_total
+SET bytes_added = bytes_added + %s,
+bytes_removed = bytes_removed + %s,
+bytes_retrieved = bytes_retrieved + %s
+WHERE collection_id = %s
+""".strip()
+
+# the first time we see a collection, its total is the sum of its history,
+# including the row we have just inserted
+_insert_total_command = """
+INSERT INTO nimbusio_central.space_accounting_total
+(collection_id, bytes_added, bytes_removed, bytes_retrieved)
+SELECT %s, 
+COALESCE(SUM(bytes_added), 0), 
+COALESCE(SUM(bytes_removed), 0), 
+COALESCE(SUM(bytes_retrieved), 0)
+FROM nimbusio_central.space_accounting 
+WHERE collection_id = %s
+""".strip()
+
+_total_query = """
+SELECT bytes_added, bytes_removed, bytes_retrieved
+FROM nimbusio_central.space_accounting_total
+WHERE collection_id = %s
+""".strip()
+
 _collection_query = """
 SELECT COALESCE(SUM(bytes_added), 0), 
 COALESCE(SUM(bytes_removed), 0), 
@@ -32,6 +59,11 @@ DELETE FROM nimbusio_central.space_accounting
 WHERE collection_id = %s
 """.strip()
 
+_clear_total_command = """
+DELETE FROM nimbusio_central.space_accounting_total
+WHERE collection_id = %s
+""".strip()
+
 class SpaceAccountingDatabase(object):
     """wrap access to the space_accounting_table"""
     def __init__(self, transaction=True):
@@ -56,7 +88,10 @@ class SpaceAccountingDatabase(object):
         bytes_removed,
         bytes_retrieved
     ):
-        """store one row for an collection"""
+        """
+        store one row for an collection, and add it to the collection's
+        running total, in the same transaction
+        """
         command = _insert_command % (
             collection_id,
             timestamp,
@@ -65,18 +100,36 @@ class SpaceAccountingDatabase(object):
             bytes_retrieved,
         )
         self._connection.execute(command)
+
+        command = _update_total_command % (
+            bytes_added,
+            bytes_removed,
+            bytes_retrieved,
+            collection_id,
+        )
+        rowcount = self._connection.execute(command)
+        if rowcount == 0:
+            command = _insert_total_command % (collection_id, collection_id, )
+            self._connection.execute(command)
     
     def retrieve_collection_stats(self, collection_id):
         """get the consolidated stats for an collection"""
-        query = _collection_query % (collection_id, )
+        query = _total_query % (collection_id, )
         result = self._connection.fetch_one_row(query)
         if result is None:
-            raise SpaceAccountingDatabasecollectionNotFound(str(collection_id))
+            # no total yet: the collection has no stats, or they were stored
+            # before we kept totals
+            query = _collection_query % (collection_id, )
+            result = self._connection.fetch_one_row(query)
+        if result is None:
+            raise SpaceAccountingDatabaseCollectionNotFound(str(collection_id))
         [bytes_added, bytes_removed, bytes_retrieved, ] = result
         return bytes_added, bytes_removed, bytes_retrieved, 
 
     def clear_collection_stats(self, collection_id):
         """clear all stats for an collection *** for use in testing ***"""
+        command = _clear_total_command % (collection_id, )
+        self._connection.execute(command)
         command = _clear_command % (collection_id, )
         self._connection.execute(command)
 
@@ -23,6 +23,7 @@ import os
 import sys
 import time
 
+import psycopg2
 import zmq
 
 from tools.zeromq_pollster import ZeroMQPollster
@@ -66,6 +67,33 @@ def _handle_space_accounting_detail(state, message, _data):
     collection_entry[message["event"]] = \
         collection_entry.setdefault(message["event"], 0) + message["value"]
 
+def _retrieve_collection_stats(state, collection_id):
+    """
+    get the consolidated stats for a collection, using the connection we
+    keep open for space usage requests. If the connection has gone bad
+    (for example, the database was restarted) reconnect and try once more.
+    """
+    log = logging.getLogger("_retrieve_collection_stats")
+    for _ in range(2):
+        if state["space-accounting-database"] is None:
+            state["space-accounting-database"] = \
+                SpaceAccountingDatabase(transaction=False)
+        try:
+            return state["space-accounting-database"].\
+                    retrieve_collection_stats(collection_id)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError), instance:
+            log.warn("database connection failed, reconnecting %s" % (
+                instance, 
+            ))
+            try:
+                state["space-accounting-database"].close()
+            except psycopg2.Error:
+                pass
+            state["space-accounting-database"] = None
+            last_error = instance
+
+    raise last_error
+
 def _handle_space_usage_request(state, message, _data):
     log = logging.getLogger("_handle_space_usage_request")
     log.info("request for collection %s" % (message["collection-id"],))
@@ -78,21 +106,16 @@ def _handle_space_usage_request(state, message, _data):
         "result"        : None,
     }
 
-    # get sums of stats from the database
-    space_accounting_database = SpaceAccountingDatabase(transaction=False)
+    # get the running totals of stats from the database
     try:
-        stats = space_accounting_database.retrieve_collection_stats(
-            message["collection-id"]
-        )
-    except SpaceAccountingDatabasecollectionNotFound, instance:
+        stats = _retrieve_collection_stats(state, message["collection-id"])
+    except SpaceAccountingDatabaseCollectionNotFound, instance:
         error_message = "collection not found %s" % (instance, )
         log.warn(error_message)
         reply["result"] = "unknown-collection"
         reply["error-message"] = error_message
         state["router-server"].queue_message_for_send(reply)
         return
-    finally:
-        space_accounting_database.close()
 
     bytes_added, bytes_removed, bytes_retrieved = stats
 
@@ -123,6 +146,7 @@ def _create_state():
         "router-server"           : None,
         "event-push-client"     : None,
         "state-cleaner"         : None,
+        "space-accounting-database" : None,
         "receive-queue"         : deque(),
         "queue-dispatcher"      : None,
         "data"                  : dict(),
@@ -186,6 +210,9 @@ def _tear_down(_state):
 
     state["event-push-client"].close()
 
+    if state["space-accounting-database"] is not None:
+        state["space-accounting-database"].close()
+
     state["zmq-context"].term()
 
     log.debug("teardown complete")
@@ -1,3 +1,4 @@
+delete from nimbusio_central.space_accounting_total;
 delete from nimbusio_central.space_accounting;
 delete from nimbusio_central.collection;
 delete from nimbusio_central.customer_key;
@@ -3,3 +3,5 @@ delete from nimbusio_node.segment_sequence;
 delete from nimbusio_node.value_file;
 delete from nimbusio_node.meta;
 delete from nimbusio_node.conjoined;
+delete from nimbusio_node.gc_checkpoint;
+delete from nimbusio_node.gc_dirty_key;
@@ -0,0 +1,60 @@
+/****
+ * add the incremental garbage collector's tables to an existing node database
+ *
+ * A trigger on segment logs the (collection_id, key) of every segment row
+ * inserted or changing status in nimbusio_node.gc_dirty_key. We log every
+ * key that already has a segment row, so the first incremental run
+ * evaluates the whole node.
+ ****/
+
+BEGIN;
+
+set search_path to nimbusio_node, public;
+
+create sequence gc_dirty_key_id_seq;
+create table gc_dirty_key (
+    id int8 primary key default nextval('nimbusio_node.gc_dirty_key_id_seq'),
+    collection_id int4 not null,
+    key varchar(1024),
+    claimed boolean not null default false
+);
+create index gc_dirty_key_claimed_idx on gc_dirty_key (collection_id, key)
+    where claimed;
+
+create function log_gc_dirty_key() returns trigger as $$
+begin
+    insert into nimbusio_node.gc_dirty_key (collection_id, key)
+    values (NEW.collection_id, NEW.key);
+    return null;
+end;
+$$ language plpgsql;
+
+/* creating the triggers locks out writers to segment until we commit, 
+ * so no row can slip in between the triggers and the insert below */
+create trigger segment_insert_gc_dirty_key
+after insert on segment
+for each row
+when (NEW.handoff_node_id is null)
+execute procedure log_gc_dirty_key();
+
+create trigger segment_status_gc_dirty_key
+after update of status on segment
+for each row
+when (NEW.handoff_node_id is null and OLD.status is distinct from NEW.status)
+execute procedure log_gc_dirty_key();
+
+drop table if exists gc_checkpoint;
+create table gc_checkpoint (
+    id int4 primary key default 1,
+    run_in_progress boolean not null default false,
+    last_collection_id int4,
+    last_key varchar(1024),
+    constraint single_row check (id = 1)
+);
+
+INSERT INTO gc_dirty_key (collection_id, key)
+SELECT DISTINCT collection_id, key
+  FROM segment
+ WHERE handoff_node_id IS NULL;
+
+COMMIT;
@@ -79,6 +79,18 @@ create table space_accounting(
    bytes_removed int8 not null default 0,
    bytes_retrieved int8 not null default 0
 );
+create index space_accounting_collection_id_idx 
+    on nimbusio_central.space_accounting("collection_id");
+
+/* running totals of space_accounting for each collection, updated in the
+ * same transaction as the rows are inserted into space_accounting */
+create table space_accounting_total(
+   collection_id int4 primary key 
+       references nimbusio_central.collection(id),
+   bytes_added int8 not null default 0,
+   bytes_removed int8 not null default 0,
+   bytes_retrieved int8 not null default 0
+);
 
 create table collection_ops_accounting (
    collection_id int4 not null references nimbusio_central.collection(id),
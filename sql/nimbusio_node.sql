@@ -143,6 +143,11 @@ create table garbage_segment_conjoined_old (
  * has a similar effect to sharding this into a different index per collection.) 
  */
 create index segment_key_idx on nimbusio_node.segment("collection_id", "key");
+/* the same, ordered in the "C" collation whatever the database's locale, so
+ * keys that share a prefix are adjacent. list_key_prefixes in
+ * segment_visibility/sql_factory.py skips over whole prefixes in this index. */
+create index segment_key_c_idx 
+    on nimbusio_node.segment("collection_id", "key" COLLATE "C");
 /* a partial index just for handoffs, so it's easy to find these records when a
  * node comes back online */
 create index segment_handoff_idx on nimbusio_node.segment("handoff_node_id") where handoff_node_id is not null;
@@ -294,6 +299,58 @@ create table file_space (
     constraint possible_purpose check (purpose in ('journal', 'storage'))
 );
 
+/* (collection_id, key) of every segment row inserted, or changing status,
+ * that the incremental garbage collector has not yet evaluated.
+ * Rows are written by a trigger on segment, in the same transaction as the
+ * change, so a key only becomes visible here when its segment rows commit,
+ * whatever order their segment ids were allocated in (data_writer reserves
+ * ids in blocks long before it inserts the rows).
+ * A garbage collection run claims the rows committed when it starts, and
+ * deletes them in the transaction that finishes the run.
+ */
+create sequence gc_dirty_key_id_seq;
+create table gc_dirty_key (
+    id int8 primary key default nextval('nimbusio_node.gc_dirty_key_id_seq'),
+    collection_id int4 not null,
+    key varchar(1024),
+    claimed boolean not null default false
+);
+create index gc_dirty_key_claimed_idx on gc_dirty_key (collection_id, key)
+    where claimed;
+
+create function log_gc_dirty_key() returns trigger as $$
+begin
+    insert into nimbusio_node.gc_dirty_key (collection_id, key)
+    values (NEW.collection_id, NEW.key);
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger segment_insert_gc_dirty_key
+after insert on segment
+for each row
+when (NEW.handoff_node_id is null)
+execute procedure log_gc_dirty_key();
+
+create trigger segment_status_gc_dirty_key
+after update of status on segment
+for each row
+when (NEW.handoff_node_id is null and OLD.status is distinct from NEW.status)
+execute procedure log_gc_dirty_key();
+
+/* progress of the incremental garbage collector (a single row).
+ * While a run is in progress, the gc_dirty_key rows it has claimed are the
+ * keys it is evaluating, and last_collection_id, last_key is the last
+ * partition it has archived, so an interrupted run resumes where it left off.
+ */
+create table gc_checkpoint (
+    id int4 primary key default 1,
+    run_in_progress boolean not null default false,
+    last_collection_id int4,
+    last_key varchar(1024),
+    constraint single_row check (id = 1)
+);
+
 /* rollback; */
 commit;
 
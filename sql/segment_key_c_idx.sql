@@ -0,0 +1,14 @@
+/****
+ * add the "C" collation key index to an existing node database
+ *
+ * list_key_prefixes in segment_visibility/sql_factory.py compares and
+ * orders keys in the "C" collation, so keys that share a prefix are
+ * adjacent whatever the database's locale, and skips over whole prefixes
+ * in this index.
+ *
+ * create index concurrently cannot run inside a transaction, and does not
+ * lock out the data writer while it builds.
+ ****/
+
+create index concurrently segment_key_c_idx 
+    on nimbusio_node.segment("collection_id", "key" COLLATE "C");
@@ -0,0 +1,36 @@
+/****
+ * add running totals of space accounting to an existing central database
+ *
+ * space_accounting_server keeps nimbusio_central.space_accounting_total up to
+ * date as it dumps each hour's stats. This creates the table and fills it
+ * from the existing history.
+ ****/
+
+BEGIN;
+
+set search_path to nimbusio_central, public;
+
+create index space_accounting_collection_id_idx
+    on nimbusio_central.space_accounting("collection_id");
+
+create table space_accounting_total(
+   collection_id int4 primary key
+       references nimbusio_central.collection(id),
+   bytes_added int8 not null default 0,
+   bytes_removed int8 not null default 0,
+   bytes_retrieved int8 not null default 0
+);
+
+/* keep the space accounting server out while we fill the table */
+lock table nimbusio_central.space_accounting in share mode;
+
+INSERT INTO space_accounting_total
+(collection_id, bytes_added, bytes_removed, bytes_retrieved)
+SELECT collection_id,
+       sum(bytes_added),
+       sum(bytes_removed),
+       sum(bytes_retrieved)
+  FROM space_accounting
+ GROUP BY collection_id;
+
+COMMIT;
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+io_worker_read_benchmark.py
+
+compare bytes/sec for one retrieve_source io worker reading sequences
+from a (hot, page cached) value file, hashing them and sending them as
+zeromq frames: a buffered read sliced into bytes objects versus readinto
+a single buffer sent as memoryview frames without copying.
+
+usage: io_worker_read_benchmark.py [value file size MB] [request count]
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+from threading import Thread
+import time
+import zlib
+
+import zmq
+
+os.environ.setdefault("NIMBUSIO_NODE_NAME", "benchmark")
+os.environ.setdefault("NIMBUSIO_REPOSITORY_PATH", tempfile.gettempdir())
+os.environ.setdefault("NIMBUSIO_SOCKET_DIR", tempfile.gettempdir())
+
+from tools.data_definitions import encoded_block_generator, \
+        incoming_slice_size, \
+        zfec_slice_size
+from retrieve_source.io_worker import _read_encoded_data
+
+_address_template = "inproc://io_worker_read_benchmark_{0}"
+_rounds = 3
+_sequence_size = zfec_slice_size(incoming_slice_size)
+
+def _drain(context, address, request_count):
+    pull_socket = context.socket(zmq.PULL)
+    pull_socket.connect(address)
+    for _ in range(request_count):
+        pull_socket.recv_multipart(copy=False)
+    pull_socket.close()
+
+def _hash_blocks(encoded_block_list):
+    segment_adler32 = 0
+    segment_md5 = hashlib.md5()
+    for encoded_block in encoded_block_list:
+        segment_adler32 = zlib.adler32(encoded_block, segment_adler32)
+        segment_md5.update(encoded_block)
+    return segment_adler32, segment_md5.digest()
+
+def _buffered_read(value_file, push_socket, read_offset):
+    value_file.seek(read_offset)
+    encoded_data = value_file.read(_sequence_size)
+    encoded_block_list = list(encoded_block_generator(encoded_data))
+    _hash_blocks(encoded_block_list)
+    push_socket.send_json({}, zmq.SNDMORE)
+    for encoded_block in encoded_block_list[:-1]:
+        push_socket.send(encoded_block, zmq.SNDMORE)
+    push_socket.send(encoded_block_list[-1])
+
+def _zero_copy_read(value_file, push_socket, read_offset):
+    encoded_data = _read_encoded_data(value_file, read_offset, _sequence_size)
+    encoded_block_list = list(encoded_block_generator(encoded_data))
+    zlib.adler32(encoded_data, 0)
+    hashlib.md5(encoded_data).digest()
+    push_socket.send_json({}, zmq.SNDMORE)
+    for encoded_block in encoded_block_list[:-1]:
+        push_socket.send(encoded_block, zmq.SNDMORE, copy=False)
+    push_socket.send(encoded_block_list[-1], copy=False)
+
+def _run(context, address, value_file, read_function, offsets):
+    push_socket = context.socket(zmq.PUSH)
+    push_socket.bind(address)
+    drain_thread = Thread(target=_drain, 
+                          args=(context, address, len(offsets), ))
+    drain_thread.start()
+
+    start_time = time.time()
+    for read_offset in offsets:
+        read_function(value_file, push_socket, read_offset)
+    drain_thread.join()
+    elapsed_time = time.time() - start_time
+
+    push_socket.close()
+    return len(offsets) * _sequence_size / elapsed_time
+
+def main():
+    """
+    main entry point
+    """
+    file_size = 256 * 1024 * 1024
+    if len(sys.argv) > 1:
+        file_size = int(sys.argv[1]) * 1024 * 1024
+    request_count = 500
+    if len(sys.argv) > 2:
+        request_count = int(sys.argv[2])
+
+    sequence_count = file_size // _sequence_size
+    offsets = [random.randrange(sequence_count) * _sequence_size
+               for _ in range(request_count)]
+
+    context = zmq.Context()
+    with tempfile.NamedTemporaryFile() as output_file:
+        for _ in range(sequence_count):
+            output_file.write(os.urandom(_sequence_size))
+        output_file.flush()
+
+        # alternate the two, and keep the best of each
+        buffered_rate = 0.0
+        zero_copy_rate = 0.0
+        for index in range(_rounds):
+            with open(output_file.name, "rb") as value_file:
+                buffered_rate = max(buffered_rate, 
+                                    _run(context, 
+                                         _address_template.format(2*index),
+                                         value_file, 
+                                         _buffered_read, 
+                                         offsets))
+            with open(output_file.name, "rb", buffering=0) as value_file:
+                zero_copy_rate = max(zero_copy_rate, 
+                                     _run(context, 
+                                          _address_template.format(2*index+1),
+                                          value_file, 
+                                          _zero_copy_read, 
+                                          offsets))
+    context.term()
+
+    print("{0:,} reads of {1:,} bytes from a {2:,} byte value file".format(
+          request_count, _sequence_size, file_size))
+    print("buffered read   {0:8.1f} MB/s".format(
+          buffered_rate / (1024.0 * 1024.0)))
+    print("zero copy read  {0:8.1f} MB/s".format(
+          zero_copy_rate / (1024.0 * 1024.0)))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+redis_stats_collector_benchmark.py
+
+compare reading and removing operational stats keys from redis the way
+redis_stats_collector used to (KEYS, then one HGETALL and one DEL per key)
+against redis_stats_reader (SCAN, then pipelined batches of HGETALL and
+DEL), with many synthetic stats keys in a local redis.
+
+This connects to the local redis (REDIS_HOST, REDIS_PORT, REDIS_DB). The
+synthetic keys are created for a node name that is never used
+(benchmark-node), and removed by each run.
+
+usage: redis_stats_collector_benchmark.py [key count] [collections per key]
+"""
+from datetime import datetime, timedelta
+import sys
+import time
+
+from tools.redis_connection import create_redis_connection
+from tools.operational_stats_redis_key import compute_key, \
+        compute_search_key
+
+from redis_stats_collector.redis_stats_reader import \
+        generate_stats_key_batches, \
+        retrieve_stats_hashes, \
+        remove_stats_keys
+
+_node_name = "benchmark-node"
+_partial_keys = ["retrieve_request",
+                 "retrieve_success",
+                 "archive_request",
+                 "archive_success",
+                 "socket_bytes_in",
+                 "socket_bytes_out", ]
+_load_batch_size = 1000
+
+def _create_synthetic_keys(redis_connection, key_count, collections_per_key):
+    start_time = datetime.utcnow() - timedelta(days=1)
+    pipeline = redis_connection.pipeline(transaction=False)
+    for n in range(key_count):
+        minute = n // len(_partial_keys)
+        partial_key = _partial_keys[n % len(_partial_keys)]
+        key = compute_key(_node_name,
+                          start_time + timedelta(minutes=minute),
+                          partial_key)
+        mapping = dict()
+        for collection_offset in range(collections_per_key):
+            collection_id = (n * collections_per_key + collection_offset)
+            mapping[str(collection_id)] = 1
+        pipeline.hmset(key, mapping)
+        if (n + 1) % _load_batch_size == 0:
+            pipeline.execute()
+    pipeline.execute()
+
+def _per_key(redis_connection, search_key):
+    keys = redis_connection.keys(search_key)
+    count = 0
+    for key_bytes in keys:
+        hash_dict = redis_connection.hgetall(key_bytes.decode("utf-8"))
+        count += len(hash_dict)
+    for key_bytes in keys:
+        redis_connection.delete(key_bytes.decode("utf-8"))
+    return len(keys), count
+
+def _pipelined(redis_connection, search_key):
+    keys = list()
+    count = 0
+    for key_batch in generate_stats_key_batches(redis_connection, search_key):
+        for hash_dict in retrieve_stats_hashes(redis_connection, key_batch):
+            count += len(hash_dict)
+        keys.extend(key_batch)
+    remove_stats_keys(redis_connection, keys)
+    return len(keys), count
+
+def _time_run(redis_connection, function, key_count, collections_per_key):
+    start_time = time.time()
+    _create_synthetic_keys(redis_connection, key_count, collections_per_key)
+    print("created {0:,} keys in {1:.1f}s".format(
+          key_count, time.time() - start_time))
+
+    start_time = time.time()
+    found_key_count, value_count = \
+        function(redis_connection, compute_search_key(_node_name))
+    elapsed_time = time.time() - start_time
+    assert found_key_count == key_count, (found_key_count, key_count, )
+    assert value_count == key_count * collections_per_key, value_count
+    return elapsed_time
+
+def main():
+    """
+    main entry point
+    """
+    key_count = 100 * 1000
+    if len(sys.argv) > 1:
+        key_count = int(sys.argv[1])
+    collections_per_key = 10
+    if len(sys.argv) > 2:
+        collections_per_key = int(sys.argv[2])
+
+    redis_connection = create_redis_connection()
+
+    per_key_time = _time_run(redis_connection,
+                             _per_key,
+                             key_count,
+                             collections_per_key)
+    pipelined_time = _time_run(redis_connection,
+                               _pipelined,
+                               key_count,
+                               collections_per_key)
+
+    print("KEYS + per key HGETALL/DEL {0:,} keys in {1:.1f}s, "
+          "{2:,.0f} keys/s".format(
+          key_count, per_key_time, key_count / per_key_time))
+    print("SCAN + pipelined HGETALL/DEL {0:,} keys in {1:.1f}s, "
+          "{2:,.0f} keys/s".format(
+          key_count, pipelined_time, key_count / pipelined_time))
+    print("speedup {0:.1f}x".format(per_key_time / pipelined_time))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
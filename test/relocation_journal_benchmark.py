@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+relocation_journal_benchmark.py
+
+compare relocating segment_sequence rows with one update per sequence
+(as the defragger and gc_rewrite_value_files used to) against a
+RelocationJournal (COPY into a temp table, then one UPDATE ... FROM),
+on a simulated node with many sequences.
+
+This connects to the node local database (NIMBUSIO_NODE_NAME,
+NIMBUSIO_NODE_USER_PASSWORD, ...). The simulated rows are inserted under
+a collection_id that is never used, and everything is done in a single
+transaction which is rolled back at the end, so the database is left
+unchanged.
+
+usage: relocation_journal_benchmark.py [sequence count] [per row sample]
+
+The per row updates are timed over a sample of the sequences (default
+100,000), and the time for all of them is projected from that.
+"""
+import sys
+import time
+
+from tools.database_connection import get_node_local_connection
+from tools.relocation_journal import RelocationJournal
+
+_benchmark_collection_id = -1
+_sequences_per_segment = 10
+_old_value_file_id = -1
+_new_value_file_id = -2
+_sequence_size = 10 * 1024 * 1024
+
+_insert_simulated_rows = """
+insert into nimbusio_node.segment_sequence (
+    collection_id,
+    segment_id,
+    zfec_padding_size,
+    value_file_id,
+    sequence_num,
+    value_file_offset,
+    size,
+    hash,
+    adler32
+)
+select %(collection_id)s,
+       -1 - (n / %(sequences_per_segment)s),
+       0,
+       %(value_file_id)s,
+       n %% %(sequences_per_segment)s,
+       n::int8 * %(sequence_size)s,
+       %(sequence_size)s,
+       decode(md5(n::text), 'hex'),
+       0
+from generate_series(0, %(sequence_count)s - 1) as n
+"""
+
+def _simulated_relocations(sequence_count):
+    for n in range(sequence_count):
+        yield (_benchmark_collection_id,
+               -1 - (n // _sequences_per_segment),
+               n % _sequences_per_segment,
+               _new_value_file_id,
+               n * _sequence_size, )
+
+def _per_row_updates(connection, relocations):
+    for collection_id, segment_id, sequence_num, value_file_id, \
+    value_file_offset in relocations:
+        connection.execute("""
+            update nimbusio_node.segment_sequence
+            set value_file_id = %s, value_file_offset = %s
+            where collection_id = %s and segment_id = %s
+            and sequence_num = %s
+        """, [value_file_id,
+              value_file_offset,
+              collection_id,
+              segment_id,
+              sequence_num])
+
+def _journal_update(connection, relocations):
+    relocation_journal = RelocationJournal()
+    for relocation in relocations:
+        relocation_journal.add(*relocation)
+    return relocation_journal.apply(connection)
+
+def main():
+    """
+    main entry point
+    """
+    sequence_count = 1000 * 1000
+    if len(sys.argv) > 1:
+        sequence_count = int(sys.argv[1])
+    sample_count = min(100 * 1000, sequence_count)
+    if len(sys.argv) > 2:
+        sample_count = min(int(sys.argv[2]), sequence_count)
+
+    connection = get_node_local_connection()
+    connection.begin_transaction()
+    try:
+        start_time = time.time()
+        connection.execute(_insert_simulated_rows,
+                           {"collection_id"         : _benchmark_collection_id,
+                            "sequences_per_segment" : _sequences_per_segment,
+                            "value_file_id"         : _old_value_file_id,
+                            "sequence_size"         : _sequence_size,
+                            "sequence_count"        : sequence_count, })
+        connection.execute("analyze nimbusio_node.segment_sequence", [])
+        print("simulated {0:,} sequences in {1:.1f}s".format(
+              sequence_count, time.time() - start_time))
+
+        start_time = time.time()
+        _per_row_updates(connection,
+                         list(_simulated_relocations(sample_count)))
+        per_row_time = time.time() - start_time
+        projected_time = per_row_time * sequence_count / sample_count
+
+        start_time = time.time()
+        rowcount = _journal_update(connection,
+                                   _simulated_relocations(sequence_count))
+        journal_time = time.time() - start_time
+        assert rowcount == sequence_count, (rowcount, sequence_count, )
+    finally:
+        connection.rollback()
+        connection.close()
+
+    print("per row updates  {0:,} rows in {1:.1f}s, "
+          "{2:,.0f} rows/s, projected {3:.1f}s for {4:,} rows".format(
+          sample_count,
+          per_row_time,
+          sample_count / per_row_time,
+          projected_time,
+          sequence_count))
+    print("relocation journal {0:,} rows in {1:.1f}s, {2:,.0f} rows/s".format(
+          sequence_count, journal_time, sequence_count / journal_time))
+    print("speedup {0:.1f}x".format(projected_time / journal_time))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+zfec_segmenter_benchmark.py
+
+compare the throughput (MB/s) of the per block zfec encode/decode with
+the contiguous slice encode/decode
+"""
+import os
+import random
+import sys
+import time
+
+from tools.data_definitions import block_generator, incoming_slice_size
+from tools.zfec_segmenter import ZfecSegmenter
+
+_num_segments = 10
+_min_segments = 8
+_iterations = int(os.environ.get("ZFEC_BENCHMARK_ITERATIONS", "20"))
+
+def _megabytes_per_second(byte_count, elapsed_time):
+    return byte_count / (1024.0 * 1024.0) / elapsed_time
+
+def _time_it(function, *args):
+    start_time = time.time()
+    for _ in range(_iterations):
+        result = function(*args)
+    return result, time.time() - start_time
+
+def _block_encode(segmenter, data):
+    return segmenter.encode(block_generator(data))
+
+def _block_decode(segmenter, segments, segment_numbers, padding_size):
+    return b"".join(segmenter.decode(segments, segment_numbers, padding_size))
+
+def main():
+    """
+    main entry point
+    """
+    slice_size = incoming_slice_size
+    if len(sys.argv) > 1:
+        slice_size = int(sys.argv[1])
+
+    data = os.urandom(slice_size)
+    segmenter = ZfecSegmenter(_min_segments, _num_segments)
+    padding_size = segmenter.padding_size(data)
+    segment_numbers = random.sample(range(1, _num_segments+1), _min_segments)
+    byte_count = slice_size * _iterations
+
+    block_segments, block_encode_time = \
+        _time_it(_block_encode, segmenter, data)
+    slice_segments, slice_encode_time = \
+        _time_it(segmenter.encode_slice, data)
+
+    block_data, block_decode_time = \
+        _time_it(_block_decode,
+                 segmenter,
+                 [block_segments[n-1] for n in segment_numbers],
+                 segment_numbers,
+                 padding_size)
+    slice_data, slice_decode_time = \
+        _time_it(segmenter.decode_slice,
+                 [slice_segments[n-1] for n in segment_numbers],
+                 segment_numbers,
+                 padding_size)
+
+    assert block_data == data
+    assert slice_data == data
+
+    print("slice size {0:,} bytes, {1} iterations".format(slice_size,
+                                                          _iterations))
+    print("encode per block {0:8.1f} MB/s".format(
+        _megabytes_per_second(byte_count, block_encode_time)))
+    print("encode slice     {0:8.1f} MB/s".format(
+        _megabytes_per_second(byte_count, slice_encode_time)))
+    print("decode per block {0:8.1f} MB/s".format(
+        _megabytes_per_second(byte_count, block_decode_time)))
+    print("decode slice     {0:8.1f} MB/s".format(
+        _megabytes_per_second(byte_count, slice_decode_time)))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,12 +5,65 @@ base_lookup.py
 See Ticket #45 Cache records from nimbus.io central database in memcached
 
 This is a base class for table lookups, wrapping common functionality
+
+In a process that runs a GreenletCacheInvalidator, lookups are also cached
+in memory, in front of memcached, so a hot collection costs no network
+round trip. The invalidator drops entries when the central database
+changes; the time to live covers any change we miss.
+
+The invalidator may see a change before central_cache_update has deleted
+the row from memcached. So invalidating a row also deletes it from
+memcached, and for a short hold off we don't cache the row in memory, in
+case a lookup already in flight brings back the stale row.
 """
 import logging
+import os
+import time
+from weakref import WeakSet
 
 from tools.data_definitions import memcached_central_key_template
+from tools.LRUCache import LRUCache
 
 _expiration_time_in_seconds = 24 * 60 * 60 # expiration of 1 day
+_l1_time_to_live = float(
+    os.environ.get("NIMBUSIO_CENTRAL_LOOKUP_L1_TIME_TO_LIVE", "60"))
+_l1_max_entries = int(
+    os.environ.get("NIMBUSIO_CENTRAL_LOOKUP_L1_MAX_ENTRIES", "10000"))
+_l1_invalidate_hold_off = float(
+    os.environ.get("NIMBUSIO_CENTRAL_LOOKUP_L1_INVALIDATE_HOLD_OFF", "5"))
+
+# the in memory cache is only safe to use when something is invalidating it
+_l1_enabled = False
+_live_lookups = WeakSet()
+
+def enable_l1_cache():
+    """
+    cache lookups in memory, as well as in memcached.
+    called by GreenletCacheInvalidator once it has subscribed to changes
+    """
+    global _l1_enabled
+    _l1_enabled = _l1_time_to_live > 0.0
+
+def disable_l1_cache():
+    global _l1_enabled
+    _l1_enabled = False
+    clear_l1_cache()
+
+def invalidate_l1_cache(table_name, lookup_field_name, lookup_field_value):
+    """
+    drop one row from the in memory cache of every lookup on table_name
+    by lookup_field_name
+    """
+    for lookup in list(_live_lookups):
+        lookup.invalidate(table_name, lookup_field_name, lookup_field_value)
+
+def clear_l1_cache(table_name=None):
+    """
+    drop every row from the in memory cache of every lookup (on table_name)
+    """
+    for lookup in list(_live_lookups):
+        if table_name is None or lookup.table_name == table_name:
+            lookup.clear()
 
 class BaseLookup(object):
     """
@@ -31,6 +84,15 @@ class BaseLookup(object):
         self._table_name = table_name
         self._lookup_field_name = lookup_field_name
         self._database_lookup_function = database_lookup_function
+        self._l1_cache = LRUCache(_l1_max_entries)
+        # lookup value -> time before which we don't cache it in memory
+        self._l1_hold_off = LRUCache(_l1_max_entries)
+        self._l1_clear_hold_off = 0.0
+        _live_lookups.add(self)
+
+    @property
+    def table_name(self):
+        return self._table_name
 
     def __str__(self):
         return self._name
@@ -50,6 +112,76 @@ class BaseLookup(object):
         retrieve a dict of column data from memcached, or database
         return None if not found
         """
+        if _l1_enabled:
+            entry = self._l1_cache.get(lookup_field_value)
+            if entry is not None:
+                expiration_time, cached_dict = entry
+                if time.time() < expiration_time:
+                    return cached_dict
+                del self._l1_cache[lookup_field_value]
+
+        result = self._get_from_memcached_or_database(lookup_field_value)
+
+        # we don't cache misses, so a new row is visible at once
+        if _l1_enabled and result is not None \
+        and not self._in_hold_off(lookup_field_value):
+            self._l1_cache[lookup_field_value] = \
+                (time.time() + _l1_time_to_live, result, )
+
+        return result
+
+    def _in_hold_off(self, lookup_field_value):
+        """
+        return True if the value was invalidated too recently to cache it
+        """
+        current_time = time.time()
+        if current_time < self._l1_clear_hold_off:
+            return True
+        hold_off_time = self._l1_hold_off.get(lookup_field_value)
+        if hold_off_time is None:
+            return False
+        if current_time < hold_off_time:
+            return True
+        del self._l1_hold_off[lookup_field_value]
+        return False
+
+    def invalidate(self, table_name, lookup_field_name, lookup_field_value):
+        """
+        drop a row from memcached and the in memory cache, if this lookup
+        caches it
+        """
+        if table_name != self._table_name \
+        or lookup_field_name != self._lookup_field_name:
+            return
+
+        # central_cache_update deletes the same key, deleting it twice is
+        # harmless
+        memcached_key = \
+            memcached_central_key_template.format(self._table_name,
+                                                  self._lookup_field_name,
+                                                  lookup_field_value)
+        result = self._memcached_client.delete(memcached_key)
+        self._log.debug("delete {0} result = {1}".format(memcached_key,
+                                                         result))
+
+        hold_off_time = time.time() + _l1_invalidate_hold_off
+
+        # the lookup value may have come to us as a string, or as an int
+        for value in [lookup_field_value, str(lookup_field_value), ]:
+            self._l1_hold_off[value] = hold_off_time
+            if value in self._l1_cache:
+                self._log.debug("invalidate {0}".format(value))
+                del self._l1_cache[value]
+
+    def clear(self):
+        """
+        drop every row from the in memory cache
+        """
+        self._l1_clear_hold_off = time.time() + _l1_invalidate_hold_off
+        self._l1_cache.clear()
+        self._l1_hold_off.clear()
+
+    def _get_from_memcached_or_database(self, lookup_field_value):
         memcached_key = \
             memcached_central_key_template.format(self._table_name,
                                                   self._lookup_field_name,
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+central_cache_event.py
+
+Ticket #47 Update/Invalidate memcache records when central DB changes
+
+parse the events published (through skeeter) by the triggers in
+nimbusio_central_triggers.sql, and work out which cached lookups they make
+stale. Shared by central_cache_update, which deletes the memcached entries,
+and GreenletCacheInvalidator, which drops entries from the in-process cache
+in front of memcached.
+"""
+import base64
+import pickle
+import time
+import zlib
+
+cache_update_channel = "nimbusio_central_cache_update"
+
+# the fields we look up each table by (see the subclasses of BaseLookup)
+_lookup_fields = {
+    "collection"    : ["id", "name", ],
+    "customer"      : ["id", "username", ],
+    "customer_key"  : ["id", ],
+}
+
+def parse_cache_update_meta(meta):
+    """
+    return a dict of the skeeter meta data for an event.
+    Every event should have a sequence and a timestamp.
+    """
+    meta_dict = dict()
+    for entry in meta.strip().split(";"):
+        [key, value] = entry.split("=")
+        meta_dict[key.strip()] = value.strip()
+
+    meta_dict["timestamp"] = time.ctime(int(meta_dict["timestamp"]))
+    meta_dict["sequence"] = int(meta_dict["sequence"])
+
+    return meta_dict
+
+def parse_cache_update_data(data):
+    """
+    return the dict pickled by the notify_cache_update trigger
+    """
+    _table_name, _uuid, raw_data = data.split("\n", 2)
+    return pickle.loads(zlib.decompress(base64.b64decode(raw_data)))
+
+def compute_stale_lookups(event_data):
+    """
+    return a list of (table_name, lookup_field_name, lookup_field_value)
+    for the cached lookups made stale by the event.
+
+    return None if the event is for a table we cache, but does not tell us
+    which rows (the trigger strips out the rows if they are too large)
+    """
+    table_name = event_data.get("table_name")
+    if table_name not in _lookup_fields:
+        return []
+
+    if event_data.get("event") != "UPDATE":
+        return []
+
+    if event_data.get("old") is None:
+        return None
+
+    stale_lookups = list()
+    for lookup_field in _lookup_fields[table_name]:
+        stale_lookups.append(
+            (table_name, lookup_field, event_data["old"][lookup_field], ))
+
+    # deleted collections have their name changed to have __deleted__$id__ at
+    # the front so that they do not conflict with future collections.  in order
+    # to clear caches even when we have mass updates.
+    if table_name == "collection":
+        name = event_data["old"]["name"]
+        if name.startswith("__deleted__"):
+            undecorated_name = name[name.rindex("_") + 1:]
+            stale_lookups.append((table_name, "name", undecorated_name, ))
+
+    return stale_lookups
+
+def is_cached_table(table_name):
+    """
+    return True if we cache lookups on rows of the table
+    """
+    return table_name in _lookup_fields
@@ -63,3 +63,17 @@ def find_least_volume_space_id(purpose, file_space_info):
 
     return max_space_id
 
+def compute_volume_by_space_id(file_space_info):
+    """
+    map each space_id to a volume name, spaces with a null volume are
+    each a volume of their own
+    """
+    volume_by_space_id = dict()
+    for file_space_row_list in file_space_info.values():
+        for file_space_row in file_space_row_list:
+            if file_space_row.volume is None:
+                volume_name = "space-{0}".format(file_space_row.space_id)
+            else:
+                volume_name = file_space_row.volume
+            volume_by_space_id[file_space_row.space_id] = volume_name
+    return volume_by_space_id
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+greenlet_cache_invalidator.py
+
+a greenlet that subscribes to the central database changes published by
+skeeter, and drops the changed rows from memcached and from the in memory
+cache in front of it (see base_lookup.py)
+"""
+import logging
+
+from  gevent.greenlet import Greenlet
+from gevent_zeromq import zmq
+
+from tools.zeromq_util import prepare_ipc_path
+from tools.base_lookup import enable_l1_cache, \
+        disable_l1_cache, \
+        invalidate_l1_cache, \
+        clear_l1_cache
+from tools.central_cache_event import cache_update_channel, \
+        parse_cache_update_meta, \
+        parse_cache_update_data, \
+        compute_stale_lookups
+
+class GreenletCacheInvalidator(Greenlet):
+    """
+    context
+        zeromq context
+
+    address
+        the address of the skeeter PUB socket
+        (NIMBUSIO_CENTRAL_SKEETER_URI)
+
+    The in memory cache is enabled while this greenlet runs. If we miss an
+    event (a gap in the sequence numbers) we clear the whole cache.
+    """
+    def __init__(self, context, address):
+        Greenlet.__init__(self)
+
+        self._log = logging.getLogger("CacheInvalidator")
+
+        # we need a valid path for IPC sockets
+        if address.startswith("ipc://"):
+            prepare_ipc_path(address)
+
+        self._sub_socket = context.socket(zmq.SUB)
+        self._log.debug("connecting to {0}".format(address))
+        self._sub_socket.connect(address)
+        self._sub_socket.setsockopt(zmq.SUBSCRIBE, cache_update_channel)
+
+        self._expected_sequence = None
+
+    def join(self, timeout=3.0):
+        """
+        Clean up and wait for the greenlet to shut down
+        """
+        self._log.debug("joining")
+        disable_l1_cache()
+        self._sub_socket.close()
+        Greenlet.join(self, timeout)
+        self._log.debug("join complete")
+
+    def _run(self):
+        enable_l1_cache()
+        try:
+            while True:
+                _topic = self._sub_socket.recv()
+                assert self._sub_socket.rcvmore
+                meta = self._sub_socket.recv()
+                if self._sub_socket.rcvmore:
+                    data = self._sub_socket.recv()
+                else:
+                    data = ""
+                self._handle_event(meta, data)
+        finally:
+            disable_l1_cache()
+
+    def _handle_event(self, meta, data):
+        meta_dict = parse_cache_update_meta(meta)
+        if self._expected_sequence is not None \
+        and meta_dict["sequence"] != self._expected_sequence:
+            self._log.warn("out of sequence expected {0} found {1}".format(
+                self._expected_sequence, meta_dict["sequence"]))
+            clear_l1_cache()
+        self._expected_sequence = meta_dict["sequence"] + 1
+
+        try:
+            event_data = parse_cache_update_data(data)
+        except Exception:
+            self._log.exception("unable to parse data '{0}'".format(data))
+            clear_l1_cache()
+            return
+
+        stale_lookups = compute_stale_lookups(event_data)
+        if stale_lookups is None:
+            self._log.info("no row data for {0}, clearing".format(
+                event_data["table_name"]))
+            clear_l1_cache(event_data["table_name"])
+            return
+
+        for table_name, lookup_field_name, lookup_field_value in stale_lookups:
+            invalidate_l1_cache(table_name,
+                                lookup_field_name,
+                                lookup_field_value)
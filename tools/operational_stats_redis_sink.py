@@ -2,22 +2,59 @@
 """
 operational_stats_redis_sink.py
 
-A Greenlet that acts as a sink: 
+A Greenlet that acts as a sink:
 reading status entries a queue and passing them to redis
 
 See Ticket #64 Implement Operational Stats Accumulation
+
+Every user request puts several entries on the queue, so rather than one
+hincrby (and one redis round trip) per entry, we sum the entries in memory
+by (partial key, minute, collection_id) and send the sums every flush
+interval, as one MULTI/EXEC batch, so redis applies all of it or none of
+it.
 """
 from collections import namedtuple
+import os
+import time
+
+import gevent.queue
+from redis import RedisError, ResponseError
 
 from tools.redis_sink import RedisSink
+from tools.redis_connection import create_redis_connection
 from tools.operational_stats_redis_key import compute_key
 
+_flush_interval = float(os.environ.get(
+    "NIMBUSIO_OPERATIONAL_STATS_FLUSH_INTERVAL", "0.5"))
+_max_queue_size = int(os.environ.get(
+    "NIMBUSIO_OPERATIONAL_STATS_MAX_QUEUE_SIZE", "100000"))
+_max_pending_entries = int(os.environ.get(
+    "NIMBUSIO_OPERATIONAL_STATS_MAX_PENDING_ENTRIES", "100000"))
+_reporting_interval = 60.0
+
 redis_queue_entry_tuple = namedtuple("RedisQueueEntry", ["timestamp",
                                                          "collection_id",
                                                          "value"])
+
+class OperationalStatsQueue(gevent.queue.Queue):
+    """
+    a bounded queue for OperationalStatsRedisSink. put() never blocks the
+    request that is reporting stats: if the queue is full, the entry is
+    dropped and counted.
+    """
+    def __init__(self, maxsize=_max_queue_size):
+        gevent.queue.Queue.__init__(self, maxsize)
+        self.drop_count = 0
+
+    def put(self, item, block=True, timeout=None):
+        try:
+            gevent.queue.Queue.put(self, item, block=False)
+        except gevent.queue.Full:
+            self.drop_count += 1
+
 class OperationalStatsRedisSink(RedisSink):
     """
-    A Greenlet that acts as a sink: 
+    A Greenlet that acts as a sink:
     reading status entries a queue and passing them to redis
 
     See Ticket #64 Implement Operational Stats Accumulation
@@ -25,14 +62,95 @@ class OperationalStatsRedisSink(RedisSink):
     def __init__(self, halt_event, redis_queue, node_name):
         RedisSink.__init__(self, halt_event, redis_queue)
         self._node_name = node_name
+        # (partial_key, minute, collection_id) -> sum of values
+        self._pending = dict()
+        self.drop_count = 0
+        self.flush_failure_count = 0
+        self.dropped_batch_count = 0
 
     def store(self, partial_key, entry):
         """
-        store one entry from the queue in redis
+        add one entry from the queue to the sums we will send to redis
+        """
+        minute = entry.timestamp.replace(second=0, microsecond=0)
+        pending_key = (partial_key, minute, entry.collection_id, )
+        if pending_key in self._pending:
+            self._pending[pending_key] += entry.value
+        elif len(self._pending) < _max_pending_entries:
+            self._pending[pending_key] = entry.value
+        else:
+            self.drop_count += 1
+
+    def flush(self):
+        """
+        send the sums to redis, in one MULTI/EXEC batch of hincrby.
+        If we cannot reach redis, we keep the sums, and try again next time.
+        If redis ran the batch but a command failed, the other commands
+        have been applied, so we drop the batch rather than count them twice
         """
-        key = compute_key(self._node_name, entry.timestamp, partial_key)
-        self._log.debug("hincrby({0}, {1}, {2})".format(key, 
-                                                        entry.collection_id, 
-                                                        entry.value))
-        self._redis_connection.hincrby(key, entry.collection_id, entry.value)
+        if len(self._pending) == 0:
+            return
+
+        pipeline = self._redis_connection.pipeline(transaction=True)
+        for (partial_key, minute, collection_id, ), value in \
+        self._pending.items():
+            key = compute_key(self._node_name, minute, partial_key)
+            pipeline.hincrby(key, collection_id, value)
+
+        try:
+            pipeline.execute()
+        except ResponseError as instance:
+            self.dropped_batch_count += 1
+            self._log.error("flush of {0} entries dropped: {1}".format(
+                len(self._pending), instance))
+            self._pending = dict()
+            return
+        except RedisError as instance:
+            self.flush_failure_count += 1
+            self._log.error("flush of {0} entries failed: {1}".format(
+                len(self._pending), instance))
+            return
+
+        self._log.debug("flushed {0} entries".format(len(self._pending)))
+        self._pending = dict()
+
+    def _report(self):
+        queue_drop_count = getattr(self._redis_queue, "drop_count", 0)
+        if self.drop_count == 0 and queue_drop_count == 0 \
+        and self.flush_failure_count == 0 and self.dropped_batch_count == 0:
+            return
+        self._log.warn("dropped {0} queue entries, {1} pending entries, "
+                       "{2} batches; {3} flush failures".format(
+                           queue_drop_count,
+                           self.drop_count,
+                           self.dropped_batch_count,
+                           self.flush_failure_count))
+
+    def _run(self):
+        self._redis_connection = create_redis_connection()
+
+        next_flush_time = time.time() + _flush_interval
+        next_report_time = time.time() + _reporting_interval
+
+        self._log.debug("start halt_event loop")
+        try:
+            while not self._halt_event.is_set():
+                timeout = max(next_flush_time - time.time(), 0.0)
+                try:
+                    partial_key, entry = \
+                        self._redis_queue.get(block=True, timeout=timeout)
+                except gevent.queue.Empty:
+                    pass
+                else:
+                    self.store(partial_key, entry)
 
+                current_time = time.time()
+                if current_time >= next_flush_time:
+                    self.flush()
+                    next_flush_time = current_time + _flush_interval
+                if current_time >= next_report_time:
+                    self._report()
+                    next_report_time = current_time + _reporting_interval
+        finally:
+            self._log.debug("end halt_event loop")
+            self.flush()
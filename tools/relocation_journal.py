@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+relocation_journal.py
+
+Collect segment_sequence relocations in memory and apply them with a
+single set based update, instead of one update per sequence.
+
+Used by the defragger and gc_rewrite_value_files, which move sequences
+from old value files to new ones.
+"""
+import io
+import logging
+
+_create_temp_table = """
+drop table if exists nimbusio_relocation_journal;
+create temp table nimbusio_relocation_journal (
+    collection_id int4 not null,
+    segment_id int8 not null,
+    sequence_num int4 not null,
+    value_file_id int4 not null,
+    value_file_offset int8 not null
+);
+"""
+
+_apply_relocations = """
+update nimbusio_node.segment_sequence as seq
+set value_file_id = journal.value_file_id,
+    value_file_offset = journal.value_file_offset
+from nimbusio_relocation_journal as journal
+where seq.collection_id = journal.collection_id
+and seq.segment_id = journal.segment_id
+and seq.sequence_num = journal.sequence_num
+"""
+
+_drop_temp_table = "drop table nimbusio_relocation_journal"
+
+class RelocationJournal(object):
+    """
+    Collect segment_sequence relocations in memory and apply them with a
+    single set based update.
+    """
+    def __init__(self):
+        self._log = logging.getLogger("RelocationJournal")
+        # the rows are kept as COPY text, ready to load
+        self._buffer = io.StringIO()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self,
+            collection_id,
+            segment_id,
+            sequence_num,
+            value_file_id,
+            value_file_offset):
+        """
+        record that a sequence has moved to value_file_offset in
+        value_file_id
+        """
+        self._buffer.write("{0}\t{1}\t{2}\t{3}\t{4}\n".format(
+            collection_id,
+            segment_id,
+            sequence_num,
+            value_file_id,
+            value_file_offset))
+        self._count += 1
+
+    def apply(self, connection):
+        """
+        update the segment_sequence rows for all the recorded relocations,
+        then empty the journal. This should be called inside the caller's
+        transaction, along with the rest of the caller's database changes.
+
+        return the number of segment_sequence rows updated
+        """
+        if self._count == 0:
+            return 0
+
+        connection.execute(_create_temp_table, [])
+
+        self._buffer.seek(0)
+        cursor = connection._connection.cursor()
+        cursor.copy_from(self._buffer, "nimbusio_relocation_journal")
+        cursor.close()
+
+        # give the planner row counts for the temp table
+        connection.execute("analyze nimbusio_relocation_journal", [])
+
+        rowcount = connection.execute(_apply_relocations, [])
+        connection.execute(_drop_temp_table, [])
+
+        if rowcount != self._count:
+            self._log.warn("{0:,} relocations updated {1:,} rows".format(
+                self._count, rowcount))
+
+        self._buffer = io.StringIO()
+        self._count = 0
+
+        return rowcount
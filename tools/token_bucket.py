@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+token_bucket.py
+
+A thread safe token bucket, to hold background I/O to a steady rate.
+"""
+from threading import Lock
+import time
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket.
+
+    rate
+        tokens (usually bytes) added per second. None or 0 means no limit
+    burst
+        the most tokens that can accumulate while we are idle, defaults
+        to one second's worth
+    """
+    def __init__(self, rate, burst=None):
+        self._rate = rate
+        self._burst = (rate if burst is None else burst)
+        self._tokens = self._burst
+        self._last_time = time.time()
+        self._lock = Lock()
+
+    def consume(self, count):
+        """
+        take count tokens from the bucket, sleeping until they are
+        available. A count larger than the burst size is allowed; it puts
+        the bucket into debt, which the caller (and other callers) wait
+        off.
+
+        return the number of seconds we slept
+        """
+        if not self._rate:
+            return 0.0
+
+        with self._lock:
+            current_time = time.time()
+            self._tokens = min(
+                self._burst,
+                self._tokens + ((current_time - self._last_time) * self._rate)
+            )
+            self._last_time = current_time
+            self._tokens -= count
+            wait_time = (0.0 if self._tokens >= 0 \
+                         else -self._tokens / self._rate)
+
+        if wait_time > 0.0:
+            time.sleep(wait_time)
+
+        return wait_time
@@ -4,12 +4,23 @@ zfec_segmenter.py
 
 Encodes/decodes segments using zfec.
 """
+import zfec
 from zfec.easyfec import Encoder, Decoder
 
+from tools.data_definitions import block_size
+
+def _div_ceil(numerator, denominator):
+    return (numerator + denominator - 1) // denominator
+
 class ZfecSegmenter(object):
     def __init__(self, min_segments, num_segments):
         self.min_segments = min_segments
         self.num_segments = num_segments
+        self._share_size = block_size // min_segments
+        self._encoder = Encoder(self.min_segments, self.num_segments)
+        self._decoder = Decoder(self.min_segments, self.num_segments)
+        self._fec_encoder = zfec.Encoder(self.min_segments, self.num_segments)
+        self._fec_decoder = zfec.Decoder(self.min_segments, self.num_segments)
 
     def padding_size(self, data):
         modulus = len(data) % self.min_segments
@@ -24,7 +35,7 @@ class ZfecSegmenter(object):
             a list size=num_segments of lists of encoded blocks (zfec shares)
         """
         return_list = [list() for _ in range(self.num_segments)]
-        encoder = Encoder(self.min_segments, self.num_segments)
+        encoder = self._encoder
         for data_block in data_blocks:
             for segment_list, zfec_share in  zip(return_list, 
                                                  encoder.encode(data_block)):
@@ -32,6 +43,62 @@ class ZfecSegmenter(object):
                 
         return return_list
 
+    def _slice_layout(self, data_size):
+        """
+        return (full_block_count, last_share_size) for a slice of data.
+        The last block may be short, its shares are padded with zeros.
+        """
+        full_block_count = data_size // block_size
+        last_block_size = data_size - (full_block_count * block_size)
+        last_share_size = _div_ceil(last_block_size, self.min_segments)
+        return full_block_count, last_share_size
+
+    def encode_slice(self, data):
+        """
+        data
+            a slice of data (up to incoming_slice_size) to be encoded
+
+        return
+            a list size=num_segments of contiguous encoded segments.
+            Each segment holds the same bytes as joining the corresponding
+            list returned by encode(block_generator(data))
+
+        zfec operates on each byte position independently, so we can lay
+        out the primary shares of every block contiguously, one buffer per
+        segment, and compute all the secondary shares with a single call
+        """
+        data_view = memoryview(data)
+        full_block_count, last_share_size = self._slice_layout(len(data))
+        full_size = full_block_count * self._share_size
+        segment_size = full_size + last_share_size
+
+        primary_segments = [bytearray(segment_size)
+                            for _ in range(self.min_segments)]
+
+        for segment_index, segment in enumerate(primary_segments):
+            data_offset = segment_index * self._share_size
+            for segment_offset in range(0, full_size, self._share_size):
+                segment[segment_offset:segment_offset+self._share_size] = \
+                    data_view[data_offset:data_offset+self._share_size]
+                data_offset += block_size
+
+            # the last block is short, the trailing bytes of its shares
+            # stay zero (padding)
+            if last_share_size > 0:
+                data_offset = (full_block_count * block_size) + \
+                              (segment_index * last_share_size)
+                data_end = min(data_offset + last_share_size, len(data))
+                if data_end > data_offset:
+                    segment[full_size:full_size+data_end-data_offset] = \
+                        data_view[data_offset:data_end]
+
+        secondary_segments = self._fec_encoder.encode(
+            primary_segments,
+            list(range(self.min_segments, self.num_segments))
+        )
+
+        return primary_segments + list(secondary_segments)
+
     def decode(self, segments, segment_numbers, padding_size):
         """
         segments
@@ -45,16 +112,16 @@ class ZfecSegmenter(object):
             a list of data blocks
         """
         data_list = list()
-        decoder = Decoder(self.min_segments, self.num_segments)
+        decoder = self._decoder
         zfec_segment_numbers = [n-1 for n in segment_numbers]
 
         # accumulate all but the last slice with padding set to 0
         for i in range(len(segments[0])-1):
             encoded_blocks = [segment[i] for segment in segments]
             data_list.append(
-                decoder.decode(encoded_blocks, zfec_segment_numbers, 0)
+                self._decoder.decode(encoded_blocks, zfec_segment_numbers, 0)
             )
-        
+
         # accumulate the last slice using the padding size
         encoded_blocks = [segment[-1] for segment in segments]
         data_list.append(
@@ -63,3 +130,49 @@ class ZfecSegmenter(object):
 
         return data_list
 
+    def decode_slice(self, segments, segment_numbers, padding_size):
+        """
+        segments
+            a list size=min_segments of contiguous encoded segments
+            (as returned by encode_slice)
+        segment_numbers
+            a list of ints giving the segment numbers of the segments (1..n)
+        padding_size
+            the zfec padding size of the last block (earlier blocks are 0)
+
+        return
+            a bytearray of the decoded data
+        """
+        segment_size = len(segments[0])
+        full_block_count = segment_size // self._share_size
+        last_share_size = segment_size - (full_block_count * self._share_size)
+        full_size = full_block_count * self._share_size
+
+        # zfec moves the primary segments into position in the list
+        # it is given, so we pass it a copy
+        primary_segments = self._fec_decoder.decode(
+            list(segments), [n-1 for n in segment_numbers]
+        )
+        primary_views = [memoryview(segment) for segment in primary_segments]
+
+        data_size = (full_block_count * block_size) + \
+                    (last_share_size * self.min_segments)
+        data = bytearray(data_size)
+
+        data_offset = 0
+        for segment_offset in range(0, full_size, self._share_size):
+            for primary_view in primary_views:
+                data[data_offset:data_offset+self._share_size] = \
+                    primary_view[segment_offset:segment_offset+self._share_size]
+                data_offset += self._share_size
+
+        if last_share_size > 0:
+            for primary_view in primary_views:
+                data[data_offset:data_offset+last_share_size] = \
+                    primary_view[full_size:full_size+last_share_size]
+                data_offset += last_share_size
+
+        if padding_size > 0:
+            del data[-padding_size:]
+
+        return data
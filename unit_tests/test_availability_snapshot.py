@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+test_availability_snapshot.py
+
+test the web director's AvailabilitySnapshot against a fake redis
+"""
+import json
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import gevent
+
+from web_director import availability_snapshot
+from web_director.availability_snapshot import AvailabilitySnapshot
+
+_hash_name = "test-availability"
+
+class _FakeRedis(object):
+    def __init__(self, hash_values):
+        self.hash_values = hash_values
+
+    def hgetall(self, hash_name):
+        assert hash_name == _hash_name
+        return self.hash_values
+
+class TestAvailabilitySnapshot(unittest.TestCase):
+    """
+    test AvailabilitySnapshot
+    """
+    def test_bad_entries(self):
+        """
+        entries that are not a dict with a reachable field are skipped,
+        the rest of the snapshot is kept
+        """
+        redis = _FakeRedis({
+            "good-up"       : json.dumps({"reachable" : True}),
+            "good-down"     : json.dumps({"reachable" : False}),
+            "not-json"      : "{",
+            "no-reachable"  : json.dumps({"timestamp" : 1}),
+            "not-dict"      : json.dumps([1, 2, 3]),
+        })
+        snapshot = AvailabilitySnapshot(redis, _hash_name)
+        self.assertTrue(snapshot.refresh())
+        self.assertEqual(snapshot.get(), {"good-up"   : True,
+                                          "good-down" : False})
+
+    def test_refresh_exception(self):
+        """
+        an unexpected exception in a refresh is counted, and the greenlet
+        keeps refreshing
+        """
+        redis = _FakeRedis(None)
+        snapshot = AvailabilitySnapshot(redis, _hash_name)
+        saved_refresh_interval = availability_snapshot.REFRESH_INTERVAL
+        availability_snapshot.REFRESH_INTERVAL = 0.01
+        try:
+            snapshot.start()
+            gevent.sleep(0.05)
+            self.assertFalse(snapshot.ready())
+            self.assertGreater(snapshot.refresh_failure_count, 0)
+
+            redis.hash_values = {"up" : json.dumps({"reachable" : True})}
+            gevent.sleep(0.05)
+            self.assertEqual(snapshot.get(), {"up" : True})
+        finally:
+            snapshot.kill()
+            availability_snapshot.REFRESH_INTERVAL = saved_refresh_interval
+
+if __name__ == "__main__":
+    unittest.main()
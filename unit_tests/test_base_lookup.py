@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+test_base_lookup.py
+
+test the in memory cache in front of memcached
+"""
+import unittest
+
+from tools import base_lookup
+from tools.base_lookup import BaseLookup, \
+        enable_l1_cache, \
+        disable_l1_cache, \
+        invalidate_l1_cache
+from tools.central_cache_event import compute_stale_lookups
+
+class _MockMemcachedClient(object):
+    def __init__(self):
+        self.data = dict()
+        self.get_count = 0
+
+    def get(self, key):
+        self.get_count += 1
+        return self.data.get(key)
+
+    def set(self, key, value, time=None):
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        return 1
+
+class TestBaseLookup(unittest.TestCase):
+    """test the in memory cache in front of memcached"""
+
+    def setUp(self):
+        self._memcached_client = _MockMemcachedClient()
+        self._database = {"aaa" : {"id" : 1, "name" : "aaa"}, }
+        self._lookup = BaseLookup(self._memcached_client,
+                                  "collection",
+                                  "name",
+                                  self._database.get)
+        enable_l1_cache()
+
+    def tearDown(self):
+        disable_l1_cache()
+
+    def _update_aaa(self):
+        """
+        change the database row for aaa, and invalidate it,
+        leaving the old row in memcached
+        """
+        self._database["aaa"] = {"id" : 1, "name" : "aaa", "versioning" : 1}
+        event_data = {"event"       : "UPDATE",
+                      "table_name"  : "collection",
+                      "old"         : {"id" : 1, "name" : "aaa"}, }
+        for stale_lookup in compute_stale_lookups(event_data):
+            invalidate_l1_cache(*stale_lookup)
+
+    def test_hit(self):
+        """test that a second lookup does not go to memcached"""
+        self.assertEqual(self._lookup.get("aaa")["id"], 1)
+        self.assertEqual(self._lookup.get("aaa")["id"], 1)
+        self.assertEqual(self._memcached_client.get_count, 1)
+
+    def test_miss_not_cached(self):
+        """test that we don't cache a row that does not exist"""
+        self.assertEqual(self._lookup.get("bbb"), None)
+        self._database["bbb"] = {"id" : 2, "name" : "bbb"}
+        self.assertEqual(self._lookup.get("bbb")["id"], 2)
+
+    def test_invalidate(self):
+        """test that a change event drops the row from the cache"""
+        self._lookup.get("aaa")
+        self._memcached_client.data.clear()
+        self._database["aaa"] = {"id" : 1, "name" : "aaa", "versioning" : 1}
+        event_data = {"event"       : "UPDATE",
+                      "table_name"  : "collection",
+                      "old"         : {"id" : 1, "name" : "aaa"}, }
+        for stale_lookup in compute_stale_lookups(event_data):
+            invalidate_l1_cache(*stale_lookup)
+        self.assertEqual(self._lookup.get("aaa")["versioning"], 1)
+
+    def test_invalidate_stale_memcached(self):
+        """
+        test that a change event seen before central_cache_update has
+        deleted the row from memcached does not bring back the stale row
+        """
+        self._lookup.get("aaa")
+        self._update_aaa()
+        self.assertEqual(self._lookup.get("aaa")["versioning"], 1)
+
+    def test_invalidate_stale_refill(self):
+        """
+        test that a stale memcached row, refilled after invalidation by a
+        lookup already in flight, is not cached in memory
+        """
+        stale_dict = self._lookup.get("aaa")
+        stale_memcached_data = dict(self._memcached_client.data)
+        self._update_aaa()
+
+        self._memcached_client.data.update(stale_memcached_data)
+        self.assertEqual(self._lookup.get("aaa"), stale_dict)
+
+        # central_cache_update deletes the row from memcached
+        self._memcached_client.data.clear()
+        self.assertEqual(self._lookup.get("aaa")["versioning"], 1)
+
+        # once the hold off is over, the row is cached in memory again
+        saved_hold_off = base_lookup._l1_invalidate_hold_off
+        base_lookup._l1_invalidate_hold_off = 0.0
+        try:
+            self._update_aaa()
+        finally:
+            base_lookup._l1_invalidate_hold_off = saved_hold_off
+        get_count = self._memcached_client.get_count
+        self._lookup.get("aaa")
+        self._lookup.get("aaa")
+        self.assertEqual(self._memcached_client.get_count, get_count + 1)
+
+    def test_disabled(self):
+        """test that without an invalidator every lookup goes to memcached"""
+        disable_l1_cache()
+        self._lookup.get("aaa")
+        self._lookup.get("aaa")
+        self.assertEqual(self._memcached_client.get_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
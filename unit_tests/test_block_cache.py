@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+test_block_cache.py
+
+test the web internal reader's cache of decoded data blocks
+"""
+import unittest
+
+from web_internal_reader.block_cache import BlockCache
+
+class TestBlockCache(unittest.TestCase):
+    """test the web internal reader block cache"""
+
+    def test_miss(self):
+        """test getting a key that is not cached"""
+        block_cache = BlockCache(1024, 1024)
+        self.assertEqual(block_cache.get((1, 0, 0, None, )), None)
+        self.assertEqual(block_cache.stats["misses"], 1)
+
+    def test_hit(self):
+        """test getting a cached key"""
+        block_cache = BlockCache(1024, 1024)
+        key = (1, 0, 0, None, )
+        block_cache.put(key, 42, [b"a" * 100, b"b" * 100, ])
+        collection_id, data_blocks = block_cache.get(key)
+        self.assertEqual(collection_id, 42)
+        self.assertEqual(data_blocks, [b"a" * 100, b"b" * 100, ])
+        self.assertEqual(block_cache.stats["hits"], 1)
+        self.assertEqual(block_cache.stats["bytes"], 200)
+
+    def test_entry_too_large(self):
+        """test that an entry larger than max_entry_size is not cached"""
+        block_cache = BlockCache(1024, 100)
+        block_cache.put((1, 0, 0, None, ), 42, [b"a" * 101, ])
+        self.assertEqual(block_cache.stats["entries"], 0)
+        self.assertEqual(block_cache.get((1, 0, 0, None, )), None)
+
+    def test_lru_eviction(self):
+        """test that the least recently used entries are evicted first"""
+        block_cache = BlockCache(300, 300)
+        for unified_id in range(3):
+            block_cache.put((unified_id, 0, 0, None, ), 42, [b"x" * 100, ])
+        # touch the oldest entry so it becomes the most recently used
+        self.assertNotEqual(block_cache.get((0, 0, 0, None, )), None)
+        block_cache.put((3, 0, 0, None, ), 42, [b"x" * 100, ])
+        self.assertEqual(block_cache.stats["evictions"], 1)
+        self.assertEqual(block_cache.stats["bytes"], 300)
+        self.assertEqual(block_cache.get((1, 0, 0, None, )), None)
+        self.assertNotEqual(block_cache.get((0, 0, 0, None, )), None)
+
+if __name__ == "__main__":
+    unittest.main()
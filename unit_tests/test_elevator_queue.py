@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+test_elevator_queue.py
+
+test the retrieve_source io controller's per volume elevator queue
+"""
+import unittest
+
+from retrieve_source.elevator_queue import ElevatorQueue
+
+class TestElevatorQueue(unittest.TestCase):
+    """test the elevator queue"""
+
+    def test_empty(self):
+        """test popping an empty queue"""
+        queue = ElevatorQueue()
+        self.assertEqual(len(queue), 0)
+        self.assertRaises(IndexError, queue.pop)
+
+    def test_disk_order(self):
+        """test that entries come out in disk order"""
+        queue = ElevatorQueue()
+        queue.push(1, 20, 0, "c")
+        queue.push(1, 10, 4096, "b")
+        queue.push(1, 10, 0, "a")
+        queue.push(2, 5, 0, "d")
+        self.assertEqual(len(queue), 4)
+        self.assertEqual([queue.pop() for _ in range(4)], 
+                         ["a", "b", "c", "d", ])
+        self.assertEqual(queue.sequential_count, 1)
+
+    def test_same_offset_fifo(self):
+        """test that entries for the same offset come out in arrival order"""
+        queue = ElevatorQueue()
+        queue.push(1, 10, 0, {"name" : "first"})
+        queue.push(1, 10, 0, {"name" : "second"})
+        self.assertEqual(queue.pop()["name"], "first")
+        self.assertEqual(queue.pop()["name"], "second")
+
+    def test_sweep(self):
+        """
+        test that entries behind the current position wait for the next 
+        sweep
+        """
+        queue = ElevatorQueue()
+        queue.push(1, 10, 8192, "b")
+        self.assertEqual(queue.pop(), "b")
+        queue.push(1, 10, 0, "c")
+        queue.push(1, 10, 16384, "a")
+        self.assertEqual(queue.pop(), "a")
+        self.assertEqual(queue.sweep_count, 0)
+        self.assertEqual(queue.pop(), "c")
+        self.assertEqual(queue.sweep_count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+test_gc_checkpoint.py
+
+test that the incremental garbage collector re-evaluates every key changed
+since its last run, however the data writer's segment ids and transactions
+interleave with the run.
+
+To run this, first create test user and database:
+ sudo -u postgres createuser -P nimbusio_node_user_test
+ sudo -u postgres createdb -O nimbusio_node_user_test nimbusio_node.test
+"""
+import logging
+import os
+import os.path
+import subprocess
+import sys
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tools.process_util import identify_program_dir
+from tools.database_connection import _node_database_name, \
+    _node_database_user, \
+    get_node_connection
+from tools.data_definitions import create_timestamp, \
+    segment_status_active
+
+from data_writer.writer import _allocate_segment_ids, \
+    _insert_new_segment_rows, \
+    _insert_segment_tombstone_row
+
+from garbage_collector.checkpoint import load_checkpoint, \
+    start_run, \
+    finish_run
+from garbage_collector.candidate_partition_generator import \
+    generate_dirty_partitions
+
+_node_name = "test"
+_database_password = "test_password"
+_database_host = os.environ.get("NIMBUSIO_NODE_DATABASE_HOST", "localhost")
+_database_port = int(os.environ.get("NIMBUSIO_NODE_DATABASE_PORT", "5432"))
+
+_test_collection_id = 1
+_source_node_id = 1
+_segment_id_block_size = 64
+
+def _initialize_logging_to_stderr():
+    from tools.standard_logging import _log_format_template
+    log_level = logging.DEBUG
+    handler = logging.StreamHandler(stream=sys.stderr)
+    formatter = logging.Formatter(_log_format_template)
+    handler.setFormatter(formatter)
+    logging.root.addHandler(handler)
+    logging.root.setLevel(log_level)
+
+def _install_schema():
+    log = logging.getLogger("_install_schema")
+    database_name = _node_database_name(_node_name)
+    user_name = _node_database_user(_node_name)
+
+    sql_path = identify_program_dir("sql")
+    schema_path = os.path.join(sql_path, "nimbusio_node.sql")
+
+    env = {"PGPASSWORD" : _database_password};
+    args = ["/usr/bin/psql",
+            "-h", _database_host,
+            "-p", str(_database_port),
+            "-d", database_name,
+            "-U", user_name,
+            "-q",
+            "-f", schema_path]
+    log.debug(args)
+
+    process = subprocess.Popen(args, env=env)
+    process.wait()
+    assert process.returncode == 0, process.returncode
+
+def _segment_row(segment_id, key, unified_id):
+    return {"id"                    : segment_id,
+            "collection_id"         : _test_collection_id,
+            "key"                   : key,
+            "status"                : segment_status_active,
+            "unified_id"            : unified_id,
+            "timestamp"             : create_timestamp(),
+            "conjoined_part"        : 0,
+            "segment_num"           : 1,
+            "source_node_id"        : _source_node_id,
+            "handoff_node_id"       : None, }
+
+def _insert_tombstone(connection, key, unified_id):
+    connection.begin_transaction()
+    _insert_segment_tombstone_row(connection,
+                                  _test_collection_id,
+                                  key,
+                                  unified_id,
+                                  create_timestamp(),
+                                  1,
+                                  None,
+                                  _source_node_id,
+                                  None)
+    connection.commit()
+
+class TestGCCheckpoint(unittest.TestCase):
+    """
+    test the incremental garbage collector's choice of dirty keys
+    """
+    def setUp(self):
+        _install_schema()
+        self._writer_connection = get_node_connection(_node_name,
+                                                      _database_password,
+                                                      _database_host,
+                                                      _database_port)
+        self._gc_connection = get_node_connection(_node_name,
+                                                  _database_password,
+                                                  _database_host,
+                                                  _database_port)
+
+    def tearDown(self):
+        if hasattr(self, "_writer_connection"):
+            self._writer_connection.close()
+            delattr(self, "_writer_connection")
+        if hasattr(self, "_gc_connection"):
+            self._gc_connection.close()
+            delattr(self, "_gc_connection")
+
+    def _gc_run(self):
+        """
+        run the incremental garbage collector's key selection,
+        return the set of keys it evaluates
+        """
+        checkpoint = load_checkpoint(self._gc_connection)
+        self.assertFalse(checkpoint.run_in_progress)
+        checkpoint = start_run(self._gc_connection, checkpoint)
+        keys = set()
+        for partition in generate_dirty_partitions(
+            self._gc_connection,
+            checkpoint.last_collection_id,
+            checkpoint.last_key
+        ):
+            keys.add(partition[0].key)
+        self._gc_connection.begin_transaction()
+        finish_run(self._gc_connection)
+        self._gc_connection.commit()
+        return keys
+
+    def test_reserved_block_flushed_after_run(self):
+        """
+        the data writer reserves a block of segment ids, a tombstone takes
+        a later id and commits, a garbage collection run finishes, and only
+        then does the writer flush rows with its reserved ids.
+        The next run must evaluate the flushed key.
+        """
+        segment_ids = _allocate_segment_ids(self._writer_connection,
+                                            _segment_id_block_size)
+
+        _insert_tombstone(self._gc_connection, "tombstoned-key", 1001)
+        _insert_tombstone(self._gc_connection, "tombstoned-key", 1002)
+
+        self.assertEqual(self._gc_run(), set(["tombstoned-key"]))
+
+        self._writer_connection.begin_transaction()
+        _insert_new_segment_rows(self._writer_connection,
+                                 [_segment_row(segment_ids[0], "new-key", 1),
+                                  _segment_row(segment_ids[1], "new-key", 2)])
+        self._writer_connection.commit()
+
+        self.assertEqual(self._gc_run(), set(["new-key"]))
+        self.assertEqual(self._gc_run(), set())
+
+    def test_flush_in_progress_during_run(self):
+        """
+        the data writer's flush is still uncommitted while a garbage
+        collection run claims its keys. The next run must evaluate it.
+        """
+        segment_ids = _allocate_segment_ids(self._writer_connection,
+                                            _segment_id_block_size)
+
+        self._writer_connection.begin_transaction()
+        _insert_new_segment_rows(self._writer_connection,
+                                 [_segment_row(segment_ids[0], "new-key", 1),
+                                  _segment_row(segment_ids[1], "new-key", 2)])
+
+        _insert_tombstone(self._gc_connection, "tombstoned-key", 1001)
+        _insert_tombstone(self._gc_connection, "tombstoned-key", 1002)
+
+        self.assertEqual(self._gc_run(), set(["tombstoned-key"]))
+
+        self._writer_connection.commit()
+
+        self.assertEqual(self._gc_run(), set(["new-key"]))
+
+if __name__ == "__main__":
+    _initialize_logging_to_stderr()
+    unittest.main()
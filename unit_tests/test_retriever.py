@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+test_retriever.py
+
+test the web internal reader Retriever's hedged reads, with fake data
+readers
+"""
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import gevent
+
+from web_internal_reader import retriever
+from web_internal_reader.retriever import Retriever
+
+_timeout = 5.0
+
+class _FakeDataReader(object):
+    """
+    a data reader that returns one block for each sequence, and fails
+    retrieve_key_next for a retrieve it was never started on.
+    reply_delay blocks the whole process (not just this greenlet), so
+    several replies can be ready by the time the Retriever runs again.
+    """
+    def __init__(self, node_name, reply_delay, sequence_count):
+        self.node_name = node_name
+        self.connected = True
+        self._reply_delay = reply_delay
+        self._sequence_count = sequence_count
+        self.started_retrieve_ids = set()
+        self.failed_next_count = 0
+
+    def _reply(self, sequence):
+        gevent.sleep(0)
+        time.sleep(self._reply_delay)
+        return ["x", ], 0, sequence >= self._sequence_count
+
+    def retrieve_key_start(self, retrieve_id, sequence, *args):
+        self.started_retrieve_ids.add(retrieve_id)
+        return self._reply(sequence)
+
+    def retrieve_key_next(self, retrieve_id, sequence, *args):
+        if retrieve_id not in self.started_retrieve_ids:
+            self.failed_next_count += 1
+            return None
+        return self._reply(sequence)
+
+class TestRetriever(unittest.TestCase):
+    """
+    test Retriever
+    """
+    def setUp(self):
+        retriever._node_latency.clear()
+
+    def _retriever(self, data_readers, segments_needed):
+        return Retriever(None,
+                         data_readers,
+                         1,
+                         "test-key",
+                         1,
+                         0,
+                         0,
+                         None,
+                         segments_needed,
+                         "test-request")
+
+    def test_hedge_killed_before_start(self):
+        """
+        a hedge spawned in the same loop as the last reply we need is killed
+        before it sends retrieve-key-start. We must not send its node
+        retrieve-key-next, or charge it a failure.
+        """
+        # both replies arrive after the hedge delay, in the same loop
+        data_readers = [
+            _FakeDataReader("node-01", 0.1, 2),
+            _FakeDataReader("node-02", 0.1, 2),
+            _FakeDataReader("node-03", 0.0, 2),
+        ]
+        result_count = 0
+        test_retriever = self._retriever(data_readers, 2)
+        for result_dict in test_retriever.retrieve(_timeout):
+            self.assertEqual(len(result_dict), 2)
+            result_count += 1
+
+        self.assertEqual(result_count, 2)
+        self.assertEqual(test_retriever.hedge_count, 1)
+        for data_reader in data_readers:
+            self.assertEqual(data_reader.failed_next_count, 0,
+                             data_reader.node_name)
+        self.assertNotEqual(retriever._node_latency.get("node-03"),
+                            retriever._failure_latency)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+test_segment_spill.py
+
+test the spill format cluster_inspector uses for pulled segment rows
+"""
+from datetime import datetime
+import shutil
+import tempfile
+import unittest
+
+from tools.data_definitions import segment_row_template
+
+from anti_entropy.cluster_inspector.segment_spill import SegmentSpillWriter, \
+        generate_spilled_segment_rows
+
+_node_name = "node01"
+
+def _segment_row(unified_id, handoff_node_id=None):
+    return segment_row_template(id=unified_id,
+                                collection_id=1,
+                                key="key-{0}".format(unified_id),
+                                status="F",
+                                unified_id=unified_id,
+                                timestamp=datetime(2012, 9, 1, 12, 0, 0, 123),
+                                segment_num=3,
+                                conjoined_part=0,
+                                file_size=1024,
+                                file_adler32=42,
+                                file_hash=b"\x00\x01\x02",
+                                file_tombstone_unified_id=None,
+                                source_node_id=1,
+                                handoff_node_id=handoff_node_id)
+
+class TestSegmentSpill(unittest.TestCase):
+    """test the segment spill format"""
+
+    def setUp(self):
+        self._work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._work_dir)
+
+    def _spill(self, segment_rows):
+        spill_writer = SegmentSpillWriter(self._work_dir, _node_name)
+        for segment_row in segment_rows:
+            spill_writer.add(segment_row)
+        spill_writer.close()
+
+    def test_empty(self):
+        """test reading back no rows"""
+        self._spill([])
+        self.assertEqual(
+            list(generate_spilled_segment_rows(self._work_dir, _node_name)),
+            [])
+
+    def test_round_trip(self):
+        """test that rows read back as they were, with their handoffs"""
+        handoff_row = _segment_row(2, handoff_node_id=5)
+        self._spill([_segment_row(1), handoff_row, _segment_row(2), ])
+
+        segment_dicts = \
+            list(generate_spilled_segment_rows(self._work_dir, _node_name))
+        self.assertEqual(len(segment_dicts), 2)
+
+        expected_dict = _segment_row(1)._asdict()
+        expected_dict["handoff_rows"] = list()
+        self.assertEqual(segment_dicts[0], expected_dict)
+        self.assertEqual(segment_dicts[1]["handoff_rows"], 
+                         [handoff_row._asdict()])
+
+    def test_unified_id_range(self):
+        """test reading a unified_id range"""
+        self._spill([_segment_row(unified_id) for unified_id in range(100)])
+
+        segment_dicts = generate_spilled_segment_rows(self._work_dir, 
+                                                      _node_name,
+                                                      low_unified_id=40, 
+                                                      high_unified_id=60)
+        self.assertEqual([d["unified_id"] for d in segment_dicts],
+                         list(range(40, 60)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -43,6 +43,7 @@ from tools.database_connection import _node_database_name, \
 from segment_visibility.sql_factory import collectable_archive, \
     list_versions, \
     list_keys, \
+    list_key_prefixes, \
     version_for_key, \
     mogrify
 
@@ -586,6 +587,75 @@ class TestSegmentVisibility(unittest.TestCase):
                                  list_versions_row)
 
     #@unittest.skip("isolate test")
+    def test_list_key_prefixes(self):
+        """
+        check that the skip scan finds the same prefixes as grouping the full
+        output of list_keys, in order, and that limit and key_marker work
+        """
+        log = logging.getLogger("test_list_key_prefixes")
+
+        for versioned in [True, False]:
+            sql_text = list_keys(_test_collection_id,
+                                 versioned=versioned,
+                                 prefix=_test_prefix)
+
+            args = {"collection_id" : _test_collection_id,
+                    "prefix"        : _test_prefix, }
+
+            cursor = self._connection.cursor()
+            cursor.execute(sql_text, args)
+            list_keys_rows = cursor.fetchall()
+            cursor.close()
+
+            for delimiter in ["0", "1", "-", ]:
+                expected_prefixes = list()
+                for row in list_keys_rows:
+                    delimiter_pos = row["key"].find(delimiter,
+                                                    len(_test_prefix))
+                    if delimiter_pos < 0:
+                        continue
+                    key_prefix = row["key"][:delimiter_pos+len(delimiter)]
+                    if key_prefix not in expected_prefixes:
+                        expected_prefixes.append(key_prefix)
+
+                sql_text = list_key_prefixes(_test_collection_id,
+                                             versioned=versioned,
+                                             prefix=_test_prefix)
+
+                args = {"collection_id" : _test_collection_id,
+                        "prefix"        : _test_prefix,
+                        "key_marker"    : "",
+                        "delimiter"     : delimiter, }
+
+                cursor = self._connection.cursor()
+                cursor.execute(sql_text, args)
+                prefixes = [r["prefix"] for r in cursor.fetchall()]
+                cursor.close()
+
+                self.assertEqual(prefixes, expected_prefixes,
+                                 (delimiter, prefixes, expected_prefixes, ))
+
+                # a marker inside a prefix starts after that prefix
+                key_marker = None
+                for expected_prefix in expected_prefixes:
+                    sql_text = list_key_prefixes(_test_collection_id,
+                                                 versioned=versioned,
+                                                 prefix=_test_prefix,
+                                                 key_marker=key_marker,
+                                                 limit=1)
+
+                    args["key_marker"] = \
+                        (key_marker if key_marker is not None else "")
+
+                    cursor = self._connection.cursor()
+                    cursor.execute(sql_text, args)
+                    test_row = cursor.fetchone()
+                    cursor.close()
+
+                    self.assertEqual(test_row["prefix"], expected_prefix,
+                                     (test_row["prefix"], expected_prefix))
+                    key_marker = test_row["prefix"]
+
     def test_list_keys_vs_list_versions(self):
         """ 
         check that this can ONLY find the same rows list_versions returns 
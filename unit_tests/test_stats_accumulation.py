@@ -160,6 +160,35 @@ class TestStatsAccumulator(unittest.TestCase):
                                                  queue_entry.collection_id)
         self.assertEqual(int(hash_value), expected_value)
 
+    def test_response_error_drops_batch(self):
+        """
+        test that when one command in a batch fails, the rest of the batch
+        is applied once, not again on every later flush
+        """
+        current_time = datetime.utcnow()
+        good_entry = redis_queue_entry_tuple(timestamp=current_time,
+                                             collection_id=42,
+                                             value=12345)
+        bad_entry = redis_queue_entry_tuple(timestamp=current_time,
+                                            collection_id=42,
+                                            value=1)
+
+        # a string value makes hincrby fail with WRONGTYPE
+        bad_key = compute_key(_node_name, current_time, "bad_request")
+        self._redis_connection.set(bad_key, "not a hash")
+
+        self._redis_queue.put(("get_request", good_entry), )
+        self._redis_queue.put(("bad_request", bad_entry), )
+
+        # give the greenlet time for several flushes
+        self._halt_event.wait(2)
+
+        good_key = compute_key(_node_name, current_time, "get_request")
+        hash_value = self._redis_connection.hget(good_key, 
+                                                 good_entry.collection_id)
+        self.assertEqual(int(hash_value), good_entry.value)
+        self.assertEqual(self._redis_sink.dropped_batch_count, 1)
+
 if __name__ == "__main__":
     _initialize_logging_to_stderr()
     unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+test_sync_state.py
+
+test the state shared between the data writer's writer and sync threads
+"""
+import unittest
+
+from data_writer.sync_state import SyncState, compute_distribution
+
+class TestSyncState(unittest.TestCase):
+    """test the data writer sync state"""
+
+    def test_idle(self):
+        """test that there is nothing to sync when nothing is written"""
+        sync_state = SyncState()
+        self.assertEqual(sync_state.time_until_sync(), None)
+
+    def test_completion_latency(self):
+        """test that a completion is synced within the latency target"""
+        sync_state = SyncState()
+        sync_state.add_completion(1024)
+        self.assertTrue(sync_state.wakeup_event.is_set())
+        wait_time = sync_state.time_until_sync()
+        self.assertTrue(wait_time is not None)
+        self.assertTrue(wait_time <= 1.0)
+
+    def test_completion_count(self):
+        """test that many completions are synced immediately"""
+        sync_state = SyncState()
+        for _ in range(1000):
+            sync_state.add_completion(1)
+        self.assertEqual(sync_state.time_until_sync(), 0.0)
+
+    def test_sync_cycle(self):
+        """test a request and completion of a sync"""
+        sync_state = SyncState()
+        sync_state.add_write(1024)
+        sync_state.add_completion(1024)
+        sync_state.sync_requested()
+        self.assertEqual(sync_state.time_until_sync(), None)
+        sync_state.sync_complete(1, 0.5)
+        self.assertEqual(sync_state.time_until_sync(), None)
+        sync_latencies, batch_sizes = sync_state.pop_stats()
+        self.assertEqual(sync_latencies, [0.5, ])
+        self.assertEqual(batch_sizes, [1, ])
+        self.assertEqual(sync_state.pop_stats(), ([], [], ))
+
+    def test_distribution(self):
+        """test computing a distribution"""
+        self.assertEqual(compute_distribution([]), {"count" : 0})
+        distribution = compute_distribution(list(range(101)))
+        self.assertEqual(distribution["count"], 101)
+        self.assertEqual(distribution["min"], 0)
+        self.assertEqual(distribution["max"], 100)
+        self.assertEqual(distribution["p50"], 50)
+        self.assertEqual(distribution["p99"], 99)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+test_token_bucket.py
+
+test the token bucket used to throttle background I/O
+"""
+import unittest
+
+from tools.token_bucket import TokenBucket
+
+class TestTokenBucket(unittest.TestCase):
+    """test the token bucket"""
+
+    def test_unlimited(self):
+        """test that a bucket with no rate never waits"""
+        token_bucket = TokenBucket(None)
+        self.assertEqual(token_bucket.consume(10 * 1024 ** 3), 0.0)
+
+    def test_burst(self):
+        """test that a request within the burst does not wait"""
+        token_bucket = TokenBucket(1000)
+        self.assertEqual(token_bucket.consume(1000), 0.0)
+
+    def test_debt(self):
+        """test that a request beyond the burst waits for the tokens"""
+        token_bucket = TokenBucket(1000, burst=10)
+        wait_time = token_bucket.consume(60)
+        self.assertTrue(0.03 < wait_time <= 0.05, wait_time)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,9 @@ try:
 except ImportError:
     import unittest
 
-from tools.data_definitions import block_generator, incoming_slice_size
+from tools.data_definitions import block_generator, \
+        block_size, \
+        incoming_slice_size
 from tools.zfec_segmenter import ZfecSegmenter
 
 _min_segments = 8
@@ -66,6 +68,49 @@ class TestZfecSegmenter(unittest.TestCase):
         decoded_data = "".join(decoded_segments)
         self.assertTrue(decoded_data == test_data, len(decoded_data))
 
+    def test_encode_slice(self):
+        """test that slice encoding matches block encoding"""
+        segmenter = ZfecSegmenter(_min_segments, _num_segments)
+        for segment_size in [incoming_slice_size, 
+                             incoming_slice_size - 1, 
+                             block_size - 1,
+                             1, ]:
+            test_data = os.urandom(segment_size)
+
+            block_segments = segmenter.encode(block_generator(test_data))
+            slice_segments = segmenter.encode_slice(test_data)
+
+            self.assertEqual(len(slice_segments), _num_segments)
+            for block_segment, slice_segment in zip(block_segments,
+                                                    slice_segments):
+                self.assertEqual(b"".join(block_segment), 
+                                 bytes(slice_segment))
+
+    def test_decode_slice(self):
+        """test decoding contiguous segments"""
+        segmenter = ZfecSegmenter(_min_segments, _num_segments)
+        for segment_size in [incoming_slice_size, 
+                             incoming_slice_size - 1, 
+                             block_size - 1,
+                             1, ]:
+            test_data = os.urandom(segment_size)
+
+            padding_size = segmenter.padding_size(test_data)
+            encoded_segments = segmenter.encode_slice(test_data)
+
+            segment_numbers = range(1, _num_segments+1)
+
+            test_segment_numbers = random.sample(segment_numbers, 
+                                                 _min_segments)
+            test_segments = \
+                [encoded_segments[n-1] for n in test_segment_numbers]
+
+            decoded_data = segmenter.decode_slice(
+                test_segments, test_segment_numbers, padding_size
+            )
+
+            self.assertTrue(decoded_data == test_data, len(decoded_data))
+
 if __name__ == "__main__":
     unittest.main()
 
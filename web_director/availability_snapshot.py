@@ -0,0 +1,116 @@
+"""
+availability_snapshot.py
+
+A Greenlet that keeps an in-process copy of the availability hash
+web_monitor writes to redis, so routing a request needs no network I/O,
+and a redis hiccup does not become a request latency hiccup.
+
+The snapshot is refreshed with a single HGETALL every refresh interval. If
+we can't refresh it, we keep using the last snapshot until it is older than
+the max age; after that the snapshot is stale, and the router falls back to
+considering every host available (the same as when redis fails).
+"""
+import json
+import logging
+import os
+import time
+
+import gevent
+import gevent.greenlet
+from redis import RedisError
+
+REFRESH_INTERVAL = float(os.environ.get(
+    "NIMBUSIO_WEB_DIRECTOR_AVAILABILITY_REFRESH_INTERVAL", "1.0"))
+MAX_SNAPSHOT_AGE = float(os.environ.get(
+    "NIMBUSIO_WEB_DIRECTOR_AVAILABILITY_MAX_AGE", "30.0"))
+REPORTING_INTERVAL = 60.0
+
+class AvailabilitySnapshot(gevent.greenlet.Greenlet):
+    """
+    A Greenlet that keeps an in-process copy of the web_monitor availability
+    hash
+    """
+    def __init__(self, redis, hash_name):
+        gevent.greenlet.Greenlet.__init__(self)
+        self._log = logging.getLogger("AvailabilitySnapshot")
+        self._redis = redis
+        self._hash_name = hash_name
+
+        # hash key -> True if reachable
+        self._snapshot = None
+        self._snapshot_time = None
+
+        self.refresh_count = 0
+        self.refresh_failure_count = 0
+        self.stale_count = 0
+        self._next_report_time = time.time() + REPORTING_INTERVAL
+
+    @property
+    def age(self):
+        """
+        seconds since the last successful refresh, None if we have never had
+        one
+        """
+        if self._snapshot_time is None:
+            return None
+        return time.time() - self._snapshot_time
+
+    def get(self):
+        """
+        return a dict of hash key -> True if reachable.
+        return None if the snapshot is stale, or we have never had one
+        """
+        age = self.age
+        if age is None or age > MAX_SNAPSHOT_AGE:
+            self.stale_count += 1
+            return None
+        return self._snapshot
+
+    def refresh(self):
+        """
+        read the whole availability hash from redis
+        return True if successful
+        """
+        try:
+            redis_values = self._redis.hgetall(self._hash_name)
+        except RedisError as err:
+            self.refresh_failure_count += 1
+            self._log.warn("redis error reading %s: %s" % (
+                self._hash_name, err, ))
+            return False
+
+        snapshot = dict()
+        for key, val in redis_values.items():
+            try:
+                snapshot[key] = bool(json.loads(val)["reachable"])
+            except Exception:
+                self._log.warn("cannot decode %s %s %r" % (
+                    self._hash_name, key, val, ))
+
+        self._snapshot = snapshot
+        self._snapshot_time = time.time()
+        self.refresh_count += 1
+        return True
+
+    def _report(self):
+        age = self.age
+        self._log.info(
+            "snapshot age = %s, refreshes = %d, failures = %d, stale = %d" % (
+                "none" if age is None else "%.1fs" % (age, ),
+                self.refresh_count,
+                self.refresh_failure_count,
+                self.stale_count, ))
+
+    def _run(self):
+        while True:
+            # if this greenlet died, every host would look available once
+            # the snapshot went stale, for the rest of the process's life
+            try:
+                self.refresh()
+            except Exception:
+                self.refresh_failure_count += 1
+                self._log.exception("refreshing %s" % (self._hash_name, ))
+            if time.time() >= self._next_report_time:
+                self._report()
+                self._next_report_time = time.time() + REPORTING_INTERVAL
+            gevent.sleep(REFRESH_INTERVAL)
@@ -7,9 +7,8 @@ import hmac
 import gevent
 from gevent.event import AsyncResult
 import httplib
-from redis import StrictRedis, RedisError
+from redis import StrictRedis
 import socket
-import json
 import memcache
 import random
 
@@ -19,6 +18,8 @@ from tools.LRUCache import LRUCache
 from tools.database_connection import get_central_database_dsn
 from tools.collection_lookup import CollectionLookup
 
+from web_director.availability_snapshot import AvailabilitySnapshot
+
 # LRUCache mapping names to integers is approximately 32m of memory per 100,000
 # entries
 
@@ -68,6 +69,7 @@ class Router(object):
         self.init_complete = AsyncResult()
         self.central_conn_pool = None
         self.redis = None
+        self.availability_snapshot = None
         self.service_domain = NIMBUS_IO_SERVICE_DOMAIN
         self.read_dest_port = NIMBUSIO_WEB_PUBLIC_READER_PORT
         self.write_dest_port = NIMBUSIO_WEB_WRITER_PORT
@@ -100,6 +102,14 @@ class Router(object):
                                  port = REDIS_PORT,
                                  db = REDIS_DB)
 
+        # fill the availability snapshot before we route anything
+        self.availability_snapshot = AvailabilitySnapshot(
+            self.redis, REDIS_WEB_MONITOR_HASH_NAME)
+        self.availability_snapshot.refresh()
+        self.availability_snapshot.link_exception(
+            self._unhandled_greenlet_exception)
+        self.availability_snapshot.start()
+
         self.memcached_client = memcache.Client(MEMCACHED_NODES)
 
         self.collection_lookup = CollectionLookup(self.memcached_client,
@@ -108,6 +118,13 @@ class Router(object):
         log.info("init complete")
         self.init_complete.set(True)
 
+    def _unhandled_greenlet_exception(self, greenlet_object):
+        log = logging.getLogger("Router")
+        try:
+            greenlet_object.get()
+        except Exception:
+            log.exception(str(greenlet_object))
+
     def _parse_collection(self, hostname):
         "return the Nimbus.io collection name from host name"
         offset = -1 * ( len(self.service_domain) + 1 )
@@ -171,33 +188,25 @@ class Router(object):
         redis_keys = [ REDIS_WEB_MONITOR_HASHKEY_FORMAT % (a, dest_port, )
                        for a in addresses ]
 
-        try:
-            redis_values = self.redis.hmget(REDIS_WEB_MONITOR_HASH_NAME,
-                                            redis_keys)
-        except RedisError as err:
-            log.warn("redis error querying availability for %s: %s, %r"
-                % ( REDIS_WEB_MONITOR_HASH_NAME, err, redis_keys, ))
+        snapshot = self.availability_snapshot.get()
+        if snapshot is None:
+            log.warn("availability snapshot is stale (age %s)" % (
+                self.availability_snapshot.age, ))
             # just consider everything available. it's the best we can do.
             available.update(hosts)
             return available
 
         unknown = []
-        for idx, val in enumerate(redis_values):
-            if val is None:
-                unknown.append((hosts[idx], redis_keys[idx], ))
+        for idx, redis_key in enumerate(redis_keys):
+            reachable = snapshot.get(redis_key)
+            if reachable is None:
+                unknown.append((hosts[idx], redis_key, ))
                 continue
-            try:
-                status = json.loads(val)
-            except Exception, err:
-                log.warn("cannot decode %s %s %s %r" % ( 
-                    REDIS_WEB_MONITOR_HASH_NAME, hosts[idx], 
-                    redis_keys[idx], val, ))
-            else:
-                if status["reachable"]:
-                    available.add(hosts[idx])
+            if reachable:
+                available.add(hosts[idx])
             
         if unknown:
-            log.warn("no availability info in redis for hkeys: %s %r" % 
+            log.warn("no availability info in snapshot for hkeys: %s %r" % 
                 ( REDIS_WEB_MONITOR_HASH_NAME, unknown, ))
             # if every host is unknown, just consider them all available
             if len(unknown) == len(hosts):
@@ -343,6 +352,7 @@ class Router(object):
             while True:
                 hosts_idx = self.round_robin_dispatch_counter % len(hosts)
                 target = hosts[hosts_idx]
+                self.round_robin_dispatch_counter += 1
                 if target in availability:
                     break
 
@@ -30,6 +30,7 @@ import socket
 import traceback
 import logging
 import os
+import weakref
 
 #from http_parser.pyparser import HttpParser
 from http_parser.parser import HttpParser
@@ -45,6 +46,34 @@ LOG_PATH = "%s/nimbusio_web_director.log" % (os.environ["NIMBUSIO_LOG_DIR"], )
 
 _ROUTER = None
 _HOST_PORT_REGEXP = re.compile("^(.*):(\d+)$")
+_END_OF_HEADERS = ("\r\n\r\n", "\n\n", )
+
+# tproxy handles each connection in its own greenlet, and passes proxy() the
+# whole buffer received so far, until we tell it where to send the
+# connection. Rather than parse the whole buffer every time, we remember (by
+# greenlet) how much of it we have scanned for the end of the headers, and
+# parse it once, when the headers are complete.
+#
+# We don't feed HttpParser the new bytes as they arrive: it joins a header
+# value split across two calls to execute() with a space.
+_SCANNED_BYTES = weakref.WeakKeyDictionary()
+
+def _headers_complete(data):
+    "return True if data holds the end of the request headers"
+    connection = gevent.getcurrent()
+    scanned_bytes = _SCANNED_BYTES.get(connection, 0)
+    if scanned_bytes > len(data):
+        scanned_bytes = 0
+
+    # back up, in case the end of the headers straddles the last buffer
+    start = max(scanned_bytes - 3, 0)
+    for end_of_headers in _END_OF_HEADERS:
+        if data.find(end_of_headers, start) != -1:
+            _SCANNED_BYTES.pop(connection, None)
+            return True
+
+    _SCANNED_BYTES[connection] = len(data)
+    return False
 
 def proxy(data):
     """
@@ -61,6 +90,16 @@ def proxy(data):
 
     bytes_received = len(data)
 
+    if not _headers_complete(data):
+        if bytes_received > MAX_HEADER_LENGTH:
+            return { 'close': 
+                'HTTP/1.0 400 Bad Request\r\n'
+                '\r\nHeaders are too large' }
+        return None
+
+    # we route once per connection: after we return a remote, tproxy
+    # forwards the rest of the connection (including any keep-alive
+    # requests) without calling us again
     parser =  HttpParser()
     bytes_parsed = parser.execute(data, bytes_received)
 
@@ -99,7 +99,8 @@ class Application(object):
         data_readers,
         accounting_client,
         event_push_client,
-        stats
+        stats,
+        block_cache
     ):
         self._log = logging.getLogger("Application")
         self._memcached_client = memcached_client
@@ -110,7 +111,7 @@ class Application(object):
         self.accounting_client = accounting_client
         self._event_push_client = event_push_client
         self._stats = stats
-
+        self._block_cache = block_cache
 
         self._dispatch_table = {
             action_respond_to_ping      : self._respond_to_ping,
@@ -211,6 +212,35 @@ class Application(object):
             assert slice_size % block_size == 0, slice_size
             block_count = slice_size / block_size
 
+        # hot segments are served from our own cache, without going out
+        # to the data readers at all
+        cache_key = (unified_id, conjoined_part, block_offset, block_count, )
+        cached_entry = self._block_cache.get(cache_key)
+        if cached_entry is not None:
+            collection_id, data_blocks = cached_entry
+            self._log.info("request {0} cache hit unified-id {1} {2}".format(
+                user_request_id, unified_id, conjoined_part))
+
+            def cached_app_iterator(_response):
+                sent = 0
+                for data in data_blocks:
+                    yield data
+                    sent += len(data)
+
+                self.accounting_client.retrieved(
+                    collection_id,
+                    create_timestamp(),
+                    sent
+                )
+
+            return self._make_response(req,
+                                       user_request_id,
+                                       cached_app_iterator,
+                                       lower_bound,
+                                       upper_bound,
+                                       total_file_size,
+                                       slice_size)
+
         connected_data_readers = _connected_clients(self.data_readers)
 
         if len(connected_data_readers) < _min_connected_clients:
@@ -273,6 +303,9 @@ class Application(object):
         def app_iterator(response):
             segmenter = ZfecSegmenter( _min_segments, _max_segments)
             sent = 0
+            # keep the decoded blocks for the cache, unless there are
+            # too many of them
+            cache_blocks = list()
             try:
                 for segments in chain([first_segments], retrieved):
                     segment_numbers = segments.keys()
@@ -294,6 +327,12 @@ class Application(object):
                         yield data
                         sent += len(data)
 
+                    if cache_blocks is not None:
+                        if sent > self._block_cache.max_entry_size:
+                            cache_blocks = None
+                        else:
+                            cache_blocks.extend(data_list)
+
             except RetrieveFailedError, instance:
                 self._log.error('retrieve failed: {0} {1}'.format(
                     description, instance
@@ -305,6 +344,9 @@ class Application(object):
             end_time = time.time()
             self._stats["retrieves"] -= 1
 
+            if cache_blocks is not None:
+                self._block_cache.put(cache_key, collection_id, cache_blocks)
+
             self.accounting_client.retrieved(
                 collection_id,
                 create_timestamp(),
@@ -313,6 +355,22 @@ class Application(object):
 
         self._log.info("request {0} successful retrieve".format(user_request_id))
 
+        return self._make_response(req,
+                                   user_request_id,
+                                   app_iterator,
+                                   lower_bound,
+                                   upper_bound,
+                                   total_file_size,
+                                   slice_size)
+
+    def _make_response(self, 
+                       req, 
+                       user_request_id, 
+                       app_iterator, 
+                       lower_bound,
+                       upper_bound,
+                       total_file_size,
+                       slice_size):
         response_headers = dict()
         if "range" in req.headers:
             status_int = httplib.PARTIAL_CONTENT
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+block_cache.py
+
+A size bounded cache of decoded data blocks for hot segments.
+
+Entries are keyed by (unified_id, conjoined_part, block_offset, block_count).
+The data for a unified_id and conjoined_part never changes once it is
+written, so entries never need to be invalidated, only evicted. We evict
+the least recently used entries when the total size of the cached blocks
+exceeds max_size.
+"""
+from collections import OrderedDict
+
+class BlockCache(object):
+    """
+    A size bounded cache of decoded data blocks for hot segments.
+    """
+    def __init__(self, max_size, max_entry_size):
+        self._max_size = max_size
+        self.max_entry_size = max_entry_size
+        self._entries = OrderedDict()
+        self.stats = {
+            "hits"          : 0,
+            "misses"        : 0,
+            "evictions"     : 0,
+            "entries"       : 0,
+            "bytes"         : 0,
+        }
+
+    def get(self, key):
+        """
+        return (collection_id, data_blocks, ) or None if key is not cached
+        """
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.stats["misses"] += 1
+            return None
+
+        # put it back, at the most recently used end
+        self._entries[key] = entry
+        self.stats["hits"] += 1
+        return entry[:2]
+
+    def put(self, key, collection_id, data_blocks):
+        """
+        cache the data blocks for key, if they fit
+        """
+        entry_size = sum([len(data) for data in data_blocks])
+        if entry_size > self.max_entry_size or entry_size > self._max_size:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        while self.stats["bytes"] + entry_size > self._max_size:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats["evictions"] += 1
+
+        self._entries[key] = (collection_id, data_blocks, entry_size, )
+        self.stats["entries"] += 1
+        self.stats["bytes"] += entry_size
+
+    def _remove(self, key):
+        _, _, entry_size = self._entries.pop(key)
+        self.stats["entries"] -= 1
+        self.stats["bytes"] -= entry_size
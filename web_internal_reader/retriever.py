@@ -5,6 +5,7 @@ retriever.py
 A class that retrieves data from data readers.
 """
 import logging
+import os
 import time
 import uuid
 
@@ -18,6 +19,40 @@ from web_internal_reader.exceptions import RetrieveFailedError
 # because if a node is down, we will block a lot
 _task_timeout = 1.0
 
+# in hedged read mode we only ask the segments_needed nodes with the lowest
+# latency, and only ask a spare node when one of them fails or is late.
+# Otherwise we ask every node, and throw away the slowest replies.
+_hedged_reads = \
+    os.environ.get("NIMBUSIO_WEB_INTERNAL_READER_HEDGED_READS", "1") == "1"
+_latency_ewma_alpha = float(
+    os.environ.get("NIMBUSIO_WEB_INTERNAL_READER_LATENCY_EWMA_ALPHA", "0.2")
+)
+_min_hedge_delay = float(
+    os.environ.get("NIMBUSIO_WEB_INTERNAL_READER_MIN_HEDGE_DELAY", "0.05")
+)
+_hedge_delay_multiplier = 2.0
+_failure_latency = 5.0
+
+# latency EWMA (seconds) by node name, shared by all Retrievers
+_node_latency = dict()
+
+def _record_latency(node_name, elapsed_time):
+    previous_latency = _node_latency.get(node_name)
+    if previous_latency is None:
+        _node_latency[node_name] = elapsed_time
+    else:
+        _node_latency[node_name] = \
+            (_latency_ewma_alpha * elapsed_time) + \
+            ((1.0 - _latency_ewma_alpha) * previous_latency)
+
+def _decay_latency(node_name):
+    """
+    decay the latency of a node we are not asking, so a node that was 
+    slow once gets another chance eventually
+    """
+    if node_name in _node_latency:
+        _node_latency[node_name] *= (1.0 - _latency_ewma_alpha)
+
 class Retriever(object):
     """Retrieves data from data readers."""
     def __init__(
@@ -56,6 +91,11 @@ class Retriever(object):
         self._pending = gevent.pool.Group()
         self._finished_tasks = gevent.queue.Queue()
         self._sequence = 0
+        # the (segment_number, data_reader) pairs we have started a 
+        # retrieve on; these get every retrieve_key_next
+        self._active_readers = list()
+        self._blocks_retrieved = 0
+        self.hedge_count = 0
 
     def _unhandled_greenlet_exception(self, greenlet_object):
         self._log.error("request {0}: " \
@@ -76,8 +116,96 @@ class Retriever(object):
         else:
             self._finished_tasks.put(task, block=True)
 
+    def _spare_readers(self):
+        """
+        return connected (segment_number, data_reader) pairs we have not 
+        started a retrieve on, lowest latency first
+        """
+        active_segment_numbers = set(
+            [segment_number for segment_number, _ in self._active_readers]
+        )
+        spare_readers = list()
+        for i, data_reader in enumerate(self._data_readers):
+            segment_number = i + 1
+            if segment_number in active_segment_numbers:
+                continue
+            if not data_reader.connected:
+                self._log.warn("request {0} ignoring disconnected reader {1}".format(
+                    self._user_request_id, str(data_reader),
+                ))
+                continue
+            spare_readers.append((segment_number, data_reader, ))
+
+        spare_readers.sort(
+            key=lambda entry: _node_latency.get(entry[1].node_name, 0.0)
+        )
+        return spare_readers
+
+    def _spawn_start(self, segment_number, data_reader):
+        """
+        start a retrieve on a node, from the first block we do not 
+        already have
+        """
+        block_offset = self._block_offset + self._blocks_retrieved
+        if self._block_count is None:
+            block_count = None
+        else:
+            block_count = self._block_count - self._blocks_retrieved
+
+        self._active_readers.append((segment_number, data_reader, ))
+        task = self._spawn(
+            segment_number,
+            data_reader,
+            data_reader.retrieve_key_start,
+            block_offset,
+            block_count
+        )
+        task.is_start = True
+        return task
+
+    def _spawn(self, segment_number, data_reader, method, block_offset, 
+               block_count):
+        task = self._pending.spawn(
+            method,
+            self._retrieve_id,
+            self._sequence,
+            self._collection_id,
+            self._key,
+            self._unified_id,
+            self._conjoined_part,
+            segment_number,
+            block_offset,
+            block_count,
+            self._user_request_id,
+        )
+        task.link(self._done_link)
+        task.link_exception(self._unhandled_greenlet_exception)
+        task.segment_number = segment_number
+        task.data_reader = data_reader
+        task.sequence = self._sequence
+        task.start_time = time.time()
+        task.is_start = False
+        return task
+
+    def _hedge(self):
+        """
+        start a retrieve on the fastest spare node
+        return False if there are no spares left
+        """
+        spare_readers = self._spare_readers()
+        if len(spare_readers) == 0:
+            return False
+
+        segment_number, data_reader = spare_readers[0]
+        self._log.info("request {0} hedge sequence {1} to {2}".format(
+            self._user_request_id, self._sequence, data_reader.node_name
+        ))
+        self.hedge_count += 1
+        self._spawn_start(segment_number, data_reader)
+        return True
+
     def retrieve(self, timeout):
-        retrieve_id = uuid.uuid1().hex
+        self._retrieve_id = uuid.uuid1().hex
 
         # spawn retrieve_key start, then spawn retrieve key next
         # until we are done
@@ -89,50 +217,35 @@ class Retriever(object):
                 self._sequence, 
                 self._unified_id, 
                 self._conjoined_part,
-                retrieve_id
+                self._retrieve_id
             ))
-            # send a request to all node
-            for i, data_reader in enumerate(self._data_readers):
-                if not data_reader.connected:
-                    self._log.warn("request {0} ignoring disconnected reader {1}".format(
-                        self._user_request_id, str(data_reader),
-                    ))
-                    continue
-
-                segment_number = i + 1
-                if start:
-                    task = self._pending.spawn(
-                        data_reader.retrieve_key_start,
-                        retrieve_id,
-                        self._sequence,
-                        self._collection_id,
-                        self._key,
-                        self._unified_id,
-                        self._conjoined_part,
+            if start:
+                selected_readers = self._spare_readers()
+                if _hedged_reads:
+                    for _, data_reader in \
+                    selected_readers[self._segments_needed:]:
+                        _decay_latency(data_reader.node_name)
+                    selected_readers = \
+                        selected_readers[:self._segments_needed]
+                for segment_number, data_reader in selected_readers:
+                    self._spawn_start(segment_number, data_reader)
+            else:
+                for segment_number, data_reader in list(self._active_readers):
+                    if not data_reader.connected:
+                        self._log.warn("request {0} ignoring disconnected reader {1}".format(
+                            self._user_request_id, str(data_reader),
+                        ))
+                        self._active_readers.remove(
+                            (segment_number, data_reader, )
+                        )
+                        continue
+                    self._spawn(
                         segment_number,
-                        self._block_offset,
-                        self._block_count,
-                        self._user_request_id,
-                    )
-                else:
-                    task = self._pending.spawn(
+                        data_reader,
                         data_reader.retrieve_key_next,
-                        retrieve_id,
-                        self._sequence,
-                        self._collection_id,
-                        self._key,
-                        self._unified_id,
-                        self._conjoined_part,
-                        segment_number,
                         self._block_offset,
-                        self._block_count,
-                        self._user_request_id
+                        self._block_count
                     )
-                task.link(self._done_link)
-                task.link_exception(self._unhandled_greenlet_exception)
-                task.segment_number = segment_number
-                task.data_reader = data_reader
-                task.sequence = self._sequence
 
             # wait for, and process, replies from the nodes
             result_dict, completed = self._process_node_replies(timeout)
@@ -140,23 +253,54 @@ class Retriever(object):
                 self._user_request_id, self._sequence,
             ))
 
+            data_segment, _ = result_dict.values()[0]
+            self._blocks_retrieved += len(data_segment)
+
             yield result_dict
             if completed:
                 break
 
             start = False
 
+    def _hedge_delay(self):
+        """
+        how long we wait for a reply before asking a spare node
+        """
+        active_latencies = [
+            _node_latency.get(data_reader.node_name, 0.0) \
+            for _, data_reader in self._active_readers
+        ]
+        return max(
+            [_min_hedge_delay, ] + \
+            [_hedge_delay_multiplier * latency for latency in active_latencies]
+        )
+
     def _process_node_replies(self, timeout):
-        finished_task_count = 0
         result_dict = dict()
         completed_list = list()
         start_time = time.time()
+        pending_count = len(self._pending)
+        hedge_delay = self._hedge_delay()
+        hedge_time = start_time + hedge_delay
 
         # block on the finished_tasks queue until done
-        while finished_task_count < len(self._data_readers):
+        while len(result_dict) < self._segments_needed:
+
+            # ask a spare node if too few of the nodes we asked can still
+            # reply, or if a reply is late
+            current_time = time.time()
+            if pending_count < self._segments_needed - len(result_dict) \
+            or current_time >= hedge_time:
+                if self._hedge():
+                    pending_count += 1
+                elif pending_count == 0:
+                    break
+                hedge_time = current_time + hedge_delay
+
+            wait_time = min(_task_timeout, max(0.0, hedge_time - current_time))
             try:
                 task = self._finished_tasks.get(block=True, 
-                                                timeout=_task_timeout)
+                                                timeout=wait_time)
             except gevent.queue.Empty:
                 elapsed_time = time.time() - start_time
                 if elapsed_time > timeout:
@@ -184,30 +328,49 @@ class Retriever(object):
                 )
                 continue
 
-            finished_task_count += 1
+            pending_count -= 1
             result = self._process_finished_task(task)
 
             if result is None:
+                # a node that fails is no use to us for the rest of
+                # this retrieve. A task that was killed says nothing about
+                # the node's latency.
+                if not isinstance(task.value, gevent.GreenletExit):
+                    _record_latency(task.data_reader.node_name, 
+                                    _failure_latency)
+                self._active_readers.remove(
+                    (task.segment_number, task.data_reader, )
+                )
                 continue
 
+            _record_latency(task.data_reader.node_name, 
+                            time.time() - task.start_time)
+
             data_segment, zfec_padding_size, completion_status = result
 
             result_dict[task.segment_number] = \
                     (data_segment, zfec_padding_size, )
             completed_list.append(completion_status)
 
-            if len(result_dict) >= self._segments_needed:
-                self._log.debug(
-                    "request {0} {1} {2} len(result_dict) = {3}: enough".format(
-                    self._user_request_id,
-                    self._collection_id,
-                    self._key,
-                    len(result_dict),
-                ))
-                self._pending.kill()
-                break
+        self._log.debug(
+            "request {0} {1} {2} len(result_dict) = {3}".format(
+            self._user_request_id,
+            self._collection_id,
+            self._key,
+            len(result_dict),
+        ))
 
-        # if anything is still running, get rid of it
+        # if anything is still running, get rid of it.
+        # A start we kill may never have reached its node (a hedge spawned
+        # just before the last reply we needed has not even run yet), so
+        # we must not send that node retrieve_key_next. It goes back among
+        # the spares.
+        for task in list(self._pending):
+            if task.is_start and not task.ready():
+                self._active_readers.remove(
+                    (task.segment_number, task.data_reader, )
+                )
+        self._pending.kill()
         self._pending.join(timeout, raise_error=True)
 
         if len(result_dict) < self._segments_needed:
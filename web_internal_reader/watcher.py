@@ -13,10 +13,11 @@ class Watcher(Greenlet):
     """
     A Greenlet to watch web server internals
     """
-    def __init__(self, stats, reader_clients, event_push_client):
+    def __init__(self, stats, block_cache, reader_clients, event_push_client):
         Greenlet.__init__(self)
         self._log = logging.getLogger(str(self))
         self._stats = stats
+        self._block_cache = block_cache
         self._reader_clients = reader_clients
         self._event_push_client = event_push_client
         self._halt_event = Event()
@@ -30,11 +31,19 @@ class Watcher(Greenlet):
             for client in self._reader_clients:
                 reader_info.append(client.queue_size)
 
+            cache_stats = dict(self._block_cache.stats)
+            for key in ["hits", "misses", "evictions", ]:
+                self._block_cache.stats[key] = 0
+
             self._log.info("retrieves: %(retrieves)s" % self._stats)
+            self._log.info("cache: %(hits)s hits, %(misses)s misses, " 
+                           "%(evictions)s evictions, " 
+                           "%(entries)s entries, %(bytes)s bytes" % cache_stats)
             self._event_push_client.info(
                 "web-server-stats",
                 "web server stats",
                 stats=self._stats,
+                cache=cache_stats,
                 reader=reader_info
             )
             self._halt_event.wait(_interval)
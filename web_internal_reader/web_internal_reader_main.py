@@ -46,6 +46,7 @@ from web_internal_reader.application import Application
 from web_internal_reader.data_reader import DataReader
 from web_public_reader.space_accounting_client import SpaceAccountingClient
 from web_internal_reader.watcher import Watcher
+from web_internal_reader.block_cache import BlockCache
 from web_public_reader.central_database_util import get_cluster_row
 
 _log_path = "%s/nimbusio_web_internal_reader_%s.log" % (
@@ -70,6 +71,10 @@ _wsgi_backlog = int(os.environ.get("NIMBUS_IO_WSGI_BACKLOG", "1024"))
 _stats = {
     "retrieves"   : 0,
 }
+_max_cache_size = int(os.environ.get(
+    "NIMBUSIO_WEB_INTERNAL_READER_MAX_CACHE_SIZE", str(100 * 1024 ** 2)))
+_max_cache_entry_size = int(os.environ.get(
+    "NIMBUSIO_WEB_INTERNAL_READER_MAX_CACHE_ENTRY_SIZE", str(10 * 1024 ** 2)))
 _memcached_host = os.environ.get("NIMBUSIO_MEMCACHED_HOST", "localhost")
 _memcached_port = int(os.environ.get("NIMBUSIO_MEMCACHED_PORT", "11211"))
 _memcached_nodes = ["{0}:{1}".format(_memcached_host, _memcached_port), ]
@@ -153,8 +158,11 @@ class WebInternalReader(object):
                                      timestamp_repr=repr(timestamp),
                                      source_node_name=_local_node_name)
 
+        self._block_cache = BlockCache(_max_cache_size, _max_cache_entry_size)
+
         self._watcher = Watcher(
             _stats, 
+            self._block_cache,
             self._data_reader_clients,
             self._event_push_client
         )
@@ -167,7 +175,8 @@ class WebInternalReader(object):
             self._data_readers,
             self._accounting_client,
             self._event_push_client,
-            _stats
+            _stats,
+            self._block_cache
         )
         self.wsgi_server = WSGIServer(
             (_web_internal_reader_host, _web_internal_reader_port), 
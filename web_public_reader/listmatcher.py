@@ -11,6 +11,42 @@ from segment_visibility import sql_factory
 
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
 
+def _list_key_prefixes(interaction_pool, 
+                       collection_id, 
+                       versioned, 
+                       prefix, 
+                       max_keys, 
+                       delimiter, 
+                       key_marker):
+    """
+    retrieve the distinct prefixes of visible keys, up to the first delimiter
+    after prefix. The grouping is done in the database, which skips past each
+    prefix it finds, rather than reading every key.
+    """
+    # ask for one more than max_keys, so we can tell if we are truncated
+    request_count = max_keys + 1
+
+    sql_text = sql_factory.list_key_prefixes(collection_id,
+                                             versioned=versioned,
+                                             prefix=prefix,
+                                             key_marker=key_marker,
+                                             limit=request_count)
+
+    args = {"collection_id" : collection_id,
+            "prefix"        : (prefix if prefix is not None else ""), 
+            "key_marker"    : (key_marker if key_marker is not None else ""),
+            "delimiter"     : delimiter, }
+
+    async_result = interaction_pool.run(interaction=sql_text.encode("utf-8"),
+                                        interaction_args=args,
+                                        pool=_local_node_name)
+    result = async_result.get()
+
+    truncated = len(result) == request_count
+    prefix_list = [row["prefix"] for row in result[:max_keys]]
+
+    return {"prefixes" : prefix_list, "truncated" : truncated}
+
 def list_keys(interaction_pool, 
               collection_id, 
               versioned,
@@ -24,6 +60,15 @@ def list_keys(interaction_pool,
     # ask for one more than max_keys, so we can tell if we are truncated
     max_keys = int(max_keys)
     request_count = max_keys + 1
+
+    if delimiter != "":
+        return _list_key_prefixes(interaction_pool,
+                                  collection_id,
+                                  versioned,
+                                  prefix,
+                                  max_keys,
+                                  delimiter,
+                                  marker)
     
     sql_text = sql_factory.list_keys(collection_id,
                                      versioned=versioned,
@@ -48,18 +93,7 @@ def list_keys(interaction_pool,
             "version_identifier"  : row["unified_id"], 
             "timestamp"           : http_timestamp_str(row["timestamp"])})
 
-    if delimiter == "":
-        return {"key_data" : key_list, "truncated" : truncated} 
-
-    # XXX: there may be some SQL way to do this efficiently
-    prefix_set = set()
-    offset = (len(prefix) if prefix is not None else 0)
-    for key_entry in key_list:
-        delimiter_pos = key_entry["key"].find(delimiter, offset)
-        if delimiter_pos > 0:
-            prefix_set.add(key_entry["key"][:delimiter_pos+1])
-
-    return {"prefixes" : list(prefix_set), "truncated" : truncated}
+    return {"key_data" : key_list, "truncated" : truncated} 
 
 def list_versions(interaction_pool, 
                   collection_id, 
@@ -76,6 +110,17 @@ def list_versions(interaction_pool,
     max_keys = int(max_keys)
     request_count = max_keys + 1
 
+    # a version_id_marker only orders versions within a key, so it makes no
+    # difference to which prefixes come after key_marker
+    if delimiter != "":
+        return _list_key_prefixes(interaction_pool,
+                                  collection_id,
+                                  versioned,
+                                  prefix,
+                                  max_keys,
+                                  delimiter,
+                                  key_marker)
+
     sql_text = sql_factory.list_versions(collection_id,
                                          versioned=versioned,
                                          prefix=prefix,
@@ -103,16 +148,5 @@ def list_versions(interaction_pool,
             "version_identifier" : row["unified_id"], 
             "timestamp"          : http_timestamp_str(row["timestamp"])})
 
-    if delimiter == "":
-        return {"key_data" : key_list, "truncated" : truncated} 
-
-    # XXX: there may be some SQL way to do this efficiently
-    prefix_set = set()
-    offset = (len(prefix) if prefix is not None else 0)
-    for key_entry in key_list:
-        delimiter_pos = key_entry["key"].find(delimiter, offset)
-        if delimiter_pos > 0:
-            prefix_set.add(key_entry["key"][:delimiter_pos+1])
-
-    return {"prefixes" : list(prefix_set), "truncated" : truncated}
+    return {"key_data" : key_list, "truncated" : truncated} 
 
@@ -26,7 +26,6 @@ import sys
 
 from gevent.pywsgi import WSGIServer
 from gevent.event import Event
-import gevent.queue
 from gevent_zeromq import zmq
 import gevent
 
@@ -39,11 +38,13 @@ from tools.greenlet_push_client import GreenletPUSHClient
 from tools.database_connection import get_central_database_dsn, \
         get_node_local_database_dsn
 from tools.event_push_client import EventPushClient
+from tools.greenlet_cache_invalidator import GreenletCacheInvalidator
 from tools.id_translator import InternalIDTranslator
 from tools.interaction_pool_authenticator import \
     InteractionPoolAuthenticator
 from tools.data_definitions import cluster_row_template
-from tools.operational_stats_redis_sink import OperationalStatsRedisSink
+from tools.operational_stats_redis_sink import OperationalStatsRedisSink, \
+    OperationalStatsQueue
 
 from web_public_reader.memcached_client import create_memcached_client
 from web_public_reader.application import Application
@@ -69,6 +70,7 @@ _repository_path = os.environ["NIMBUSIO_REPOSITORY_PATH"]
 _central_database_pool_size = 3 
 _central_pool_name = "default"
 _local_database_pool_size = 3 
+_central_skeeter_uri = os.environ.get("NIMBUSIO_CENTRAL_SKEETER_URI")
 
 def _signal_handler_closure(halt_event):
     def _signal_handler(*_args):
@@ -130,6 +132,17 @@ class WebPublicReaderServer(object):
 
         self._zeromq_context = zmq.Context()
 
+        # without change events from the central database, lookups are
+        # cached only in memcached
+        self._cache_invalidator = None
+        if _central_skeeter_uri is not None:
+            self._cache_invalidator = GreenletCacheInvalidator(
+                self._zeromq_context, _central_skeeter_uri
+            )
+            self._cache_invalidator.link_exception(
+                self._unhandled_greenlet_exception
+            )
+
         self._space_accounting_dealer_client = GreenletDealerClient(
             self._zeromq_context, 
             _local_node_name, 
@@ -169,7 +182,7 @@ class WebPublicReaderServer(object):
             id_translator_keys["hmac_size"]
         )
 
-        redis_queue = gevent.queue.Queue()
+        redis_queue = OperationalStatsQueue()
 
         self._redis_sink = OperationalStatsRedisSink(halt_event, 
                                                      redis_queue,
@@ -193,6 +206,8 @@ class WebPublicReaderServer(object):
         )
 
     def start(self):
+        if self._cache_invalidator is not None:
+            self._cache_invalidator.start()
         self._space_accounting_dealer_client.start()
         self._redis_sink.start()
         self.wsgi_server.start()
@@ -203,8 +218,12 @@ class WebPublicReaderServer(object):
         self._accounting_client.close()
         self._log.debug("killing greenlets")
         self._space_accounting_dealer_client.kill()
+        if self._cache_invalidator is not None:
+            self._cache_invalidator.kill()
         self._log.debug("joining greenlets")
         self._space_accounting_dealer_client.join()
+        if self._cache_invalidator is not None:
+            self._cache_invalidator.join()
         self._redis_sink.kill()
         self._log.debug("closing zmq")
         self._event_push_client.close()
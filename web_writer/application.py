@@ -36,7 +36,6 @@ from webob import exc
 from webob import Response
 
 from tools.data_definitions import incoming_slice_size, \
-        block_generator, \
         create_priority, \
         create_timestamp, \
         nimbus_meta_prefix, \
@@ -377,7 +376,8 @@ class Application(object):
                 file_adler32 = zlib.adler32(slice_item, file_adler32)
                 file_md5.update(slice_item)
                 file_size += len(slice_item)
-                segments = segmenter.encode(block_generator(slice_item))
+                segments = [[segment, ] 
+                            for segment in segmenter.encode_slice(slice_item)]
                 zfec_padding_size = segmenter.padding_size(slice_item)
                 if actual_content_length == expected_content_length:
                     archiver.archive_final(
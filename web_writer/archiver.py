@@ -17,8 +17,22 @@ from web_writer.exceptions import ArchiveFailedError
 _local_node_name = os.environ["NIMBUSIO_NODE_NAME"]
 _task_timeout = 60.0
 
+# the number of slices we may have in flight to each data writer
+# before we wait for replies. 1 sends a slice and waits for all of its
+# replies before sending the next one
+_archive_window_size = int(os.environ.get(
+    "NIMBUSIO_WEB_WRITER_ARCHIVE_WINDOW_SIZE", "3")
+)
+
 class Archiver(object):
-    """Sends data segments to data writers."""
+    """
+    Sends data segments to data writers.
+
+    Up to _archive_window_size slices may be in flight to each data writer,
+    so encoding the next slice overlaps with sending and storing the
+    previous ones. The messages for each data writer go through its
+    client's send queue, so it sees the sequences in sequence_num order.
+    """
     def __init__(
         self, 
         data_writers, 
@@ -43,6 +57,10 @@ class Archiver(object):
         self._sequence_num = 0
         self._pending = gevent.pool.Group()
         self._finished_tasks = gevent.queue.Queue()
+        self._in_flight_by_node = dict(
+            [(data_writer.node_name, 0, ) for data_writer in data_writers]
+        )
+        self._error_count = 0
 
     def _done_link(self, task):
         self._finished_tasks.put(task, block=True)
@@ -90,12 +108,16 @@ class Archiver(object):
                     self._user_request_id
                 )
             task.node_name = data_writer.node_name
+            task.sequence_num = self._sequence_num
+            self._in_flight_by_node[task.node_name] += 1
             task.link(self._done_link)
             task.link_exception(self._unhandled_greenlet_exception)
 
-        self._process_node_replies(timeout)
         self._sequence_num += 1
 
+        # wait until every data writer has room for another slice
+        self._process_node_replies(timeout, _archive_window_size - 1)
+
     def archive_final(
         self, 
         file_size, 
@@ -146,18 +168,30 @@ class Archiver(object):
                     self._user_request_id
                 )
             task.node_name = data_writer.node_name
+            task.sequence_num = self._sequence_num
+            self._in_flight_by_node[task.node_name] += 1
             task.link(self._done_link)
             task.link_exception(self._unhandled_greenlet_exception)
 
-        self._process_node_replies(timeout)
+        # wait for every slice we have sent
+        self._process_node_replies(timeout, 0)
 
-    def _process_node_replies(self, timeout):
-        finished_count = 0
-        error_count = 0
+    def _process_node_replies(self, timeout, max_in_flight):
+        """
+        process replies until no data writer has more than max_in_flight
+        slices outstanding. If any task has failed, we wait for all
+        outstanding slices before raising ArchiveFailedError, so the
+        caller's cancel reaches data writers that are not still working
+        on this archive.
+        """
         start_time = time.time()
 
         # block on the finished_tasks queue until done
-        while finished_count < len(self._data_writers):
+        while True:
+            if self._error_count > 0:
+                max_in_flight = 0
+            if max(self._in_flight_by_node.values()) <= max_in_flight:
+                break
             try:
                 task = self._finished_tasks.get(block=True, 
                                                 timeout=_task_timeout)
@@ -180,7 +214,7 @@ class Archiver(object):
                                 self._user_request_id))
                 continue
 
-            finished_count += 1
+            self._in_flight_by_node[task.node_name] -= 1
             if isinstance(task.value, gevent.GreenletExit):
                 self._log.debug("request {0}: " \
                                 "({1}) {2} {3} {4} " \
@@ -190,7 +224,7 @@ class Archiver(object):
                                 self._key,
                                 self._unified_id,
                                 task.node_name))
-                error_count += 1
+                self._error_count += 1
                 continue
 
             if not task.successful():
@@ -203,19 +237,21 @@ class Archiver(object):
                                 self._key,
                                 self._unified_id,
                                 task.node_name))
-                error_count += 1
+                self._error_count += 1
                 continue
 
             if task.value["result"] != "success":
                 self._log.error("request {0}: " \
-                                "({1}) {2} {3} {4} task ends with {5}".format(
+                                "({1}) {2} {3} {4} sequence {5} " \
+                                "task ends with {6}".format(
                                 self._user_request_id,
                                 self._collection_id,
                                 self._key,
                                 self._unified_id,
                                 task.node_name,
+                                task.sequence_num,
                                 task.value["error-message"]))
-                error_count += 1
+                self._error_count += 1
                 continue
 
             self._log.debug("request {0}: " \
@@ -226,10 +262,10 @@ class Archiver(object):
                             self._unified_id,
                             task.node_name))
 
-        if error_count > 0:
+        if self._error_count > 0:
             error_message = \
                 "%s errors %s %s %s" % (
-                    error_count,
+                    self._error_count,
                     self._collection_id,
                     self._key,
                     self._unified_id
@@ -17,7 +17,7 @@ def _segment_properties(segment):
     segment_md5 = hashlib.md5()
     for data_block in segment:
         segment_size += len(data_block)
-        segment_adler32 = zlib.adler32(data_block)
+        segment_adler32 = zlib.adler32(data_block, segment_adler32)
         segment_md5.update(data_block)
 
     return segment_size, segment_adler32, segment_md5
@@ -32,7 +32,6 @@ import sys
 
 from gevent.pywsgi import WSGIServer
 from gevent.event import Event
-import gevent.queue
 from gevent_zeromq import zmq
 import gevent
 
@@ -46,6 +45,7 @@ from tools.deliverator import Deliverator
 from tools.greenlet_push_client import GreenletPUSHClient
 from tools.database_connection import get_central_database_dsn
 from tools.event_push_client import EventPushClient
+from tools.greenlet_cache_invalidator import GreenletCacheInvalidator
 from tools.unified_id_factory import UnifiedIDFactory
 from tools.id_translator import InternalIDTranslator
 from tools.data_definitions import create_timestamp, \
@@ -53,7 +53,8 @@ from tools.data_definitions import create_timestamp, \
         node_row_template
 from tools.interaction_pool_authenticator import \
     InteractionPoolAuthenticator
-from tools.operational_stats_redis_sink import OperationalStatsRedisSink
+from tools.operational_stats_redis_sink import OperationalStatsRedisSink, \
+    OperationalStatsQueue
 
 from web_public_reader.space_accounting_client import SpaceAccountingClient
 
@@ -85,6 +86,7 @@ _memcached_host = os.environ.get("NIMBUSIO_MEMCACHED_HOST", "localhost")
 _memcached_port = int(os.environ.get("NIMBUSIO_MEMCACHED_PORT", "11211"))
 _memcached_nodes = ["{0}:{1}".format(_memcached_host, _memcached_port), ]
 _database_pool_size = 3 
+_central_skeeter_uri = os.environ.get("NIMBUSIO_CENTRAL_SKEETER_URI")
 _central_pool_name = "default"
 
 def _signal_handler_closure(halt_event):
@@ -170,6 +172,17 @@ class WebWriter(object):
 
         self._zeromq_context = zmq.Context()
 
+        # without change events from the central database, lookups are
+        # cached only in memcached
+        self._cache_invalidator = None
+        if _central_skeeter_uri is not None:
+            self._cache_invalidator = GreenletCacheInvalidator(
+                self._zeromq_context, _central_skeeter_uri
+            )
+            self._cache_invalidator.link_exception(
+                self._unhandled_greenlet_exception
+            )
+
         self._pull_server = GreenletPULLServer(
             self._zeromq_context, 
             _web_writer_pipeliner_address,
@@ -241,7 +254,7 @@ class WebWriter(object):
             id_translator_keys["hmac_size"]
         )
 
-        redis_queue = gevent.queue.Queue()
+        redis_queue = OperationalStatsQueue()
 
         self._redis_sink = OperationalStatsRedisSink(halt_event, 
                                                      redis_queue,
@@ -264,6 +277,8 @@ class WebWriter(object):
         )
 
     def start(self):
+        if self._cache_invalidator is not None:
+            self._cache_invalidator.start()
         self._space_accounting_dealer_client.start()
         self._pull_server.start()
         for client in self._data_writer_clients:
@@ -277,12 +292,16 @@ class WebWriter(object):
         self._accounting_client.close()
         self._log.debug("killing greenlets")
         self._space_accounting_dealer_client.kill()
+        if self._cache_invalidator is not None:
+            self._cache_invalidator.kill()
         self._pull_server.kill()
         for client in self._data_writer_clients:
             client.kill()
         self._redis_sink.kill()
         self._log.debug("joining greenlets")
         self._space_accounting_dealer_client.join()
+        if self._cache_invalidator is not None:
+            self._cache_invalidator.join()
         self._pull_server.join()
         for client in self._data_writer_clients:
             client.join()